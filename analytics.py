@@ -0,0 +1,459 @@
+import argparse
+import base64
+import html
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from catalog_io import CATALOG_CACHE_DIR, compact_frame, file_digest, iter_catalog_chunks, read_catalog
+
+# matplotlib нужен только для графиков: расчёты импортируются без него
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+ANALYSIS_COLUMNS = ["Name", "Data", "Date", "Rate", "Votes", "Genre", "Type", "Certificate", "Episodes"]
+MIN_GENRE_TITLES = 5
+TOP_GENRES = 15
+# Границы длины сериала в эпизодах: (-inf, 20], (20, 60], (60, inf)
+SERIES_BINS = [-np.inf, 20, 60, np.inf]
+SERIES_LABELS = ["Короткие (1-20 эп.)", "Средние (21-60 эп.)", "Длинные (60+ эп.)"]
+NOT_SERIES = "Not Series"
+FIGSIZE = (18, 6)
+SCATTER_POINTS = 20_000
+REPORT_FORMATS = ("png", "svg")
+REPORT_DPI = 100
+CACHE_DIR = ".analytics-cache"
+# Растёт при изменении aggregate(): старые файлы кэша перестают совпадать по ключу
+AGGREGATES_VERSION = 1
+
+GENRE_STATS_SQL = """
+    SELECT g.genre, COUNT(*) AS mentions, AVG(c.imdb_rate) AS mean_rate
+    FROM catalog_genres AS g
+    JOIN catalog AS c ON c.id = g.catalog_id
+    WHERE c.imdb_rate IS NOT NULL
+    GROUP BY g.genre
+"""
+
+
+def load_catalog(path: str = "imdb.csv", catalog_cache: Optional[str] = CATALOG_CACHE_DIR) -> pd.DataFrame:
+    if catalog_cache:
+        # Колонки берутся из кэша разобранного CSV (catalog_io.build_catalog_cache), он пересобирается по хэшу файла
+        df = read_catalog(path, catalog_cache, ANALYSIS_COLUMNS)
+        return compact_frame(df.dropna(subset=["Rate"]).reset_index(drop=True), ["Type", "Certificate"])
+    # Без кэша CSV читается чанками: каждый чанк сразу нормализуется и ужимается,
+    # поэтому в памяти не бывает полной сырой копии файла
+    chunks = []
+    for chunk in iter_catalog_chunks(path, usecols=lambda col: col in ANALYSIS_COLUMNS):
+        chunk = chunk.dropna(subset=["Rate"])
+        chunks.append(compact_frame(chunk, ["Type", "Certificate"]))
+    return compact_frame(pd.concat(chunks, ignore_index=True), ["Type", "Certificate"])
+
+
+def explode_genres(genres: pd.Series) -> pd.Series:
+    # Одна строка на пару (позиция, жанр); правила те же, что у catalog_io.split_genres
+    exploded = genres.astype("string").str.split(",").explode().str.strip().replace("Actions", "Action")
+    exploded = exploded[exploded.notna() & (exploded != "")]
+    # Повтор жанра внутри одного тайтла считается один раз
+    return exploded[~exploded.to_frame("genre").set_index("genre", append=True).index.duplicated()]
+
+
+def genre_stats(df: pd.DataFrame) -> pd.DataFrame:
+    # Различных сочетаний жанров в каталоге на порядки меньше, чем строк: строки сводятся к сочетаниям
+    # через factorize и bincount, а explode/groupby идут уже по сочетаниям — одна разреженная
+    # матрица "сочетание x жанр" вместо прохода по всем строкам на каждый жанр
+    codes, combos = pd.factorize(df["Genre"])
+    rates = df["Rate"].to_numpy(dtype="float64")
+    known = codes >= 0
+    rated = known & ~np.isnan(rates)
+    titles = np.bincount(codes[known], minlength=len(combos))
+    rate_sum = np.bincount(codes[rated], weights=rates[rated], minlength=len(combos))
+    rate_count = np.bincount(codes[rated], minlength=len(combos))
+    pairs = explode_genres(pd.Series(combos))
+    combo = pairs.index.to_numpy()
+    stats = (
+        pd.DataFrame(
+            {"genre": pairs.to_numpy(), "mentions": titles[combo], "rate_sum": rate_sum[combo], "rate_count": rate_count[combo]}
+        )
+        .groupby("genre", sort=False)
+        .sum()
+    )
+    stats["mean_rate"] = stats["rate_sum"] / stats["rate_count"].where(stats["rate_count"] > 0)
+    return stats[["mentions", "mean_rate"]].sort_values("mentions", ascending=False)
+
+
+def genre_stats_from_db(path: str = "tracker.db", csv_path: Optional[str] = None) -> Optional[pd.DataFrame]:
+    # Жанры каталога бота уже разложены в catalog_genres: считаем их индексированным соединением.
+    # С csv_path — только если каталог базы загружен целиком из этого же файла (meta catalog_digest),
+    # иначе жанровые графики описывали бы другие данные, чем остальной отчёт
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path)
+    try:
+        if csv_path is not None:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'catalog_digest'").fetchone()
+            if row is None or row[0] != file_digest(csv_path):
+                return None
+        return pd.read_sql_query(GENRE_STATS_SQL, conn).set_index("genre")
+    except (sqlite3.Error, pd.errors.DatabaseError):
+        return None
+    finally:
+        conn.close()
+
+
+def top_genres(stats: pd.DataFrame, limit: int = TOP_GENRES) -> Dict[str, Dict[str, float]]:
+    by_mentions = stats["mentions"].nlargest(limit)
+    rated = stats.loc[stats["mentions"] > MIN_GENRE_TITLES, "mean_rate"]
+    return {"mentions": by_mentions.to_dict(), "rating": rated.nlargest(limit).to_dict()}
+
+
+def series_length(df: pd.DataFrame) -> pd.Series:
+    # pd.cut раскладывает эпизоды по корзинам за один проход; не-сериалы и сериалы без числа эпизодов — NOT_SERIES
+    buckets = pd.cut(df["Episodes"].where(df["Type"] == "Series"), SERIES_BINS, labels=SERIES_LABELS)
+    return buckets.cat.add_categories([NOT_SERIES]).fillna(NOT_SERIES)
+
+
+def summary(df: pd.DataFrame) -> Dict[str, Any]:
+    rates = df["Rate"]
+    return {
+        "rows": len(df),
+        "mean": float(rates.mean()),
+        "median": float(rates.median()),
+        "min": float(rates.min()),
+        "max": float(rates.max()),
+        "types": {str(k): int(v) for k, v in df["Type"].value_counts().items()} if "Type" in df.columns else {},
+    }
+
+
+def aggregate(df: pd.DataFrame, stats: pd.DataFrame) -> Dict[str, Any]:
+    # Всё, что нужно графикам, в компактном виде: их можно кэшировать и передавать в другие процессы
+    rates = df["Rate"].dropna()
+    hist_counts, hist_edges = np.histogram(rates, bins=30)
+    lengths = series_length(df)
+    length_counts = lengths[lengths != NOT_SERIES].value_counts(sort=False)
+    cert_stats = df.groupby("Certificate", observed=True)["Rate"].agg(["mean", "count"]).round(3)
+    cert_stats = cert_stats[cert_stats["count"] > MIN_GENRE_TITLES].sort_values("mean", ascending=False).head(8)
+    agg = {
+        "summary": summary(df),
+        "top_genres": top_genres(stats),
+        "rate_hist": (hist_counts, hist_edges),
+        "types": df["Type"].value_counts(),
+        "series_lengths": length_counts[length_counts > 0],
+        "certificates": df["Certificate"].value_counts().head(10),
+        "certificate_rates": cert_stats["mean"],
+        "top_content": df.nlargest(8, "Rate")[["Name", "Rate", "Type"]].reset_index(drop=True),
+    }
+    if "Votes" in df.columns:
+        votes = np.log10(df["Votes"].fillna(0).astype("float64") + 1)
+        agg["trend"] = np.polyfit(df["Rate"], votes, 1)
+        # Точечный график на миллионе точек ничего не добавляет, кроме времени отрисовки
+        sample = np.random.default_rng(0).permutation(len(df))[:SCATTER_POINTS]
+        agg["scatter"] = (df["Rate"].to_numpy()[sample], votes.to_numpy()[sample])
+    return agg
+
+
+def _figure(fig: Optional["Figure"]) -> "Figure":
+    # Без pyplot: такие фигуры можно строить в потоках и процессах и сохранять без экрана
+    if fig is None:
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=FIGSIZE)
+    return fig
+
+
+def plot_genres(agg: Dict[str, Any], fig: Optional["Figure"] = None) -> "Figure":
+    fig = _figure(fig)
+    axes = fig.subplots(1, 3)
+    top = agg["top_genres"]
+
+    axes[0].barh(list(top["mentions"]), list(top["mentions"].values()), alpha=0.7, color="steelblue")
+    axes[0].set_xlabel("Количество упоминаний")
+    axes[0].set_title(f"Топ-{TOP_GENRES} жанров по упоминаниям", fontweight="bold")
+    axes[0].grid(True, alpha=0.3)
+
+    axes[1].barh(list(top["rating"]), list(top["rating"].values()), alpha=0.7, color="coral")
+    axes[1].set_xlabel("Средний рейтинг IMDB")
+    axes[1].set_title(f"Топ-{TOP_GENRES} жанров по оценкам", fontweight="bold")
+    axes[1].grid(True, alpha=0.3)
+
+    counts, edges = agg["rate_hist"]
+    info = agg["summary"]
+    axes[2].hist(edges[:-1], bins=edges, weights=counts, edgecolor="black", alpha=0.7, color="skyblue")
+    axes[2].axvline(info["mean"], color="red", linestyle="--", linewidth=2, label=f"Среднее: {info['mean']:.2f}")
+    axes[2].axvline(info["median"], color="green", linestyle="--", linewidth=2, label=f"Медиана: {info['median']:.2f}")
+    axes[2].set_xlabel("Рейтинг IMDB (1-10)")
+    axes[2].set_ylabel("Количество")
+    axes[2].set_title("Распределение рейтингов", fontweight="bold")
+    axes[2].legend()
+    axes[2].grid(True, alpha=0.3)
+
+    fig.suptitle("АНАЛИЗ ЖАНРОВ И РЕЙТИНГОВ", fontsize=14, fontweight="bold")
+    fig.tight_layout()
+    return fig
+
+
+def plot_content_types(agg: Dict[str, Any], fig: Optional["Figure"] = None) -> "Figure":
+    fig = _figure(fig)
+    axes = fig.subplots(1, 3)
+
+    type_counts = agg["types"]
+    colors = ["#ff6b6b", "#4ecdc4"] if len(type_counts) == 2 else None
+    axes[0].pie(type_counts.values, labels=type_counts.index, autopct="%1.1f%%", startangle=90, colors=colors)
+    axes[0].set_title("Соотношение фильмов и сериалов", fontweight="bold")
+
+    length_counts = agg["series_lengths"]
+    if len(length_counts) > 0:
+        axes[1].pie(
+            length_counts.values,
+            labels=length_counts.index,
+            autopct="%1.1f%%",
+            startangle=90,
+            colors=["#FFD700", "#FFA500", "#8B0000"][: len(length_counts)],
+            textprops={"fontsize": 10},
+        )
+        axes[1].set_title("Сериалы по длительности", fontweight="bold")
+    else:
+        axes[1].text(0.5, 0.5, "Сериалы не найдены", ha="center", va="center", fontsize=12)
+        axes[1].set_title("Сериалы по длительности")
+
+    cert_counts = agg["certificates"].sort_values(ascending=True)
+    colors = ["lightgreen", "green", "yellow", "orange", "red", "darkred", "black", "purple", "blue", "cyan"]
+    axes[2].barh(cert_counts.index.astype(str), cert_counts.values, alpha=0.7, color=colors[: len(cert_counts)])
+    axes[2].set_xlabel("Количество записей")
+    axes[2].set_title("Топ возрастных рейтингов", fontweight="bold")
+    axes[2].grid(True, alpha=0.3)
+
+    fig.suptitle("АНАЛИЗ ТИПОВ КОНТЕНТА", fontsize=14, fontweight="bold")
+    fig.tight_layout()
+    return fig
+
+
+def plot_extra(agg: Dict[str, Any], fig: Optional["Figure"] = None) -> "Figure":
+    fig = _figure(fig)
+    axes = fig.subplots(1, 3)
+
+    if "scatter" in agg:
+        rates, votes = agg["scatter"]
+        axes[0].scatter(rates, votes, alpha=0.5, s=20, c="purple")
+        axes[0].set_xlabel("Рейтинг IMDB")
+        axes[0].set_ylabel("log10(Количество голосов + 1)")
+        axes[0].set_title("Рейтинг vs Популярность", fontweight="bold")
+        axes[0].grid(True, alpha=0.3)
+        xs = np.sort(rates)
+        axes[0].plot(xs, np.poly1d(agg["trend"])(xs), "r--", alpha=0.8, linewidth=2)
+
+    top_content = agg["top_content"]
+    names = top_content["Name"].astype(str).tolist()
+    y_pos = np.arange(len(names))
+    types = top_content["Type"].tolist()
+    axes[1].barh(
+        y_pos, top_content["Rate"], alpha=0.7, color=["#ff6b6b" if t == "Film" else "#4ecdc4" for t in types]
+    )
+    axes[1].set_yticks(y_pos)
+    axes[1].set_yticklabels([name[:20] + "..." if len(name) > 20 else name for name in names], fontsize=9)
+    axes[1].set_xlabel("Рейтинг IMDB")
+    axes[1].set_title("Топ контента по рейтингу", fontweight="bold")
+    axes[1].grid(True, alpha=0.3)
+    for i, (rating, type_name) in enumerate(zip(top_content["Rate"], types)):
+        axes[1].text(rating + 0.02, i, type_name, va="center", fontsize=9, color="black", fontweight="bold")
+
+    cert_rates = agg["certificate_rates"]
+    if len(cert_rates) > 0:
+        colors = ["green", "lightgreen", "yellow", "orange", "red", "darkred", "brown", "black"]
+        bars = axes[2].bar(cert_rates.index.astype(str), cert_rates.values, alpha=0.7, color=colors[: len(cert_rates)])
+        axes[2].set_xlabel("Возрастной рейтинг")
+        axes[2].set_ylabel("Средний рейтинг IMDB")
+        axes[2].set_title("Возрастные рейтинги по оценкам", fontweight="bold")
+        axes[2].tick_params(axis="x", rotation=45)
+        axes[2].grid(True, alpha=0.3)
+        for bar, rating in zip(bars, cert_rates.values):
+            axes[2].text(
+                bar.get_x() + bar.get_width() / 2.0, bar.get_height() + 0.05, f"{rating:.2f}", ha="center", va="bottom", fontsize=9
+            )
+
+    fig.suptitle("ДОПОЛНИТЕЛЬНЫЙ АНАЛИЗ", fontsize=14, fontweight="bold")
+    fig.tight_layout()
+    return fig
+
+
+# Панели отчёта в порядке показа: имя файла -> функция отрисовки
+PANELS: Dict[str, Callable[..., "Figure"]] = {
+    "genres": plot_genres,
+    "content_types": plot_content_types,
+    "extra": plot_extra,
+}
+
+
+def build_figures(agg: Dict[str, Any], figures: Optional[List["Figure"]] = None) -> List["Figure"]:
+    figures = figures or [None] * len(PANELS)
+    return [plot(agg, fig) for plot, fig in zip(PANELS.values(), figures)]
+
+
+def cached_aggregates(
+    csv_path: str, cache_dir: Optional[str] = CACHE_DIR, catalog_cache: Optional[str] = CATALOG_CACHE_DIR
+) -> Tuple[Dict[str, Any], bool]:
+    # Ключ — содержимое CSV и версия расчёта: неизменённый файл не пересчитывается между запусками
+    path = None
+    if cache_dir:
+        key = f"{file_digest(csv_path)[:32]}-v{AGGREGATES_VERSION}"
+        path = os.path.join(cache_dir, f"aggregates-{key}.pkl")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return pickle.load(f), True
+    df = load_catalog(csv_path, catalog_cache)
+    agg = aggregate(df, genre_stats(df))
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Запись через временный файл: параллельный запуск не прочитает недописанный кэш
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(agg, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    return agg, False
+
+
+def render_panel(name: str, agg: Dict[str, Any], out_dir: str, formats: Sequence[str]) -> List[str]:
+    # Выполняется в процессе пула: backend Agg, без экрана и без pyplot
+    import matplotlib
+
+    matplotlib.use("Agg")
+    fig = PANELS[name](agg)
+    paths = []
+    for fmt in formats:
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        fig.savefig(path, dpi=REPORT_DPI)
+        paths.append(path)
+    return paths
+
+
+def render_panels(
+    agg: Dict[str, Any], out_dir: str, formats: Sequence[str] = REPORT_FORMATS, workers: int = 0
+) -> Dict[str, List[str]]:
+    # Панели независимы, поэтому рисуются параллельно; workers=0 — по панели на ядро
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or min(len(PANELS), os.cpu_count() or 1)
+    if workers == 1:
+        return {name: render_panel(name, agg, out_dir, formats) for name in PANELS}
+    # matplotlib загружается до запуска пула, чтобы процессы не импортировали его каждый заново
+    import matplotlib
+    import matplotlib.figure
+
+    matplotlib.use("Agg")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(render_panel, name, agg, out_dir, formats) for name in PANELS}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def write_html(path: str, agg: Dict[str, Any], files: Dict[str, List[str]], source: str) -> None:
+    # Один самодостаточный файл: PNG встроены как data URI, SVG лежат рядом для печати
+    info = agg["summary"]
+    rows = [
+        ("Всего записей", f"{info['rows']:,}"),
+        ("Средний рейтинг", f"{info['mean']:.2f}"),
+        ("Медианный рейтинг", f"{info['median']:.2f}"),
+        ("Минимальный рейтинг", f"{info['min']:.2f}"),
+        ("Максимальный рейтинг", f"{info['max']:.2f}"),
+    ] + [(name, f"{count} ({count / info['rows'] * 100:.1f}%)") for name, count in info["types"].items()]
+    parts = [
+        "<!DOCTYPE html>",
+        '<html lang="ru"><head><meta charset="utf-8"><title>Анализ каталога</title></head><body>',
+        f"<h1>Анализ каталога</h1><p>Источник: {html.escape(source)}</p>",
+        "<table>" + "".join(f"<tr><th>{html.escape(k)}</th><td>{html.escape(v)}</td></tr>" for k, v in rows) + "</table>",
+    ]
+    for name, paths in files.items():
+        png = next((p for p in paths if p.endswith(".png")), None)
+        svg = next((p for p in paths if p.endswith(".svg")), None)
+        if png:
+            with open(png, "rb") as f:
+                data = base64.b64encode(f.read()).decode("ascii")
+            parts.append(f'<p><img alt="{name}" src="data:image/png;base64,{data}" style="max-width:100%"></p>')
+        elif svg:
+            parts.append(f'<p><img alt="{name}" src="{html.escape(os.path.basename(svg))}" style="max-width:100%"></p>')
+    parts.append("</body></html>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(parts))
+
+
+def build_report(
+    csv_path: str,
+    out_dir: str,
+    formats: Sequence[str] = REPORT_FORMATS,
+    workers: int = 0,
+    cache_dir: Optional[str] = CACHE_DIR,
+    catalog_cache: Optional[str] = CATALOG_CACHE_DIR,
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    agg, cache_hit = cached_aggregates(csv_path, cache_dir, catalog_cache)
+    aggregated = time.perf_counter()
+    files = render_panels(agg, out_dir, formats, workers)
+    rendered = time.perf_counter()
+    report = os.path.join(out_dir, "report.html")
+    write_html(report, agg, files, os.path.basename(csv_path))
+    return {
+        "report": report,
+        "files": files,
+        "cache_hit": cache_hit,
+        "aggregate_s": aggregated - start,
+        "render_s": rendered - aggregated,
+    }
+
+
+def print_summary(info: Dict[str, Any]) -> None:
+    print(f"Всего записей: {info['rows']:,}")
+    print(f"Средний рейтинг: {info['mean']:.2f}")
+    print(f"Медианный рейтинг: {info['median']:.2f}")
+    print(f"Минимальный рейтинг: {info['min']:.2f}")
+    print(f"Максимальный рейтинг: {info['max']:.2f}")
+    for type_name, count in info["types"].items():
+        print(f"{type_name}: {count} ({count / info['rows'] * 100:.1f}%)")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Анализ каталога: жанры, рейтинги, типы контента")
+    parser.add_argument("--csv", default="imdb.csv")
+    parser.add_argument("--db", default="tracker.db", help="база бота: жанры из catalog_genres, если её каталог загружен из этого же --csv")
+    parser.add_argument("--save", help="сохранить графики PNG в каталог вместо показа на экране")
+    parser.add_argument("--report", help="без экрана: панели PNG/SVG и report.html в этот каталог")
+    parser.add_argument("--formats", default=",".join(REPORT_FORMATS), help="форматы панелей отчёта через запятую")
+    parser.add_argument("--workers", type=int, default=0, help="процессов отрисовки, 0 — по панели на ядро")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="кэш агрегатов по хэшу CSV, '' — без кэша")
+    parser.add_argument("--catalog-cache", default=CATALOG_CACHE_DIR, help="кэш разобранного CSV (.npy), '' — без кэша")
+    args = parser.parse_args(argv)
+
+    if args.report:
+        # Ночной прогон: жанры считаются по самому CSV, чтобы ключ кэша описывал все входные данные
+        result = build_report(
+            args.csv, args.report, args.formats.split(","), args.workers, args.cache_dir or None, args.catalog_cache or None
+        )
+        print(
+            f"{result['report']}: агрегаты {result['aggregate_s']:.2f} c "
+            f"({'из кэша' if result['cache_hit'] else 'посчитаны'}), отрисовка {result['render_s']:.2f} c"
+        )
+        return
+
+    df = load_catalog(args.csv, args.catalog_cache or None)
+    stats = genre_stats_from_db(args.db, args.csv)
+    if stats is None or len(stats) == 0:
+        stats = genre_stats(df)
+    agg = aggregate(df, stats)
+
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+        for i, fig in enumerate(build_figures(agg), 1):
+            fig.savefig(os.path.join(args.save, f"analysis_{i}.png"), dpi=REPORT_DPI)
+    else:
+        import matplotlib.pyplot as plt
+
+        build_figures(agg, [plt.figure(figsize=FIGSIZE) for _ in PANELS])
+        plt.show()
+    print_summary(agg["summary"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1392 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import bot
+from metrics import metrics, start_http_server, stop_http_server
+from user_report import render_user_report
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def setup_db(path: str, users: int, views_per_user: int) -> None:
+    bot.DB_PATH = path
+    bot.init_db()
+    rnd = random.Random(42)
+    genres = ["Drama", "Comedy", "Action", "Thriller", "Horror", "Crime"]
+    conn = bot.get_conn()
+    conn.executemany(
+        """
+        INSERT INTO views (user_id, name, type, genre, certificate, imdb_rate, user_rate, view_date, duration_minutes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                u,
+                f"Title {rnd.randint(1, 5000)}",
+                rnd.choice(["Film", "Series"]),
+                rnd.choice(genres),
+                "PG-13",
+                round(rnd.uniform(4, 9), 1),
+                rnd.randint(1, 10),
+                f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                rnd.randint(30, 180),
+            )
+            for u in range(users)
+            for _ in range(views_per_user)
+        ],
+    )
+    cur = conn.cursor()
+    cur.execute("SELECT id, user_id, genre, view_date FROM views")
+    bot.write_view_genres(cur, cur.fetchall())
+    conn.commit()
+    bot.rebuild_user_stats()
+
+
+async def run_load(users: int, rounds: int, mode: str):
+    latencies = {"add": [], "stats": []}
+    lag = []
+    stop = asyncio.Event()
+
+    async def heartbeat():
+        # Задержка цикла событий: сколько тик ждал своей очереди
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag.append(time.perf_counter() - start - 0.001)
+
+    async def call(kind, func, *args):
+        start = time.perf_counter()
+        if mode == "queue" and kind == "add":
+            await bot.queue_view(*args)
+        elif mode != "inline":
+            runner = bot.db_write if kind == "add" else bot.db_read
+            await runner(func, *args)
+        else:
+            func(*args)
+            await asyncio.sleep(0)
+        latencies[kind].append(time.perf_counter() - start)
+
+    async def user(uid):
+        for i in range(rounds):
+            view = {
+                "name": f"Load {uid}-{i}",
+                "type": "Film",
+                "genre": "Drama",
+                "certificate": "R",
+                "imdb_rate": 7.0,
+                "user_rate": 8,
+                "view_date": "2024-06-01",
+                "duration_minutes": 120,
+            }
+            await call("add", bot.insert_view, uid, view)
+            await call("stats", bot.stats, uid)
+
+    hb = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(user(uid) for uid in range(users)))
+    elapsed = time.perf_counter() - start
+    await bot.write_queue.close()
+    stop.set()
+    await hb
+    return elapsed, latencies, lag
+
+
+def cmd_load(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_db(os.path.join(tmp, "load.db"), args.users, args.views)
+        modes = {"inline": "в цикле событий", "pool": "пул потоков", "queue": "групповая фиксация"}
+        for mode, label in modes.items():
+            elapsed, latencies, lag = asyncio.run(run_load(args.users, args.rounds, mode))
+            ops = sum(len(v) for v in latencies.values())
+            print(f"[{label}] {ops} операций за {elapsed:.2f} c ({ops / elapsed:.0f} оп/с)")
+            for kind, values in latencies.items():
+                print(
+                    f"  {kind}: p50 {percentile(values, 50) * 1000:.2f} мс, "
+                    f"p99 {percentile(values, 99) * 1000:.2f} мс"
+                )
+            print(
+                f"  задержка цикла: средн. {statistics.mean(lag) * 1000:.2f} мс, "
+                f"макс. {max(lag) * 1000:.2f} мс"
+            )
+        counters = bot.db.counters()
+        print(
+            f"соединений открыто: {counters['connections_opened']}, "
+            f"запросов выполнено: {counters['statements_executed']}, "
+            f"групповых транзакций: {bot.write_queue.batches} на {bot.write_queue.rows} записей"
+        )
+        mismatched = bot.check_user_stats()
+        if mismatched:
+            raise SystemExit(f"user_stats расходится с views: {mismatched}")
+        bot.shutdown_db()
+
+
+# Горячие запросы; планы проверяет tests/test_query_plans.py
+def hot_queries(user_id: int):
+    return [
+        ("find_in_catalog", bot.find_in_catalog, ("Title 1",)),
+        ("get_last_views", bot.get_last_views, (user_id,)),
+        ("stats", bot.stats, (user_id,)),
+        ("recommendations", bot.recommendations, (user_id,)),
+        ("progress", bot.progress, (user_id,)),
+        ("user_report_data", bot.user_report_data, (user_id,)),
+        ("history_page", bot.history_page, (user_id, ("2024-06-01", 10**9))),
+        ("history_page genre", lambda *a: bot.history_page(*a, genre="Drama", date_from="2024-03-01"), (user_id, None)),
+    ]
+
+
+LIKE_FUZZY_SQL = """
+    SELECT name, type, genre, certificate, imdb_rate
+    FROM catalog
+    WHERE name LIKE ?
+    ORDER BY imdb_rate DESC NULLS LAST
+    LIMIT ?
+"""
+SEARCH_QUERIES = ["Venom", "Venon", "carnage venom", "game of throns", "dune", "the office", "Squid"]
+
+
+def multiply_catalog(factor: int) -> None:
+    # Синтетический каталог: копии реальных названий с номером части
+    conn = bot.get_conn()
+    rows = conn.execute(
+        "SELECT name, type, genre, certificate, imdb_rate, votes, episodes FROM catalog"
+    ).fetchall()
+    conn.executemany(
+        """
+        INSERT INTO catalog (name, name_norm, type, genre, certificate, imdb_rate, votes, episodes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (f"{r[0]} {k}", bot.normalize_title(f"{r[0]} {k}"), *r[1:])
+            for k in range(2, factor + 1)
+            for r in rows
+        ),
+    )
+    conn.commit()
+    bot.reset_title_index()
+    bot.reset_catalog_snapshot()
+
+
+def time_calls(func, queries, repeat):
+    timings = []
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            func(q)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def cmd_search(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, "search.db")
+        bot.CATALOG_CSV = args.csv
+        bot.init_db()
+        bot.load_catalog_if_empty()
+        for factor in (1, args.factor):
+            if factor > 1:
+                multiply_catalog(factor)
+            conn = bot.get_conn()
+            size = conn.execute("SELECT COUNT(*) FROM catalog").fetchone()[0]
+            start = time.perf_counter()
+            bot.title_index()
+            build = time.perf_counter() - start
+            like = time_calls(
+                lambda q: conn.execute(LIKE_FUZZY_SQL, (f"%{q}%", 5)).fetchall(), SEARCH_QUERIES, args.repeat
+            )
+            index = time_calls(bot.fuzzy_catalog, SEARCH_QUERIES, args.repeat)
+            print(f"каталог {size} строк, построение индекса {build * 1000:.0f} мс")
+            for label, values in (("LIKE", like), ("триграммы", index)):
+                print(
+                    f"  {label}: p50 {percentile(values, 50) * 1000:.3f} мс, "
+                    f"p99 {percentile(values, 99) * 1000:.3f} мс"
+                )
+        bot.shutdown_db()
+
+
+SQL_FIND = "SELECT name, type, genre, certificate, imdb_rate FROM catalog WHERE name_norm = ? LIMIT 1"
+SQL_BY_IDS = "SELECT id, name, type, genre, certificate, imdb_rate FROM catalog WHERE id IN (?, ?, ?, ?, ?)"
+
+
+def sql_find(conn, name_norm):
+    # Прежний путь find_in_catalog: запрос к SQLite и новый словарь на каждую строку
+    row = conn.execute(SQL_FIND, (name_norm,)).fetchone()
+    return dict(zip(("name", "type", "genre", "certificate", "imdb_rate"), row)) if row else None
+
+
+def sql_by_ids(conn, ids):
+    # Прежний _catalog_rows_by_id: SELECT ... WHERE id IN и словари в порядке ids
+    by_id = {
+        r[0]: dict(zip(("name", "type", "genre", "certificate", "imdb_rate"), r[1:]))
+        for r in conn.execute(SQL_BY_IDS, ids).fetchall()
+    }
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def cmd_snapshot(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DB_PATH = os.path.join(tmp, "snapshot.db")
+        bot.CATALOG_CSV = args.csv
+        bot.init_db()
+        bot.load_catalog_if_empty()
+        for factor in (1, args.factor):
+            if factor > 1:
+                multiply_catalog(factor)
+            conn = bot.get_conn()
+            rows = conn.execute("SELECT id, name_norm FROM catalog").fetchall()
+            rnd = random.Random(42)
+            sample = [rnd.choice(rows) for _ in range(200)]
+            names = [r[1] for r in sample]
+            id_groups = [[rnd.choice(rows)[0] for _ in range(5)] for _ in range(200)]
+
+            start = time.perf_counter()
+            snapshot = bot.catalog_snapshot()
+            build = time.perf_counter() - start
+            # Память — отдельной сборкой: под tracemalloc построение идёт в разы медленнее
+            bot.reset_catalog_snapshot()
+            tracemalloc.start()
+            bot.catalog_snapshot()
+            allocated = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            # Снимок должен отдавать то же, что и SQLite
+            for name in names:
+                expected = sql_find(conn, name)
+                record = snapshot.find(name)
+                got = {key: record[key] for key in expected} if record else None
+                if got != expected:
+                    raise SystemExit(f"расхождение для {name!r}: {got} != {expected}")
+
+            timings = {
+                "find: SQLite": time_calls(lambda n: sql_find(conn, n), names, args.repeat),
+                "find: снимок": time_calls(snapshot.find, names, args.repeat),
+                "5 id: SQLite": time_calls(lambda ids: sql_by_ids(conn, ids), id_groups, args.repeat),
+                "5 id: снимок": time_calls(snapshot.records, id_groups, args.repeat),
+            }
+            print(
+                f"каталог {len(rows)} строк: снимок за {build * 1000:.0f} мс, "
+                f"{snapshot.nbytes() / 2**20:.1f} МБ (пик выделения {allocated / 2**20:.1f} МБ)"
+            )
+            for label, values in timings.items():
+                print(
+                    f"  {label}: p50 {percentile(values, 50) * 1e6:.1f} мкс, "
+                    f"p99 {percentile(values, 99) * 1e6:.1f} мкс"
+                )
+        bot.shutdown_db()
+
+
+def cmd_recommend(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_db(os.path.join(tmp, "recommend.db"), 50, 200)
+        bot.CATALOG_CSV = args.csv
+        bot.load_catalog_if_empty()
+        for factor in (1, args.factor):
+            if factor > 1:
+                multiply_catalog(factor)
+                bot.reset_catalog_vectors()
+            start = time.perf_counter()
+            vectors = bot.catalog_vectors()
+            build = time.perf_counter() - start
+            # Мимо кэша: меряем само ранжирование
+            timings = time_calls(lambda uid: bot._rank_candidates(uid, 5), range(50), args.repeat)
+            print(
+                f"каталог {len(vectors)} тайтлов, векторизация {build * 1000:.0f} мс, "
+                f"p50 {percentile(timings, 50) * 1000:.2f} мс, p99 {percentile(timings, 99) * 1000:.2f} мс"
+            )
+        bot.shutdown_db()
+
+
+WORDS = (
+    "night day dark light last first lost city king queen house game road star war love dead blood "
+    "secret story time world man woman girl boy family storm fire ice river sea mountain wolf dragon "
+    "ghost shadow heart dream summer winter black white red golden silent broken wild little big "
+    "return rise fall legend empire island planet machine code escape hunt"
+).split()
+SYNTHETIC_GENRES = [
+    "Action", "Adventure", "Animation", "Biography", "Comedy", "Crime", "Drama", "Family", "Fantasy",
+    "History", "Horror", "Music", "Mystery", "Romance", "Sci-Fi", "Sport", "Thriller", "War", "Western",
+]
+SYNTHETIC_CERTIFICATES = ["G", "PG", "PG-13", "R", "TV-14", "TV-MA", "TV-PG", "Not Rated"]
+ADVISORY_VALUES = ["None", "Mild", "Moderate", "Severe", "No Rate"]
+CSV_HEADER = [
+    "Name", "Date", "Rate", "Votes", "Genre", "Duration", "Type", "Certificate", "Episodes",
+    "Nudity", "Violence", "Profanity", "Alcohol", "Frightening",
+]
+
+
+def write_synthetic_catalog(path: str, titles: int, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    names = []
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for i in range(titles):
+            name = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 4))).title()
+            if rnd.random() < 0.5:
+                name = f"{name} {i}"
+            names.append(name)
+            is_series = rnd.random() < 0.3
+            writer.writerow(
+                [
+                    name,
+                    rnd.randint(1950, 2024),
+                    f"{rnd.uniform(2, 9.6):.1f}" if rnd.random() > 0.03 else "No Rate",
+                    f"{int(rnd.paretovariate(1.2) * 300):,}",
+                    ", ".join(rnd.sample(SYNTHETIC_GENRES, rnd.randint(1, 3))),
+                    rnd.randint(20, 60) if is_series else rnd.randint(80, 180),
+                    "Series" if is_series else "Film",
+                    rnd.choice(SYNTHETIC_CERTIFICATES),
+                    rnd.randint(1, 300) if is_series else "-",
+                ]
+                + [rnd.choice(ADVISORY_VALUES) for _ in range(5)]
+            )
+    return names
+
+
+def generate_views(names: list, users: int, views: int, seed: int = 42, batch: int = 50_000) -> None:
+    rnd = random.Random(seed)
+    conn = bot.get_conn()
+    cur = conn.cursor()
+
+    def rows():
+        for _ in range(views):
+            # Немногие активные пользователи дают большую часть истории, как в живом дневнике
+            user = min(int(rnd.paretovariate(1.1)) - 1, users - 1)
+            yield (
+                user,
+                rnd.choice(names),
+                rnd.choice(["Film", "Series"]),
+                ", ".join(rnd.sample(SYNTHETIC_GENRES, rnd.randint(1, 3))),
+                rnd.choice(SYNTHETIC_CERTIFICATES),
+                round(rnd.uniform(2, 9.6), 1),
+                rnd.randint(1, 10),
+                f"{rnd.randint(2020, 2026)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                rnd.randint(20, 180),
+            )
+
+    cur.executemany(
+        """
+        INSERT INTO views (user_id, name, type, genre, certificate, imdb_rate, user_rate, view_date, duration_minutes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows(),
+    )
+    conn.commit()
+    reader = conn.cursor()
+    reader.execute("SELECT id, user_id, genre, view_date FROM views")
+    while True:
+        chunk = reader.fetchmany(batch)
+        if not chunk:
+            break
+        bot.write_view_genres(cur, chunk)
+    conn.commit()
+    bot.rebuild_user_stats()
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(name: str, func, make_args, iterations: int, alloc_iterations: int = 20) -> dict:
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        args = make_args()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    wall = time.perf_counter() - started
+    # Пик памяти меряем отдельным коротким прогоном: tracemalloc сам по себе замедляет вызовы
+    tracemalloc.start()
+    for _ in range(min(alloc_iterations, iterations)):
+        func(*make_args())
+    peak_alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {
+        "iterations": iterations,
+        "p50_ms": round(percentile(timings, 50) * 1000, 4),
+        "p99_ms": round(percentile(timings, 99) * 1000, 4),
+        "ops_per_s": round(iterations / wall, 1) if wall else 0.0,
+        "peak_alloc_kb": round(peak_alloc / 1024, 1),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+    print(
+        f"{name:>22}: p50 {result['p50_ms']:9.3f} мс  p99 {result['p99_ms']:9.3f} мс  "
+        f"{result['ops_per_s']:10.1f} оп/с  alloc {result['peak_alloc_kb']:9.1f} КБ  rss {result['peak_rss_kb']} КБ"
+    )
+    return result
+
+
+def run_suite(args) -> dict:
+    rnd = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "catalog.csv")
+        start = time.perf_counter()
+        names = write_synthetic_catalog(csv_path, args.titles, args.seed)
+        print(f"каталог: {args.titles} тайтлов сгенерирован за {time.perf_counter() - start:.1f} c")
+
+        bot.DB_PATH = os.path.join(tmp, "suite.db")
+        bot.CATALOG_CSV = csv_path
+        bot.init_db()
+        results["load_catalog_if_empty"] = measure("load_catalog_if_empty", bot.load_catalog_if_empty, tuple, 1, 0)
+        results["catalog_snapshot_build"] = measure("catalog_snapshot_build", bot.catalog_snapshot, tuple, 1, 0)
+        results["title_index_build"] = measure("title_index_build", bot.title_index, tuple, 1, 0)
+        results["catalog_vectors_build"] = measure("catalog_vectors_build", bot.catalog_vectors, tuple, 1, 0)
+
+        start = time.perf_counter()
+        generate_views(names, args.users, args.views, args.seed)
+        print(f"история: {args.views} просмотров у {args.users} пользователей за {time.perf_counter() - start:.1f} c")
+
+        def user():
+            return (min(int(rnd.paretovariate(1.1)) - 1, args.users - 1),)
+
+        def typo(name):
+            pos = rnd.randrange(len(name))
+            return name[:pos] + rnd.choice("aeiou") + name[pos + 1 :]
+
+        def view():
+            name = rnd.choice(names)
+            return user() + (
+                {
+                    "name": name,
+                    "type": "Film",
+                    "genre": ", ".join(rnd.sample(SYNTHETIC_GENRES, 2)),
+                    "certificate": "PG-13",
+                    "imdb_rate": 7.0,
+                    "user_rate": rnd.randint(1, 10),
+                    "view_date": f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                    "duration_minutes": 100,
+                },
+            )
+
+        def uncached_recommendations(user_id):
+            bot._recommendation_cache.invalidate(user_id)
+            return bot.recommendations(user_id)
+
+        n = args.iterations
+        results["find_in_catalog"] = measure("find_in_catalog", bot.find_in_catalog, lambda: (rnd.choice(names),), n)
+        results["fuzzy_catalog"] = measure("fuzzy_catalog", bot.fuzzy_catalog, lambda: (typo(rnd.choice(names)),), n)
+        popular = names[:100]
+        results["resolve_title_cached"] = measure("resolve_title_cached", bot.resolve_title, lambda: (rnd.choice(popular),), n)
+        results["insert_view"] = measure("insert_view", bot.insert_view, view, n)
+        results["get_last_views"] = measure("get_last_views", bot.get_last_views, user, n)
+        results["stats"] = measure("stats", bot.stats, user, n)
+        results["recommendations"] = measure("recommendations", uncached_recommendations, user, n)
+        results["recommendations_cached"] = measure("recommendations_cached", bot.recommendations, lambda: (0,), n)
+        results["progress"] = measure("progress", bot.progress, user, n)
+        bot.shutdown_db()
+    return {
+        "meta": {
+            "titles": args.titles,
+            "views": args.views,
+            "users": args.users,
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def compare_results(current: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    if current["meta"]["titles"] != baseline["meta"]["titles"] or current["meta"]["views"] != baseline["meta"]["views"]:
+        print("внимание: размеры данных базовой линии отличаются от текущего прогона")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            # Хвост распределения шумнее медианы, поэтому для p99 допуск вдвое больше
+            limit = tolerance if metric == "p50_ms" else tolerance * 2
+            if base[metric] and result[metric] > base[metric] * (1 + limit):
+                regressions.append(name)
+                print(f"РЕГРЕССИЯ {name}.{metric}: {base[metric]:.3f} -> {result[metric]:.3f} мс")
+    return regressions
+
+
+def cmd_suite(args) -> None:
+    report = run_suite(args)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"результаты сохранены в {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare_results(report, baseline, args.tolerance):
+            raise SystemExit(1)
+        print("регрессий нет")
+
+
+class StubBotAPI(BaseRequest):
+    # Локальная замена Bot API: отвечает на getMe, send* и getFile, ничего не отправляя в сеть.
+    # Содержимое "загруженных" документов лежит в files по file_id
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls = 0
+        self.last_text = {}
+        self.files = {}
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None
+    ):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "/file/bot" in url:
+            return 200, self.files[endpoint]
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+        elif endpoint.startswith("send"):
+            self._message_id += 1
+            chat_id = int(params["chat_id"])
+            self.last_text[chat_id] = params.get("text", params.get("caption", ""))
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        elif endpoint == "getFile":
+            file_id = params["file_id"]
+            result = {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self.files[file_id]),
+                "file_path": f"documents/{file_id}",
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class FeedProcessor(bot.UserUpdateProcessor):
+    # Тот же процессор апдейтов, что у бота, плюс отметка о завершении каждого апдейта
+    def __init__(self, max_concurrent_updates: int) -> None:
+        super().__init__(max_concurrent_updates)
+        self.done = {}
+
+    async def do_process_update(self, update, coroutine) -> None:
+        try:
+            await super().do_process_update(update, coroutine)
+        finally:
+            future = self.done.pop(update.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+
+class UpdateFeed:
+    # Апдейты кладутся в application.update_queue и проходят через Application.update_processor, как при
+    # run_polling: с тем же пределом параллельности и очередью апдейтов одного пользователя
+    def __init__(self, request: BaseRequest, max_concurrent_updates: int = bot.CONCURRENT_UPDATES) -> None:
+        self.processor = FeedProcessor(max_concurrent_updates)
+        self.application = bot.build_application("123456:REPLAY", request=request, update_processor=self.processor)
+        self._update_id = 0
+
+    async def __aenter__(self) -> "UpdateFeed":
+        await self.application.initialize()
+        await self.application.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.application.stop()
+        await bot.write_queue.close()
+        await self.application.shutdown()
+
+    def put(self, uid: int, text: str = "", **content) -> asyncio.Future:
+        # Апдейт сразу уходит в очередь; future завершится, когда бот его обработает
+        self._update_id += 1
+        message = {
+            "message_id": self._update_id,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": f"user{uid}"},
+            **content,
+        }
+        if text:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        future = asyncio.get_running_loop().create_future()
+        self.processor.done[self._update_id] = future
+        update = Update.de_json({"update_id": self._update_id, "message": message}, self.application.bot)
+        self.application.update_queue.put_nowait(update)
+        return future
+
+    async def send(self, uid: int, text: str = "", **content) -> None:
+        await self.put(uid, text, **content)
+
+
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+def print_histogram(name: str, values: list) -> None:
+    values_ms = [v * 1000 for v in values]
+    print(
+        f"{name:>16}: n={len(values_ms)} p50 {percentile(values_ms, 50):.2f} мс, p90 {percentile(values_ms, 90):.2f} мс, "
+        f"p99 {percentile(values_ms, 99):.2f} мс, max {max(values_ms, default=0):.2f} мс"
+    )
+    lower = 0
+    for upper in LATENCY_BUCKETS_MS + [float("inf")]:
+        count = sum(1 for v in values_ms if lower <= v < upper)
+        if count:
+            label = f"{lower}-{upper} мс" if upper != float("inf") else f">= {lower} мс"
+            bar = "#" * max(1, round(40 * count / len(values_ms)))
+            print(f"{label:>20} {count:8d} {bar}")
+        lower = upper
+
+
+async def run_replay(users: int, rounds: int, names: list, api_latency: float, seed: int):
+    rnd = random.Random(seed)
+    stub = StubBotAPI(api_latency)
+    latencies = {}
+
+    async with UpdateFeed(stub) as feed:
+
+        async def send(uid: int, step: str, text: str) -> str:
+            # Задержка — от постановки в очередь апдейтов до конца обработки, включая ожидание процессора
+            start = time.perf_counter()
+            await feed.send(uid, text)
+            latencies.setdefault(step, []).append(time.perf_counter() - start)
+            return stub.last_text.get(uid, "")
+
+        async def user(uid: int):
+            for i in range(rounds):
+                await send(uid, "add_start", "/add")
+                if rnd.random() < 0.8:
+                    reply = await send(uid, "add_title", rnd.choice(names))
+                else:
+                    reply = await send(uid, "add_title", f"Replay Title {uid} {i}")
+                # Сценарий подстраивается под ответ бота, как это сделал бы живой пользователь
+                if reply.startswith("Не нашёл точного"):
+                    reply = await send(uid, "add_title_choice", "1" if rnd.random() < 0.5 else "новый")
+                if reply.startswith("Напиши жанр") or reply.startswith("В каталоге нет"):
+                    await send(uid, "add_new_details", "Drama, Film, PG-13")
+                    await send(uid, "add_new_rating", str(rnd.randint(1, 10)))
+                else:
+                    await send(uid, "add_rating", str(rnd.randint(1, 10)))
+                await send(uid, "add_date", f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}")
+                await send(uid, "add_duration", "авто")
+                await send(uid, "stats_cmd", "/stats")
+                await send(uid, "recommend_cmd", "/recommend")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(uid) for uid in range(1, users + 1)))
+        elapsed = time.perf_counter() - start
+    return elapsed, latencies, stub.calls
+
+
+def cmd_replay(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "catalog.csv")
+        names = write_synthetic_catalog(csv_path, args.titles, args.seed)
+        bot.CATALOG_CSV = csv_path
+        setup_db(os.path.join(tmp, "replay.db"), args.users, args.views)
+        bot.load_catalog_if_empty()
+        bot.catalog_vectors()
+        bot.title_index()
+        try:
+            elapsed, latencies, api_calls = asyncio.run(
+                run_replay(args.users, args.rounds, names, args.api_latency / 1000, args.seed)
+            )
+        finally:
+            bot.shutdown_db()
+    updates = sum(len(v) for v in latencies.values())
+    print(
+        f"{args.users} пользователей, {updates} апдейтов за {elapsed:.2f} c: {updates / elapsed:.0f} апдейтов/с, "
+        f"{api_calls} вызовов Bot API, групповых транзакций: {bot.write_queue.batches} на {bot.write_queue.rows} записей"
+    )
+    for step, values in latencies.items():
+        print_histogram(step, values)
+
+
+def cmd_metrics(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "catalog.csv")
+        names = write_synthetic_catalog(csv_path, args.titles)
+        bot.CATALOG_CSV = csv_path
+        setup_db(os.path.join(tmp, "metrics.db"), args.users, args.views)
+        bot.load_catalog_if_empty()
+        bot.title_index()
+        rnd = random.Random(42)
+        calls = [
+            ("get_last_views", bot.get_last_views, lambda: (rnd.randrange(args.users),)),
+            ("stats", bot.stats, lambda: (rnd.randrange(args.users),)),
+            ("find_in_catalog", bot.find_in_catalog, lambda: (rnd.choice(names),)),
+            ("progress", bot.progress, lambda: (rnd.randrange(args.users),)),
+        ]
+        # Одна и та же последовательность вызовов с метриками и без, чередуя прогоны против дрейфа
+        for name, func, make_args in calls:
+            timings = {False: [], True: []}
+            for _ in range(args.rounds):
+                for enabled in (False, True):
+                    metrics.enabled = enabled
+                    start = time.perf_counter()
+                    for _ in range(args.calls):
+                        func(*make_args())
+                    timings[enabled].append((time.perf_counter() - start) / args.calls)
+            off, on = statistics.median(timings[False]), statistics.median(timings[True])
+            print(
+                f"{name:>16}: без метрик {off * 1e6:8.1f} мкс, с метриками {on * 1e6:8.1f} мкс, "
+                f"накладные {(on - off) * 1e6:+.1f} мкс ({100 * (on / off - 1):+.1f}%)"
+            )
+        metrics.enabled = True
+
+        server = start_http_server(0)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            body = urllib.request.urlopen(url).read().decode("utf-8")
+        finally:
+            stop_http_server(server)
+        print(f"/metrics: {len(body.splitlines())} строк, например:")
+        for line in body.splitlines():
+            if line.startswith("tracker_call_seconds_count"):
+                print("  " + line)
+        bot.shutdown_db()
+
+
+def cmd_responses(args) -> None:
+    from caching import ResponseCache, ResponseStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_db(os.path.join(tmp, "responses.db"), args.users, args.views)
+        renders = [("last", bot.render_last), ("stats", bot.render_stats), ("progress", bot.render_progress)]
+        users = range(args.users)
+
+        def timed():
+            timings = {}
+            for command, render in renders:
+                timings[command] = time_calls(lambda uid: bot.cached_response(uid, command, render), users, 1)
+            return timings
+
+        def report(label, timings):
+            print(
+                f"{label:>22}: "
+                + ", ".join(f"{command} {statistics.median(t) * 1e6:7.1f} мкс" for command, t in timings.items())
+            )
+
+        store_path = os.path.join(tmp, "responses-cache.db")
+        bot.response_cache = ResponseCache(bot.RESPONSE_CACHE_BYTES, ResponseStore(store_path))
+        report("без кэша (первый вызов)", timed())
+        report("кэш в памяти", timed())
+        # Перезапуск: память пустая, хранилище на диске то же
+        bot.response_cache.store.close()
+        bot.response_cache = ResponseCache(bot.RESPONSE_CACHE_BYTES, ResponseStore(store_path))
+        report("после перезапуска", timed())
+        counters = bot.response_cache.counters()
+        print(f"записей {counters['entries']}, {counters['bytes'] / 1024:.0f} КБ, доля попаданий {counters['hit_ratio']}")
+
+        # Новый просмотр должен сразу менять ответ, а не отдавать прошлый текст
+        stale = 0
+        rnd = random.Random(42)
+        for uid in rnd.sample(list(users), min(50, args.users)):
+            before = bot.cached_response(uid, "stats", bot.render_stats)
+            bot.insert_view(
+                uid,
+                {"name": "Bench", "type": "Film", "genre": "Drama", "user_rate": 7, "view_date": "2026-01-01", "duration_minutes": 90},
+            )
+            after = bot.cached_response(uid, "stats", bot.render_stats)
+            if after != bot.render_stats(uid) or after == before:
+                stale += 1
+        bot.response_cache.store.close()
+        bot.shutdown_db()
+        print(f"устаревших ответов после записи: {stale}")
+        if stale:
+            raise SystemExit(1)
+
+
+def legacy_genre_stats(df):
+    # Прежний расчёт из "Анализ данных.py": циклы по спискам жанров и apply на каждый жанр
+    df = df.copy()
+    df["Genre"] = df["Genre"].str.replace("Actions", "Action")
+    df["Genre_Clean"] = df["Genre"].str.split(", ")
+    all_genres = []
+    for genres in df["Genre_Clean"].dropna():
+        if isinstance(genres, list):
+            all_genres.extend([g.strip() for g in genres])
+    genre_counter = {}
+    for genre in all_genres:
+        genre_counter[genre] = genre_counter.get(genre, 0) + 1
+    genre_ratings = {}
+    for genre in genre_counter.keys():
+        mask = df["Genre_Clean"].apply(lambda x: genre in x if isinstance(x, list) else False)
+        if mask.sum() > 5:
+            genre_ratings[genre] = df.loc[mask, "Rate"].mean()
+    return genre_counter, genre_ratings
+
+
+def legacy_series_length(df):
+    df = df[["Type", "Episodes"]].copy()
+    df["Series_Length"] = "Not Series"
+    series_mask = df["Type"] == "Series"
+    df.loc[series_mask & (df["Episodes"] <= 20), "Series_Length"] = "Короткие (1-20 эп.)"
+    df.loc[series_mask & (df["Episodes"] > 20) & (df["Episodes"] <= 60), "Series_Length"] = "Средние (21-60 эп.)"
+    df.loc[series_mask & (df["Episodes"] > 60), "Series_Length"] = "Длинные (60+ эп.)"
+    return df["Series_Length"]
+
+
+def synthetic_frame(rows: int, seed: int = 42):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    combos = [", ".join(sorted(set(rng.choice(SYNTHETIC_GENRES, rng.integers(1, 4))))) for _ in range(500)]
+    is_series = rng.random(rows) < 0.3
+    return pd.DataFrame(
+        {
+            "Name": [f"Title {i}" for i in range(rows)],
+            "Rate": rng.uniform(2, 9.6, rows).round(1).astype("float32"),
+            "Votes": (rng.pareto(1.2, rows) * 300).astype("float32"),
+            "Genre": np.array(combos, dtype=object)[rng.integers(0, len(combos), rows)],
+            "Type": pd.Categorical(np.where(is_series, "Series", "Film")),
+            "Certificate": pd.Categorical(rng.choice(SYNTHETIC_CERTIFICATES, rows)),
+            "Episodes": np.where(is_series, rng.integers(1, 300, rows), 1).astype("float32"),
+        }
+    )
+
+
+def cmd_analytics(args) -> None:
+    import analytics
+
+    df = synthetic_frame(args.rows, args.seed)
+    print(f"каталог: {len(df):,} строк, {df['Genre'].nunique()} сочетаний жанров")
+    start = time.perf_counter()
+    stats = analytics.genre_stats(df)
+    lengths = analytics.series_length(df)
+    vectorized = time.perf_counter() - start
+    print(f"analytics (factorize + explode + groupby, pd.cut): {vectorized:.2f} c")
+    if args.skip_legacy:
+        return
+    start = time.perf_counter()
+    counter, ratings = legacy_genre_stats(df)
+    legacy_lengths = legacy_series_length(df)
+    legacy = time.perf_counter() - start
+    print(f"прежний скрипт (циклы и apply на жанр): {legacy:.2f} c, ускорение x{legacy / vectorized:.0f}")
+
+    mismatched = [g for g, n in counter.items() if stats["mentions"].get(g) != n]
+    mismatched += [g for g, r in ratings.items() if not abs(stats["mean_rate"].get(g, float("nan")) - r) <= 1e-4]
+    if mismatched or not (lengths.astype(str) == legacy_lengths.astype(str)).all():
+        raise SystemExit(f"результаты расходятся с прежним расчётом: {mismatched[:5]}")
+
+
+def cmd_report(args) -> None:
+    import analytics
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = args.csv
+        if args.rows:
+            csv_path = os.path.join(tmp, "catalog.csv")
+            synthetic_frame(args.rows, args.seed).to_csv(csv_path, index=False)
+        cache_dir = os.path.join(tmp, "cache")
+        runs = [
+            ("холодный, по очереди", 1),
+            ("из кэша, по очереди", 1),
+            (f"из кэша, {args.workers} процесса", args.workers),
+        ]
+        for label, workers in runs:
+            start = time.perf_counter()
+            result = analytics.build_report(
+                csv_path, os.path.join(tmp, "out"), workers=workers, cache_dir=cache_dir, catalog_cache=cache_dir
+            )
+            total = time.perf_counter() - start
+            print(
+                f"{label:>24}: агрегаты {result['aggregate_s']:.2f} c, отрисовка {result['render_s']:.2f} c, "
+                f"всего {total:.2f} c"
+            )
+        size = os.path.getsize(result["report"])
+        print(f"report.html {size / 1024:.0f} КБ, ядер {os.cpu_count()}")
+        if not result["cache_hit"]:
+            raise SystemExit("повторный прогон не взял агрегаты из кэша")
+
+
+def cmd_titles(args) -> None:
+    rnd = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "catalog.csv")
+        names = write_synthetic_catalog(csv_path, args.titles, args.seed)
+        bot.DB_PATH = os.path.join(tmp, "titles.db")
+        bot.CATALOG_CSV = csv_path
+        bot.startup()
+
+        # Популярные названия вводят чаще (распределение Парето), часть — с опечаткой или вовсе неизвестные
+        def query():
+            name = names[min(int(rnd.paretovariate(1.1)) - 1, len(names) - 1)]
+            roll = rnd.random()
+            if roll < 0.2:
+                pos = rnd.randrange(len(name))
+                return name[:pos] + rnd.choice("aeiou") + name[pos + 1 :]
+            if roll < 0.25:
+                return f"Unknown Title {rnd.randint(1, 50)}"
+            return name
+
+        queries = [query() for _ in range(args.queries)]
+        uncached = time_calls(lambda q: (bot.find_in_catalog(q) or bot.fuzzy_catalog(q)), queries, 1)
+        cached = time_calls(bot.resolve_title, queries, 1)
+        counters = bot._title_cache.counters()
+        hit_ratio = counters["hits"] / max(1, counters["hits"] + counters["misses"])
+        print(f"{args.queries} запросов, {len(set(queries))} разных, каталог {args.titles} тайтлов")
+        print(f"find_in_catalog + fuzzy_catalog: p50 {percentile(uncached, 50) * 1e6:8.1f} мкс, сумма {sum(uncached):.2f} c")
+        print(
+            f"resolve_title с кэшем:           p50 {percentile(cached, 50) * 1e6:8.1f} мкс, сумма {sum(cached):.2f} c, "
+            f"попаданий {hit_ratio:.0%}, записей {counters['size']}"
+        )
+
+        # Кэш должен совпадать с прямым поиском, а новый тайтл — находиться сразу после записи в каталог
+        wrong = [
+            q for q in set(queries)
+            if bot.resolve_title(q) != (bot.find_in_catalog(q), [] if bot.find_in_catalog(q) else bot.fuzzy_catalog(q))
+        ]
+        missing = "Bench Brand New Title"
+        before, _ = bot.resolve_title(missing)
+        bot.insert_catalog_entry({"name": missing, "type": "Film", "genre": "Drama"})
+        after, _ = bot.resolve_title(missing)
+        bot.shutdown_db()
+        if wrong or before is not None or after is None:
+            raise SystemExit(f"кэш названий расходится с поиском: {wrong[:5]}, новый тайтл найден: {after is not None}")
+
+
+def cmd_catalogcache(args) -> None:
+    import analytics
+    import catalog_io
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "catalog.csv")
+        write_synthetic_catalog(csv_path, args.titles, args.seed)
+        cache_dir = os.path.join(tmp, "cache")
+        print(f"каталог: {args.titles:,} тайтлов, CSV {os.path.getsize(csv_path) / 2**20:.1f} МБ")
+
+        def timed(label, func):
+            start = time.perf_counter()
+            result = func()
+            print(f"{label:>34}: {(time.perf_counter() - start) * 1000:8.1f} мс")
+            return result
+
+        timed("read_csv и очистка", lambda: catalog_io.read_catalog(csv_path, None))
+        timed("сборка кэша .npy", lambda: catalog_io.build_catalog_cache(csv_path, cache_dir))
+        # Сборка идёт по чанкам, как импорт: пик памяти не должен расти вместе с каталогом.
+        # tracemalloc замедляет сборку, поэтому память меряем отдельной сборкой в другой каталог
+        tracemalloc.start()
+        catalog_io.build_catalog_cache(csv_path, os.path.join(tmp, "traced-cache"))
+        build_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{'пик памяти сборки':>34}: {build_peak / 2**20:8.1f} МБ")
+        timed("кэш из .npy (mmap)", lambda: catalog_io.read_catalog(csv_path, cache_dir))
+        plain = timed("analytics.load_catalog без кэша", lambda: analytics.load_catalog(csv_path, None))
+        cached = timed("analytics.load_catalog из кэша", lambda: analytics.load_catalog(csv_path, cache_dir))
+
+        bot.DB_PATH = os.path.join(tmp, "catalog.db")
+        bot.init_db()
+        timed("import_catalog без кэша", lambda: bot.import_catalog(csv_path, replace=True))
+        expected = bot.get_conn().execute("SELECT * FROM catalog ORDER BY id").fetchall()
+        timed("import_catalog из кэша", lambda: bot.import_catalog(csv_path, replace=True, cache_dir=cache_dir))
+        actual = bot.get_conn().execute("SELECT * FROM catalog ORDER BY id").fetchall()
+        bot.shutdown_db()
+
+        # Изменённый CSV должен дать новый кэш, а не прочитать старые колонки
+        with open(csv_path, "a", encoding="utf-8") as f:
+            f.write('Bench Appended,2020,7.0,"1,000",Drama,90,Film,R,-,None,None,None,None,None\n')
+        _, rebuilt = catalog_io.build_catalog_cache(csv_path, cache_dir)
+        caches = [name for name in os.listdir(cache_dir) if name.startswith("catalog-")]
+        print(f"после изменения CSV: пересобран {rebuilt}, каталогов кэша {len(caches)}")
+
+        mismatched = len(expected) != len(actual) or [row[1:] for row in expected] != [row[1:] for row in actual]
+        frames_differ = [
+            col
+            for col in cached.columns
+            if plain[col].isna().tolist() != cached[col].isna().tolist()
+            or plain[col].dropna().tolist() != cached[col].dropna().tolist()
+        ]
+        if mismatched or frames_differ or not rebuilt or len(caches) != 1:
+            raise SystemExit(f"кэш расходится с CSV: строки каталога {mismatched}, analytics {frames_differ}")
+
+
+async def run_user_report(uid: int, repeat: int):
+    stub = StubBotAPI()
+    lags = []
+    done = False
+
+    async def heartbeat():
+        # Отрисовка идёт в отдельном процессе, поэтому цикл событий должен оставаться отзывчивым
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - start - 0.005)
+
+    async with UpdateFeed(stub) as feed:
+
+        async def report() -> float:
+            start = time.perf_counter()
+            await feed.send(uid, "/report")
+            return time.perf_counter() - start
+
+        beat = asyncio.create_task(heartbeat())
+        try:
+            # Первый вызов поднимает процесс отрисовки, второй — отрисовка в уже запущенном процессе
+            timings = {"первый (запуск процесса)": [await report()]}
+            bot.views_committed(uid)
+            timings["без кэша"] = [await report()]
+            timings["из кэша"] = [await report() for _ in range(repeat)]
+            bot.insert_view(
+                uid,
+                {"name": "Bench", "type": "Film", "genre": "Drama", "user_rate": 7, "view_date": "2026-01-01", "duration_minutes": 90},
+            )
+            stale, _ = bot.response_cache.get(uid, "report")
+            timings["после /add"] = [await report()]
+        finally:
+            done = True
+            await beat
+            bot.shutdown_report_pool()
+    return timings, lags, stub.last_text.get(uid, ""), stale
+
+
+def cmd_userreport(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_db(os.path.join(tmp, "report.db"), 1, args.views)
+        uid = 0
+        sql = time_calls(bot.user_report_data, [uid], args.repeat)
+        print(f"агрегаты в SQL для {args.views} просмотров: {statistics.median(sql) * 1000:.2f} мс")
+        data = bot.user_report_data(uid)
+        start = time.perf_counter()
+        png = render_user_report(data)
+        print(f"отрисовка в этом процессе: {(time.perf_counter() - start) * 1000:.0f} мс, PNG {len(png) / 1024:.0f} КБ")
+        timings, lags, caption, stale = asyncio.run(run_user_report(uid, args.repeat))
+        for label, values in timings.items():
+            print(f"{label:>26}: {statistics.median(values) * 1000:8.2f} мс")
+        print(f"задержка цикла событий во время /report: max {max(lags, default=0) * 1000:.1f} мс")
+        print(f"подпись: {caption}")
+        bot.shutdown_db()
+        if stale is not None:
+            raise SystemExit("после insert_view /report отдал картинку из кэша")
+
+
+def cmd_export(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_db(os.path.join(tmp, "export.db"), 1, args.views)
+        path = os.path.join(tmp, "export.out")
+        formats = ["csv", "jsonl"] + (["parquet"] if bot.parquet_available() else [])
+        for fmt in formats:
+            for batch_size in (100, 1000, 10_000):
+                start = time.perf_counter()
+                rows = bot.export_views(0, fmt, path, batch_size)
+                elapsed = time.perf_counter() - start
+                # Пик памяти — вторым прогоном, tracemalloc замедляет запись в разы
+                tracemalloc.start()
+                bot.export_views(0, fmt, path, batch_size)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(
+                    f"{fmt:>7}, пачка {batch_size:>6}: {rows} строк за {elapsed:.2f} c, "
+                    f"пик памяти {peak / 2**20:.1f} МБ, файл {os.path.getsize(path) / 2**20:.1f} МБ"
+                )
+
+        async def exported_with_heartbeat():
+            lag = []
+            stop = asyncio.Event()
+
+            async def heartbeat():
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    await asyncio.sleep(0.001)
+                    lag.append(time.perf_counter() - start - 0.001)
+
+            hb = asyncio.create_task(heartbeat())
+            await bot.db_read(bot.export_views, 0, "csv", path)
+            stop.set()
+            await hb
+            return lag
+
+        lag = asyncio.run(exported_with_heartbeat())
+        print(f"задержка цикла во время выгрузки: средн. {statistics.mean(lag) * 1000:.2f} мс, макс. {max(lag) * 1000:.2f} мс")
+        bot.shutdown_db()
+
+
+# Бюджет импорта истории (разбор, сопоставление и запись), секунды; превышение — код возврата 1
+IMPORT_BUDGET_S = 5.0
+
+
+def write_history_file(path: str, names: list, rows: int, seed: int = 42) -> None:
+    # Файл в формате выгрузки оценок IMDb: точные названия, опечатки и тайтлы, которых нет в каталоге
+    rnd = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Const", "Your Rating", "Date Rated", "Title", "Title Type", "Runtime (mins)", "Genres"])
+        for i in range(rows):
+            kind = rnd.random()
+            name = rnd.choice(names)
+            if kind < 0.1:
+                pos = rnd.randrange(len(name))
+                name = name[:pos] + rnd.choice("aeiou") + name[pos + 1 :]
+            elif kind < 0.2:
+                name = f"Qzx Unlisted Title {i % (rows // 20 or 1)}"
+            writer.writerow(
+                [
+                    f"tt{i:07d}",
+                    rnd.randint(1, 10),
+                    f"{rnd.randint(2015, 2026)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                    name.upper() if rnd.random() < 0.1 else name,
+                    rnd.choice(["movie", "tvSeries"]),
+                    rnd.choice([rnd.randint(80, 180), ""]),
+                    ", ".join(rnd.sample(SYNTHETIC_GENRES, rnd.randint(1, 3))),
+                ]
+            )
+
+
+async def send_document(uid: int, filename: str, data: bytes) -> str:
+    # Тот же файл через обработчик документа, как если бы его прислали в чат
+    stub = StubBotAPI()
+    stub.files[filename] = data
+    async with UpdateFeed(stub) as feed:
+        # Документ без /import бот игнорирует
+        await feed.send(uid, "/import")
+        document = {"file_id": filename, "file_unique_id": filename, "file_name": filename, "file_size": len(data)}
+        await feed.send(uid, document=document)
+    return stub.last_text.get(uid, "")
+
+
+def cmd_import(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "catalog.csv")
+        names = write_synthetic_catalog(csv_path, args.titles, args.seed)
+        bot.DB_PATH = os.path.join(tmp, "import.db")
+        bot.CATALOG_CSV = csv_path
+        bot.startup()
+        history_path = os.path.join(tmp, "ratings.csv")
+        write_history_file(history_path, names, args.rows, args.seed)
+        with open(history_path, "rb") as f:
+            data = f.read()
+
+        start = time.perf_counter()
+        entries, skipped, matches = bot.prepare_import(data, "ratings.csv")
+        prepared = time.perf_counter()
+        result = bot.import_views(0, entries, matches)
+        done = time.perf_counter()
+        print(f"файл: {args.rows} строк, {len(data) / 2**20:.1f} МБ, каталог {args.titles} тайтлов")
+        print(f"разбор и сопоставление: {(prepared - start) * 1000:.0f} мс ({len(matches)} разных названий)")
+        print(f"запись одной транзакцией: {(done - prepared) * 1000:.0f} мс")
+        print(
+            f"найдено {result['matched']}, неоднозначных {result['ambiguous']}, новых {result['new']} "
+            f"(в каталог добавлено {result['created']}), пропущено {sum(skipped.values())}"
+        )
+        total = done - start
+        print(f"итого {total:.2f} c, {len(entries) / total:,.0f} строк/с при бюджете {args.budget:.1f} c")
+        reply = asyncio.run(send_document(1, "ratings.csv", data))
+        print("ответ бота на документ:\n  " + reply.replace("\n", "\n  "))
+
+        count = bot.get_conn().execute("SELECT COUNT(*) FROM views WHERE user_id = 1").fetchone()[0]
+        mismatched = bot.check_user_stats()
+        new_title = next((e["name"] for e in entries if matches[bot.normalize_title(e["name"])][0] == "new"), None)
+        found = bot.find_in_catalog(new_title) if new_title else True
+        bot.shutdown_db()
+        if count != len(entries) or mismatched or not found:
+            raise SystemExit(f"после импорта: {count} просмотров из {len(entries)}, user_stats расходится у {mismatched}")
+        if total > args.budget:
+            raise SystemExit(1)
+
+
+# Бюджет тёплого старта (импорт bot.py + startup() на imdb.csv), секунды; превышение — код возврата 1
+WARM_START_BUDGET_S = 1.0
+STARTUP_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import bot
+imported = time.perf_counter()
+bot.DB_PATH, bot.CATALOG_CSV = sys.argv[1], sys.argv[2]
+warm = bot.startup()
+done = time.perf_counter()
+bot.shutdown_db()
+print(json.dumps({
+    "warm": warm,
+    "import_s": imported - start,
+    "startup_s": done - imported,
+    "pandas": "pandas" in sys.modules,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def probe_startup(db_path: str, csv_path: str) -> dict:
+    # Отдельный процесс: иначе импорт модулей и кэши прошлых прогонов искажают замер
+    out = subprocess.run(
+        [sys.executable, "-c", STARTUP_PROBE, db_path, csv_path],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def cmd_startup(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "startup.db")
+        runs = [("холодный", probe_startup(db_path, args.csv))]
+        runs += [("тёплый", probe_startup(db_path, args.csv)) for _ in range(args.repeat)]
+    for label, run in runs:
+        print(
+            f"{label:>9}: импорт {run['import_s'] * 1000:6.0f} мс, startup {run['startup_s'] * 1000:6.0f} мс, "
+            f"pandas {'загружен' if run['pandas'] else 'нет'}, rss {run['rss_kb'] / 1024:.0f} МБ"
+        )
+    warm_runs = [run for label, run in runs[1:]]
+    warm_total = statistics.median(run["import_s"] + run["startup_s"] for run in warm_runs)
+    print(f"тёплый старт (медиана): {warm_total:.2f} c при бюджете {args.budget:.2f} c")
+    if not all(run["warm"] and not run["pandas"] for run in warm_runs):
+        raise SystemExit("тёплый старт прошёл проверки каталога или загрузил pandas")
+    if warm_total > args.budget:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочные проверки слоя данных бота")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="параллельные /add и /stats")
+    load.add_argument("--users", type=int, default=50)
+    load.add_argument("--rounds", type=int, default=20)
+    load.add_argument("--views", type=int, default=2000, help="просмотров на пользователя заранее")
+    load.set_defaults(func=cmd_load)
+
+    search = sub.add_parser("search", help="поиск по названию: LIKE против триграммного индекса")
+    search.add_argument("--csv", default=bot.CATALOG_CSV)
+    search.add_argument("--factor", type=int, default=100, help="во сколько раз размножить каталог")
+    search.add_argument("--repeat", type=int, default=20)
+    search.set_defaults(func=cmd_search)
+
+    recommend = sub.add_parser("recommend", help="латентность контентных рекомендаций")
+    recommend.add_argument("--csv", default=bot.CATALOG_CSV)
+    recommend.add_argument("--factor", type=int, default=100)
+    recommend.add_argument("--repeat", type=int, default=3)
+    recommend.set_defaults(func=cmd_recommend)
+
+    suite = sub.add_parser("suite", help="все функции данных на синтетическом каталоге и истории")
+    suite.add_argument("--titles", type=int, default=10_000, help="тайтлов в каталоге (10k-1M)")
+    suite.add_argument("--views", type=int, default=100_000, help="просмотров в истории (1k-10M)")
+    suite.add_argument("--users", type=int, default=1_000)
+    suite.add_argument("--iterations", type=int, default=200)
+    suite.add_argument("--seed", type=int, default=42)
+    suite.add_argument("--save", help="записать результаты в JSON (базовая линия)")
+    suite.add_argument("--compare", help="сравнить с сохранённой базовой линией")
+    suite.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение p50/p99")
+    suite.set_defaults(func=cmd_suite)
+
+    replay = sub.add_parser("replay", help="прогон /add, /stats и /recommend через Application без Telegram")
+    replay.add_argument("--users", type=int, default=1000, help="одновременных пользователей")
+    replay.add_argument("--rounds", type=int, default=3, help="сценариев на пользователя")
+    replay.add_argument("--views", type=int, default=20, help="просмотров на пользователя до прогона")
+    replay.add_argument("--titles", type=int, default=10_000)
+    replay.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, мс")
+    replay.add_argument("--seed", type=int, default=42)
+    replay.set_defaults(func=cmd_replay)
+
+    overhead = sub.add_parser("metrics", help="накладные расходы инструментирования и проверка /metrics")
+    overhead.add_argument("--users", type=int, default=200)
+    overhead.add_argument("--views", type=int, default=100)
+    overhead.add_argument("--titles", type=int, default=10_000)
+    overhead.add_argument("--calls", type=int, default=500)
+    overhead.add_argument("--rounds", type=int, default=7)
+    overhead.set_defaults(func=cmd_metrics)
+
+    snap = sub.add_parser("snapshot", help="снимок каталога в памяти против запросов к SQLite")
+    snap.add_argument("--csv", default="imdb.csv")
+    snap.add_argument("--factor", type=int, default=20, help="во сколько раз размножить каталог")
+    snap.add_argument("--repeat", type=int, default=5)
+    snap.set_defaults(func=cmd_snapshot)
+
+    start = sub.add_parser("startup", help="время холодного и тёплого старта против бюджета")
+    start.add_argument("--csv", default=os.path.abspath(bot.CATALOG_CSV))
+    start.add_argument("--repeat", type=int, default=3)
+    start.add_argument("--budget", type=float, default=WARM_START_BUDGET_S, help="бюджет тёплого старта, c")
+    start.set_defaults(func=cmd_startup)
+
+    responses = sub.add_parser("responses", help="кэш ответов /stats, /progress, /last: задержка и свежесть")
+    responses.add_argument("--users", type=int, default=500)
+    responses.add_argument("--views", type=int, default=200, help="просмотров на пользователя")
+    responses.set_defaults(func=cmd_responses)
+
+    analysis = sub.add_parser("analytics", help="жанровая статистика каталога: analytics.py против прежнего скрипта")
+    analysis.add_argument("--rows", type=int, default=1_000_000)
+    analysis.add_argument("--seed", type=int, default=42)
+    analysis.add_argument("--skip-legacy", action="store_true", help="не запускать медленный прежний расчёт")
+    analysis.set_defaults(func=cmd_analytics)
+
+    report = sub.add_parser("report", help="отчёт без экрана: кэш агрегатов и параллельная отрисовка панелей")
+    report.add_argument("--csv", default=bot.CATALOG_CSV)
+    report.add_argument("--rows", type=int, default=0, help="синтетический каталог вместо --csv")
+    report.add_argument("--workers", type=int, default=3)
+    report.add_argument("--seed", type=int, default=42)
+    report.set_defaults(func=cmd_report)
+
+    titles = sub.add_parser("titles", help="кэш поиска названий в /add: попадания и совпадение с прямым поиском")
+    titles.add_argument("--titles", type=int, default=50_000)
+    titles.add_argument("--queries", type=int, default=20_000)
+    titles.add_argument("--seed", type=int, default=42)
+    titles.set_defaults(func=cmd_titles)
+
+    catcache = sub.add_parser("catalogcache", help="кэш разобранного CSV в .npy против read_csv и очистки")
+    catcache.add_argument("--titles", type=int, default=200_000)
+    catcache.add_argument("--seed", type=int, default=42)
+    catcache.set_defaults(func=cmd_catalogcache)
+
+    userreport = sub.add_parser("userreport", help="/report: SQL-агрегаты, отрисовка в процессе и кэш до нового просмотра")
+    userreport.add_argument("--views", type=int, default=5000, help="просмотров у пользователя")
+    userreport.add_argument("--repeat", type=int, default=20)
+    userreport.set_defaults(func=cmd_userreport)
+
+    export = sub.add_parser("export", help="потоковая выгрузка дневника: память и задержка цикла")
+    export.add_argument("--views", type=int, default=200_000, help="просмотров у пользователя")
+    export.set_defaults(func=cmd_export)
+
+    imp = sub.add_parser("import", help="импорт истории просмотров из файла против бюджета")
+    imp.add_argument("--rows", type=int, default=10_000, help="строк в файле")
+    imp.add_argument("--titles", type=int, default=50_000, help="тайтлов в каталоге")
+    imp.add_argument("--seed", type=int, default=42)
+    imp.add_argument("--budget", type=float, default=IMPORT_BUDGET_S, help="бюджет импорта, c")
+    imp.set_defaults(func=cmd_import)
+
+    args = parser.parse_args()
+    # Синтетические каталоги живут во временных файлах: их кэш .npy не должен копиться в рабочем каталоге
+    with tempfile.TemporaryDirectory() as catalog_cache:
+        bot.CATALOG_CACHE = catalog_cache
+        args.func(args)
+
+
+if __name__ == "__main__":
+    main()
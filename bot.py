@@ -1,201 +1,993 @@
+import argparse
+import asyncio
+import functools
+import logging
+import multiprocessing
 import os
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, Any, List, Tuple
-
-import pandas as pd
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import IO, Awaitable, Callable, Dict, Any, Iterable, List, Optional, Tuple, Union
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
+    CallbackQueryHandler,
     CommandHandler,
     ConversationHandler,
     MessageHandler,
     ContextTypes,
     filters,
 )
+from telegram.request import BaseRequest
+
+from caching import ResponseCache, ResponseStore, TTLCache
+from catalog_io import (
+    CATALOG_CACHE_DIR,
+    CATALOG_FIELDS,
+    CHUNK_ROWS,
+    build_catalog_cache,
+    catalog_rows,
+    file_digest,
+    iter_catalog_frames,
+    split_genres,
+)
+from catalog_snapshot import CatalogRecord, CatalogSnapshot
+from export import EXPORT_BATCH, EXPORT_COLUMNS, FORMATS, iter_batches, parquet_available, write_export
+from history_import import HistoryFormatError, default_duration, read_history
+from metrics import metrics, start_http_server, stop_http_server
+from recommender import ADVISORY_FIELDS, CatalogVectors
+from title_search import TitleIndex
+from user_report import REPORT_GENRES, REPORT_WEEKS, render_user_report
 
 
 ADD_TITLE, ADD_EXISTS_RATING, ADD_DATE, ADD_DURATION, ADD_NEW_DETAILS, ADD_NEW_RATING = range(
     6
 )
+IMPORT_FILE = 6
 
 DB_PATH = "tracker.db"
 CATALOG_CSV = "imdb.csv"
+# Разобранный CSV в .npy; пустая строка — разбирать CSV при каждой загрузке каталога
+CATALOG_CACHE = CATALOG_CACHE_DIR
 BOT_TOKEN = ""
+DB_READ_WORKERS = 4
+# Апдейтов в работе одновременно. Обработчик почти всё время ждёт пул или Bot API,
+# а число одновременных запросов к базе и так ограничивают пулы
+CONCURRENT_UPDATES = 4 * DB_READ_WORKERS
+# Порт локального эндпоинта /metrics (0 — не запускать) и порог журнала медленных запросов
+METRICS_PORT = 0
+SLOW_QUERY_MS = 0.0
+# Кэш готовых ответов /stats, /progress, /last: предел памяти и файл общего хранилища ("" — только память)
+RESPONSE_CACHE_BYTES = 16 * 1024 * 1024
+RESPONSE_CACHE_PATH = ""
+
+
+main_keyboard = [["/add", "/last", "/history"], ["/stats", "/recommend"], ["/progress", "/help"]]
+main_markup = ReplyKeyboardMarkup(main_keyboard, one_time_keyboard=False, resize_keyboard=True)
 
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("cache_size", -16000),
+    ("temp_store", "MEMORY"),
+)
+STATEMENT_CACHE_SIZE = 256
+# Групповая фиксация записей: не больше строк в одной транзакции
+WRITE_BATCH_ROWS = 64
+
+
+class CountingCursor(sqlite3.Cursor):
+    # Ошибки SQL (например, "database is locked") попадают в метрики как ошибки, а строки считаются
+    # по курсору: прочитанные fetch*/итерацией и изменённые INSERT/UPDATE/DELETE
+    def execute(self, sql, parameters=()):
+        db.count_statement()
+        if not metrics.enabled:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except BaseException:
+            metrics.observe_sql(sql, parameters, time.perf_counter() - start, error=True)
+            raise
+        metrics.observe_sql(sql, parameters, time.perf_counter() - start)
+        if self.rowcount > 0:
+            metrics.add_rows(self.rowcount)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        db.count_statement()
+        if not metrics.enabled:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except BaseException:
+            metrics.observe_sql(sql, "many", time.perf_counter() - start, error=True)
+            raise
+        metrics.observe_sql(sql, "many", time.perf_counter() - start)
+        if self.rowcount > 0:
+            metrics.add_rows(self.rowcount)
+        return self
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None and metrics.enabled:
+            metrics.add_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if metrics.enabled:
+            metrics.add_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if metrics.enabled:
+            metrics.add_rows(len(rows))
+        return rows
+
+    def __iter__(self):
+        # Счётчик в генераторе и один add_rows на проход: переопределённый __next__ стоил бы вызова на строку
+        return self._counted(iter(super().__next__, None)) if metrics.enabled else self
+
+    @staticmethod
+    def _counted(rows):
+        count = 0
+        try:
+            for count, row in enumerate(rows, 1):
+                yield row
+        finally:
+            metrics.add_rows(count)
+
+
+class ManagedConnection(sqlite3.Connection):
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+    # Connection.execute не вызывает cursor(), поэтому перенаправляем явно
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionManager:
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self.connections_opened = 0
+        self.statements_executed = 0
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Соединение живёт в своём потоке, check_same_thread=False нужен только для close_all()
+            conn = sqlite3.connect(
+                DB_PATH,
+                timeout=30,
+                factory=ManagedConnection,
+                cached_statements=STATEMENT_CACHE_SIZE,
+                check_same_thread=False,
+            )
+            for name, value in SQLITE_PRAGMAS:
+                conn.execute(f"PRAGMA {name}={value}")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+                self.connections_opened += 1
+        return conn
+
+    def count_statement(self) -> None:
+        with self._lock:
+            self.statements_executed += 1
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "connections_opened": self.connections_opened,
+                "connections_open": len(self._connections),
+                "statements_executed": self.statements_executed,
+            }
+
+    def close_all(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error:
+                pass
+        # Потоки пулов переживают close_all, поэтому сбрасываем их ссылки через новое хранилище
+        self._local = threading.local()
+
+
+write_log = logging.getLogger("tracker.write_queue")
+catalog_log = logging.getLogger("tracker.catalog")
+
+
+class WriteQueue:
+    # Групповая фиксация без ожидания: одиночная запись уходит сразу, а записи, пришедшие, пока
+    # поток-писатель фиксировал предыдущую пачку, уходят следующей транзакцией (до max_rows).
+    # Каждый вызов submit() ждёт своего future, поэтому ответ бота по-прежнему значит "сохранено"
+    def __init__(self, max_rows: int = WRITE_BATCH_ROWS) -> None:
+        self.max_rows = max_rows
+        self.batches = 0
+        self.rows = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def submit(self, write: Callable[[sqlite3.Cursor], Any], after: Optional[Callable[[Any], None]] = None) -> Any:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            # Очередь и задача привязаны к циклу событий, в котором их создали
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run(self._queue))
+        future = loop.create_future()
+        self._queue.put_nowait((write, after, future))
+        return await future
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._queue.put_nowait(None)
+            await self._task
+        self._task = None
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_rows and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                outcomes = await loop.run_in_executor(_write_pool, self._flush, [(w, a) for w, a, _ in batch])
+            except Exception as exc:
+                outcomes = [(None, exc)] * len(batch)
+            for (_, _, future), (result, error) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            if stop:
+                return
+
+    def _flush(self, items: List[Tuple[Callable, Optional[Callable]]]) -> List[Tuple[Any, Optional[BaseException]]]:
+        start = time.perf_counter()
+        conn = get_conn()
+        cur = conn.cursor()
+        outcomes: List[Tuple[Any, Optional[BaseException]]] = []
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for write, _ in items:
+                # Точка сохранения на запись: ошибка одной строки не откатывает остальные
+                cur.execute("SAVEPOINT queued_write")
+                try:
+                    outcomes.append((write(cur), None))
+                    cur.execute("RELEASE queued_write")
+                except sqlite3.Error as exc:
+                    cur.execute("ROLLBACK TO queued_write")
+                    cur.execute("RELEASE queued_write")
+                    outcomes.append((None, exc))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        # Транзакция уже зафиксирована: ошибка хука (сброс кэшей) не должна превращать записанное в неудачу
+        for (_, after), (result, error) in zip(items, outcomes):
+            if after is None or error is not None:
+                continue
+            try:
+                after(result)
+            except Exception:
+                write_log.exception("after-хук записи упал, запись зафиксирована")
+        self.batches += 1
+        self.rows += len(items)
+        metrics.observe("data", "write_batch", time.perf_counter() - start, rows=len(items))
+        return outcomes
+
+
+db = ConnectionManager()
+# Все чтения идут через пул, все записи — через один поток-писатель (WAL: один writer, много readers)
+_read_pool = ThreadPoolExecutor(max_workers=DB_READ_WORKERS, thread_name_prefix="db-read")
+_write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+metrics.register_gauges("tracker_db", "Счётчики соединений и выражений SQLite", db.counters)
+write_queue = WriteQueue()
+metrics.register_gauges(
+    "tracker_write_queue", "Групповая фиксация записей", lambda: {"batches": write_queue.batches, "rows": write_queue.rows}
+)
 
-main_keyboard = [["/add", "/last"], ["/stats", "/recommend"], ["/progress", "/help"]]
-main_markup = ReplyKeyboardMarkup(main_keyboard, one_time_keyboard=False, resize_keyboard=True)
 
-def get_conn():
-    return sqlite3.connect(DB_PATH)
+def get_conn() -> sqlite3.Connection:
+    return db.connection()
 
 
-def init_db() -> None:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS catalog (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT COLLATE NOCASE,
-            type TEXT,
-            genre TEXT,
-            certificate TEXT,
-            imdb_rate REAL,
-            votes INTEGER,
-            episodes INTEGER
-        )
-        """
+def shutdown_db() -> None:
+    _read_pool.shutdown(wait=True)
+    _write_pool.shutdown(wait=True)
+    db.close_all()
+
+
+async def db_read(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_pool, functools.partial(func, *args, **kwargs))
+
+
+async def db_write(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_write_pool, functools.partial(func, *args, **kwargs))
+
+
+async def queue_view(user_id: int, view: Dict[str, Any]) -> None:
+    await write_queue.submit(
+        lambda cur: write_view(cur, user_id, view),
+        lambda _: views_committed(user_id),
     )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS views (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            name TEXT,
-            type TEXT,
-            genre TEXT,
-            certificate TEXT,
-            imdb_rate REAL,
-            user_rate REAL,
-            view_date TEXT,
-            duration_minutes INTEGER
-        )
-        """
+
+
+async def queue_catalog_entry(entry: Dict[str, Any]) -> int:
+    return await write_queue.submit(
+        lambda cur: write_catalog_entry(cur, entry),
+        lambda row_id: catalog_entry_committed(row_id, entry),
     )
-    conn.commit()
-    conn.close()
 
 
-def load_catalog_if_empty() -> None:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM catalog")
-    count = cur.fetchone()[0]
-    if count > 0:
-        conn.close()
-        return
+def normalize_title(title: Any) -> str:
+    return " ".join(str(title or "").lower().split())
 
-    if not os.path.exists(CATALOG_CSV):
-        conn.close()
-        return
 
-    df = pd.read_csv(CATALOG_CSV)
-    column_mapping = {}
-    if "Data" in df.columns:
-        column_mapping["Data"] = "Date"
-    if "Nudity, violence.." in df.columns:
-        column_mapping["Nudity, violence.."] = "Content_Rating"
-    df = df.rename(columns=column_mapping)
-
-    if "Rate" in df.columns:
-        df["Rate"] = pd.to_numeric(df["Rate"], errors="coerce")
-    if "Votes" in df.columns:
-        df["Votes"] = pd.to_numeric(df["Votes"], errors="coerce")
-    if "Episodes" in df.columns:
-        df["Episodes"] = pd.to_numeric(df["Episodes"], errors="coerce").fillna(1)
-
-    rows: List[Tuple[Any, ...]] = []
-    for _, row in df.iterrows():
-        rows.append(
-            (
-                row.get("Name", ""),
-                row.get("Type", ""),
-                row.get("Genre", ""),
-                row.get("Certificate", ""),
-                row.get("Rate", None),
-                row.get("Votes", None),
-                row.get("Episodes", None),
-            )
-        )
+def _add_catalog_name_norm(cur: sqlite3.Cursor) -> None:
+    # Нормализуем в Python: SQLite LOWER() не понимает кириллицу
+    cur.execute("ALTER TABLE catalog ADD COLUMN name_norm TEXT")
+    cur.execute("SELECT id, name FROM catalog")
+    cur.executemany(
+        "UPDATE catalog SET name_norm = ? WHERE id = ?",
+        [(normalize_title(name), row_id) for row_id, name in cur.fetchall()],
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_catalog_name_norm ON catalog(name_norm)")
+
+
+def write_catalog_genres(cur: sqlite3.Cursor, rows: Iterable[Tuple[int, Any]], replace: bool = True) -> None:
+    rows = list(rows)
+    if replace:
+        cur.executemany("DELETE FROM catalog_genres WHERE catalog_id = ?", [(row_id,) for row_id, _ in rows])
+    cur.executemany(
+        "INSERT OR IGNORE INTO catalog_genres (catalog_id, genre) VALUES (?, ?)",
+        [(row_id, genre) for row_id, genres in rows for genre in split_genres(genres)],
+    )
+
+
+def write_view_genres(cur: sqlite3.Cursor, rows: Iterable[Tuple[int, int, Any, Optional[str]]]) -> None:
+    # rows — (view_id, user_id, genre, view_date); дата нужна ключу постраничной истории по жанру
+    cur.executemany(
+        "INSERT OR IGNORE INTO view_genres (view_id, user_id, genre, view_date) VALUES (?, ?, ?, ?)",
+        [
+            (view_id, user_id, genre, view_date)
+            for view_id, user_id, genres, view_date in rows
+            for genre in split_genres(genres)
+        ],
+    )
+
+
+# Строки с genre = '' хранят итоги по типу, строки с жанром — разбивку по жанрам
+USER_STATS_SELECT = """
+    SELECT user_id, IFNULL(type, ''), '', IFNULL(substr(view_date, 1, 10), ''),
+           COUNT(*), IFNULL(SUM(duration_minutes), 0), IFNULL(SUM(user_rate), 0), COUNT(user_rate)
+    FROM views
+    GROUP BY 1, 2, 3, 4
+    UNION ALL
+    SELECT v.user_id, IFNULL(v.type, ''), g.genre, IFNULL(substr(v.view_date, 1, 10), ''),
+           COUNT(*), IFNULL(SUM(v.duration_minutes), 0), IFNULL(SUM(v.user_rate), 0), COUNT(v.user_rate)
+    FROM view_genres AS g
+    JOIN views AS v ON v.id = g.view_id
+    GROUP BY 1, 2, 3, 4
+"""
+
+
+# user_totals — те же группы без дня: /stats читает по строке на тип и жанр, а не на каждый день просмотров
+USER_TOTALS_SELECT = """
+    SELECT user_id, type, genre, SUM(views), SUM(minutes), SUM(rate_sum), SUM(rate_count)
+    FROM user_stats
+    GROUP BY 1, 2, 3
+"""
+
+
+def write_user_stats(cur: sqlite3.Cursor, user_id: int, view: Dict[str, Any]) -> None:
+    minutes = view.get("duration_minutes") or 0
+    rate = view.get("user_rate")
+    day = (view.get("view_date") or "")[:10]
+    rows = [
+        (user_id, view.get("type") or "", genre, minutes, rate or 0, 0 if rate is None else 1)
+        for genre in [""] + split_genres(view.get("genre"))
+    ]
     cur.executemany(
         """
-        INSERT INTO catalog (name, type, genre, certificate, imdb_rate, votes, episodes)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO user_stats (user_id, type, genre, day, views, minutes, rate_sum, rate_count)
+        VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+        ON CONFLICT (user_id, type, genre, day) DO UPDATE SET
+            views = views + 1,
+            minutes = minutes + excluded.minutes,
+            rate_sum = rate_sum + excluded.rate_sum,
+            rate_count = rate_count + excluded.rate_count
+        """,
+        [row[:3] + (day,) + row[3:] for row in rows],
+    )
+    cur.executemany(
+        """
+        INSERT INTO user_totals (user_id, type, genre, views, minutes, rate_sum, rate_count)
+        VALUES (?, ?, ?, 1, ?, ?, ?)
+        ON CONFLICT (user_id, type, genre) DO UPDATE SET
+            views = views + 1,
+            minutes = minutes + excluded.minutes,
+            rate_sum = rate_sum + excluded.rate_sum,
+            rate_count = rate_count + excluded.rate_count
         """,
         rows,
     )
-    conn.commit()
-    conn.close()
 
 
-def find_in_catalog(title: str):
-    pattern = title.strip()
+def _rebuild_user_stats(cur: sqlite3.Cursor) -> None:
+    cur.execute("DELETE FROM user_stats")
+    cur.execute(f"INSERT INTO user_stats {USER_STATS_SELECT}")
+
+
+def _rebuild_user_totals(cur: sqlite3.Cursor) -> None:
+    cur.execute("DELETE FROM user_totals")
+    cur.execute(f"INSERT INTO user_totals {USER_TOTALS_SELECT}")
+
+
+@metrics.timed("data")
+def rebuild_user_stats() -> None:
     conn = get_conn()
     cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        _rebuild_user_stats(cur)
+        _rebuild_user_totals(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+@metrics.timed("data")
+def check_user_stats() -> int:
+    # Сверка с полным пересчётом по views: число расходящихся групп в обе стороны
+    cur = get_conn().cursor()
     cur.execute(
+        f"""
+        WITH recomputed (user_id, type, genre, day, views, minutes, rate_sum, rate_count) AS (
+            {USER_STATS_SELECT}
+        ),
+        expected AS (
+            SELECT user_id, type, genre, day, views, minutes, ROUND(rate_sum, 6), rate_count
+            FROM recomputed
+        ),
+        actual AS (
+            SELECT user_id, type, genre, day, views, minutes, ROUND(rate_sum, 6), rate_count
+            FROM user_stats
+        ),
+        expected_totals AS (
+            SELECT user_id, type, genre, SUM(views), SUM(minutes), ROUND(SUM(rate_sum), 6), SUM(rate_count)
+            FROM recomputed
+            GROUP BY 1, 2, 3
+        ),
+        actual_totals AS (
+            SELECT user_id, type, genre, views, minutes, ROUND(rate_sum, 6), rate_count
+            FROM user_totals
+        )
+        SELECT
+            (SELECT COUNT(*) FROM (SELECT * FROM expected EXCEPT SELECT * FROM actual))
+            + (SELECT COUNT(*) FROM (SELECT * FROM actual EXCEPT SELECT * FROM expected))
+            + (SELECT COUNT(*) FROM (SELECT * FROM expected_totals EXCEPT SELECT * FROM actual_totals))
+            + (SELECT COUNT(*) FROM (SELECT * FROM actual_totals EXCEPT SELECT * FROM expected_totals))
         """
-        SELECT name, type, genre, certificate, imdb_rate
-        FROM catalog
-        WHERE name LIKE ? COLLATE NOCASE
-        LIMIT 1
-        """,
-        (pattern,),
     )
-    row = cur.fetchone()
-    if not row:
-        cur.execute(
+    return cur.fetchone()[0]
+
+
+def write_meta(cur: sqlite3.Cursor, key: str, value: str) -> None:
+    cur.execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+
+def _stamp_catalog(cur: sqlite3.Cursor, source: str = "") -> None:
+    # Отметка "каталог загружен": по ней тёплый старт не пересчитывает каталог и не тянет pandas
+    cur.execute("SELECT COUNT(*) FROM catalog")
+    rows = cur.fetchone()[0]
+    if rows:
+        write_meta(cur, "catalog", f"{rows} {source}".strip())
+
+
+def _backfill_genres(cur: sqlite3.Cursor) -> None:
+    cur.execute("SELECT id, genre FROM catalog")
+    write_catalog_genres(cur, cur.fetchall(), replace=False)
+    # Схема view_genres версии 4 ещё без view_date: её заполняет миграция 10
+    cur.execute("SELECT id, user_id, genre FROM views")
+    cur.executemany(
+        "INSERT OR IGNORE INTO view_genres (view_id, user_id, genre) VALUES (?, ?, ?)",
+        [(view_id, user_id, genre) for view_id, user_id, genres in cur.fetchall() for genre in split_genres(genres)],
+    )
+
+
+# (версия, шаги): шаг — SQL-строка или функция от курсора. Версия хранится в PRAGMA user_version.
+MIGRATIONS: List[Tuple[int, List[Any]]] = [
+    (
+        1,
+        [
             """
-            SELECT name, type, genre, certificate, imdb_rate
-            FROM catalog
-            WHERE name LIKE ? COLLATE NOCASE
-            ORDER BY imdb_rate DESC NULLS LAST
-            LIMIT 1
+            CREATE TABLE IF NOT EXISTS catalog (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT COLLATE NOCASE,
+                type TEXT,
+                genre TEXT,
+                certificate TEXT,
+                imdb_rate REAL,
+                votes INTEGER,
+                episodes INTEGER
+            )
             """,
-            (f"%{pattern}%",),
-        )
-        row = cur.fetchone()
-    conn.close()
-    if row:
-        return {
-            "name": row[0],
-            "type": row[1],
-            "genre": row[2],
-            "certificate": row[3],
-            "imdb_rate": row[4],
-        }
-    return None
+            """
+            CREATE TABLE IF NOT EXISTS views (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                name TEXT,
+                type TEXT,
+                genre TEXT,
+                certificate TEXT,
+                imdb_rate REAL,
+                user_rate REAL,
+                view_date TEXT,
+                duration_minutes INTEGER
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        [
+            "CREATE INDEX IF NOT EXISTS idx_views_user_id ON views(user_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_views_user_date "
+            "ON views(user_id, view_date, user_rate, duration_minutes)",
+            "CREATE INDEX IF NOT EXISTS idx_views_user_type "
+            "ON views(user_id, type, duration_minutes, user_rate)",
+            "CREATE INDEX IF NOT EXISTS idx_views_user_genre ON views(user_id, genre)",
+            "CREATE INDEX IF NOT EXISTS idx_catalog_genre_rate ON catalog(genre, imdb_rate)",
+            _add_catalog_name_norm,
+        ],
+    ),
+    (
+        3,
+        [
+            "ALTER TABLE catalog ADD COLUMN duration INTEGER",
+            "ALTER TABLE catalog ADD COLUMN year INTEGER",
+            "ALTER TABLE catalog ADD COLUMN nudity TEXT",
+            "ALTER TABLE catalog ADD COLUMN violence TEXT",
+            "ALTER TABLE catalog ADD COLUMN profanity TEXT",
+            "ALTER TABLE catalog ADD COLUMN alcohol TEXT",
+            "ALTER TABLE catalog ADD COLUMN frightening TEXT",
+        ],
+    ),
+    (
+        4,
+        [
+            """
+            CREATE TABLE IF NOT EXISTS catalog_genres (
+                catalog_id INTEGER NOT NULL,
+                genre TEXT NOT NULL,
+                PRIMARY KEY (catalog_id, genre)
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_catalog_genres_genre ON catalog_genres(genre, catalog_id)",
+            """
+            CREATE TABLE IF NOT EXISTS view_genres (
+                view_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                genre TEXT NOT NULL,
+                PRIMARY KEY (view_id, genre)
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_view_genres_user ON view_genres(user_id, genre)",
+            _backfill_genres,
+        ],
+    ),
+    (
+        5,
+        [
+            """
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                genre TEXT NOT NULL,
+                day TEXT NOT NULL,
+                views INTEGER NOT NULL,
+                minutes INTEGER NOT NULL,
+                rate_sum REAL NOT NULL,
+                rate_count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, type, genre, day)
+            ) WITHOUT ROWID
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_user_stats_day ON user_stats(user_id, genre, day)",
+            _rebuild_user_stats,
+        ],
+    ),
+    (6, ["CREATE INDEX IF NOT EXISTS idx_catalog_rate ON catalog(imdb_rate DESC)"]),
+    (
+        7,
+        [
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID",
+            _stamp_catalog,
+        ],
+    ),
+    # Ключ (user_id, view_date, rowid) — курсор постраничной истории по дате
+    (8, ["CREATE INDEX IF NOT EXISTS idx_views_user_day ON views(user_id, view_date)"]),
+    (
+        9,
+        [
+            """
+            CREATE TABLE IF NOT EXISTS user_totals (
+                user_id INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                genre TEXT NOT NULL,
+                views INTEGER NOT NULL,
+                minutes INTEGER NOT NULL,
+                rate_sum REAL NOT NULL,
+                rate_count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, type, genre)
+            ) WITHOUT ROWID
+            """,
+            _rebuild_user_totals,
+        ],
+    ),
+    # Дата просмотра в view_genres: история по жанру листается тем же ключом (view_date, id), что и без фильтра
+    (
+        10,
+        [
+            "ALTER TABLE view_genres ADD COLUMN view_date TEXT",
+            "UPDATE view_genres SET view_date = (SELECT v.view_date FROM views AS v WHERE v.id = view_genres.view_id)",
+            "DROP INDEX IF EXISTS idx_view_genres_user",
+            "CREATE INDEX IF NOT EXISTS idx_view_genres_user_date ON view_genres(user_id, genre, view_date, view_id)",
+        ],
+    ),
+    # Индексы, которых нет ни в одном плане горячих запросов (tests/test_query_plans.py): запросы ушли на user_stats, view_genres и векторы каталога
+    (
+        11,
+        [
+            "DROP INDEX IF EXISTS idx_views_user_date",
+            "DROP INDEX IF EXISTS idx_views_user_genre",
+            "DROP INDEX IF EXISTS idx_catalog_genre_rate",
+            "DROP INDEX IF EXISTS idx_catalog_rate",
+        ],
+    ),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
 
 
-def fuzzy_catalog(title: str, limit: int = 5) -> List[Dict[str, Any]]:
-    pattern = f"%{title.strip()}%"
+def init_db() -> None:
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT name, type, genre, certificate, imdb_rate
-        FROM catalog
-        WHERE name LIKE ?
-        ORDER BY imdb_rate DESC NULLS LAST
-        LIMIT ?
-        """,
-        (pattern, limit),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    return [
-        {
-            "name": r[0],
-            "type": r[1],
-            "genre": r[2],
-            "certificate": r[3],
-            "imdb_rate": r[4],
-        }
-        for r in rows
-    ]
+    cur.execute("PRAGMA user_version")
+    version = cur.fetchone()[0]
+    migrated = False
+    for target, steps in MIGRATIONS:
+        if target <= version:
+            continue
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(cur)
+                else:
+                    cur.execute(step)
+            cur.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+        migrated = True
+    if migrated:
+        cur.execute("ANALYZE")
+        conn.commit()
+
+
+def is_warm_start() -> bool:
+    # Схема актуальна и каталог уже загружен: миграции и load_catalog_if_empty() можно пропустить
+    cur = get_conn().cursor()
+    cur.execute("PRAGMA user_version")
+    if cur.fetchone()[0] != SCHEMA_VERSION:
+        return False
+    cur.execute("SELECT 1 FROM meta WHERE key = 'catalog'")
+    return cur.fetchone() is not None
+
+
+def startup() -> bool:
+    warm = is_warm_start()
+    if not warm:
+        init_db()
+        load_catalog_if_empty()
+    # Снимок, векторы каталога и индекс названий строим до первого апдейта, а не на первом /recommend
+    catalog_snapshot()
+    catalog_vectors()
+    title_index()
+    return warm
+
+
+CATALOG_INSERT_COLUMNS = [db_col for _, db_col in CATALOG_FIELDS]
+
+
+@metrics.timed("data")
+def load_catalog_if_empty() -> None:
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT key, value FROM meta WHERE key IN ('catalog', 'catalog_import')")
+    meta = dict(cur.fetchall())
+    pending = meta.get("catalog_import")
+    if pending is not None:
+        # import_catalog фиксирует каждый чанк отдельно: прерванный импорт повторяем в том же режиме.
+        # Upsert идемпотентен, а replace всё равно успел очистить каталог
+        mode, _, path = pending.partition(" ")
+        if mode == "replace":
+            path = path if os.path.exists(path) else CATALOG_CSV
+            if os.path.exists(path):
+                import_catalog(path, replace=True, cache_dir=CATALOG_CACHE or None)
+                return
+        elif os.path.exists(path):
+            import_catalog(path, cache_dir=CATALOG_CACHE or None)
+            return
+        catalog_log.warning("импорт каталога %s прерван, а файла больше нет: каталог оставлен как есть", path)
+    elif "catalog" in meta:
+        return
+    cur.execute("SELECT 1 FROM catalog LIMIT 1")
+    if cur.fetchone() is not None:
+        # Каталог заполнен не импортом (тайтлы из /add и /import, когда imdb.csv ещё не было):
+        # строки пользователей не удаляем — CSV, если он появился, дописываем upsert'ом
+        if os.path.exists(CATALOG_CSV):
+            import_catalog(CATALOG_CSV, cache_dir=CATALOG_CACHE or None)
+        else:
+            cur.execute("DELETE FROM meta WHERE key = 'catalog_import'")
+            _stamp_catalog(cur)
+            conn.commit()
+        return
+
+    if not os.path.exists(CATALOG_CSV):
+        return
+
+    import_catalog(CATALOG_CSV, replace=True, cache_dir=CATALOG_CACHE or None)
+
+
+@metrics.timed("data")
+def import_catalog(
+    path: str,
+    replace: bool = False,
+    chunksize: int = CHUNK_ROWS,
+    progress: Optional[Callable[[int, float], None]] = None,
+    cache_dir: Optional[str] = None,
+) -> int:
+    columns = ", ".join(CATALOG_INSERT_COLUMNS)
+    placeholders = ", ".join("?" * len(CATALOG_INSERT_COLUMNS))
+    updates = ", ".join(f"{col} = s.{col}" for col in CATALOG_INSERT_COLUMNS)
+    conn = get_conn()
+    cur = conn.cursor()
+    # Пока импорт не закончен, вместо отметки лежит catalog_import: прерванная загрузка повторится
+    # на следующем старте. catalog_digest — хэш CSV, из которого каталог загружен целиком; после upsert каталог ему уже не равен
+    cur.execute("DELETE FROM meta WHERE key IN ('catalog', 'catalog_digest')")
+    write_meta(cur, "catalog_import", f"{'replace' if replace else 'upsert'} {os.path.abspath(path)}")
+    if replace:
+        cur.execute("DELETE FROM catalog")
+        cur.execute("DELETE FROM catalog_genres")
+    conn.commit()
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS catalog_staging AS SELECT {columns} FROM catalog WHERE 0")
+    total = 0
+    started = time.perf_counter()
+    # Каждый чанк — отдельная транзакция: пиковая память и длина блокировки не зависят от размера CSV
+    for chunk in iter_catalog_frames(path, chunksize=chunksize, cache_dir=cache_dir):
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            if replace:
+                cur.execute("SELECT IFNULL(MAX(id), 0) FROM catalog")
+                last_id = cur.fetchone()[0]
+                cur.executemany(f"INSERT INTO catalog ({columns}) VALUES ({placeholders})", catalog_rows(chunk))
+                cur.execute("SELECT id, genre FROM catalog WHERE id > ?", (last_id,))
+                write_catalog_genres(cur, cur.fetchall(), replace=False)
+            else:
+                # Upsert по (name_norm, type): обновляем известные тайтлы, новые добавляем
+                cur.execute("DELETE FROM catalog_staging")
+                cur.executemany(
+                    f"INSERT INTO catalog_staging ({columns}) VALUES ({placeholders})", catalog_rows(chunk)
+                )
+                cur.execute(
+                    """
+                    DELETE FROM catalog_staging
+                    WHERE rowid NOT IN (SELECT MAX(rowid) FROM catalog_staging GROUP BY name_norm, type)
+                    """
+                )
+                cur.execute(
+                    f"""
+                    UPDATE catalog SET {updates}
+                    FROM catalog_staging AS s
+                    WHERE catalog.name_norm = s.name_norm AND catalog.type IS s.type
+                    """
+                )
+                cur.execute(
+                    f"""
+                    INSERT INTO catalog ({columns})
+                    SELECT {columns} FROM catalog_staging AS s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM catalog AS c WHERE c.name_norm = s.name_norm AND c.type IS s.type
+                    )
+                    """
+                )
+                cur.execute(
+                    """
+                    SELECT c.id, c.genre FROM catalog AS c
+                    JOIN catalog_staging AS s ON c.name_norm = s.name_norm AND c.type IS s.type
+                    """
+                )
+                write_catalog_genres(cur, cur.fetchall())
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        total += len(chunk)
+        if progress:
+            progress(total, time.perf_counter() - started)
+    cur.execute("DROP TABLE IF EXISTS catalog_staging")
+    cur.execute("DELETE FROM meta WHERE key = 'catalog_import'")
+    _stamp_catalog(cur, os.path.basename(path))
+    if replace:
+        write_meta(cur, "catalog_digest", file_digest(path))
+    conn.commit()
+    reset_title_index()
+    reset_catalog_snapshot()
+    reset_catalog_vectors()
+    _recommendation_cache.clear()
+    _title_cache.clear()
+    return total
+
+
+_title_index: Optional[TitleIndex] = None
+_title_index_lock = threading.Lock()
+
+
+def title_index() -> TitleIndex:
+    global _title_index
+    index = _title_index
+    if index is None:
+        with _title_index_lock:
+            if _title_index is None:
+                cur = get_conn().cursor()
+                cur.execute("SELECT id, name_norm, imdb_rate FROM catalog")
+                index = TitleIndex()
+                index.add_many(cur)
+                _title_index = index
+            index = _title_index
+    return index
+
+
+def reset_title_index() -> None:
+    global _title_index
+    with _title_index_lock:
+        _title_index = None
+
+
+_catalog_snapshot: Optional[CatalogSnapshot] = None
+_catalog_snapshot_lock = threading.Lock()
+
+
+def catalog_snapshot() -> CatalogSnapshot:
+    global _catalog_snapshot
+    snapshot = _catalog_snapshot
+    if snapshot is None:
+        with _catalog_snapshot_lock:
+            if _catalog_snapshot is None:
+                cur = get_conn().cursor()
+                cur.execute(
+                    """
+                    SELECT id, name, name_norm, type, genre, certificate, imdb_rate, votes, episodes
+                    FROM catalog
+                    ORDER BY id
+                    """
+                )
+                _catalog_snapshot = CatalogSnapshot.from_rows(cur)
+            snapshot = _catalog_snapshot
+    return snapshot
+
+
+def reset_catalog_snapshot() -> None:
+    global _catalog_snapshot
+    with _catalog_snapshot_lock:
+        _catalog_snapshot = None
+
+
+def _catalog_rows_by_id(ids: List[int]) -> List[CatalogRecord]:
+    return catalog_snapshot().records(ids)
+
+
+@metrics.timed("data")
+def find_in_catalog(title: str) -> Optional[CatalogRecord]:
+    return _find_record(catalog_snapshot(), title_index(), normalize_title(title))
+
+
+def _find_record(snapshot: CatalogSnapshot, index: TitleIndex, pattern: str) -> Optional[CatalogRecord]:
+    record = snapshot.find(pattern)
+    if record is None:
+        records = snapshot.records(index.containing(pattern, limit=1))
+        record = records[0] if records else None
+    return record
+
+
+@metrics.timed("data")
+def fuzzy_catalog(title: str, limit: int = 5) -> List[CatalogRecord]:
+    return _catalog_rows_by_id(title_index().search(normalize_title(title), limit=limit))
 
 
+TITLE_CACHE_SIZE = 4096
+TITLE_CACHE_TTL = 3600
+# Запрос, по которому ничего не нашлось, помним недолго: тайтл могут вот-вот завести через /add или импорт
+TITLE_MISS_TTL = 60
+
+# Нормализованный запрос из /add -> (точное совпадение, похожие варианты); сбрасывается при записи в каталог
+_title_cache = TTLCache(TITLE_CACHE_SIZE, TITLE_CACHE_TTL)
+metrics.register_gauges("tracker_title_cache", "Кэш поиска названий в /add", _title_cache.counters)
+
+
+@metrics.timed("data")
+def resolve_title(title: str) -> Tuple[Optional[CatalogRecord], List[CatalogRecord]]:
+    # find_in_catalog и, если точного совпадения нет, fuzzy_catalog — одним вызовом и с кэшем
+    pattern = normalize_title(title)
+    cached = _title_cache.get(pattern)
+    if cached is None:
+        token = _title_cache.token(pattern)
+        index = title_index()
+        exact = _find_record(catalog_snapshot(), index, pattern)
+        suggestions = [] if exact is not None else _catalog_rows_by_id(index.search(pattern, limit=5))
+        cached = (exact, suggestions)
+        _title_cache.set(pattern, cached, token, ttl=None if exact is not None or suggestions else TITLE_MISS_TTL)
+    return cached
+
+
+@metrics.timed("data")
 def insert_catalog_entry(entry: Dict[str, Any]) -> None:
     conn = get_conn()
     cur = conn.cursor()
+    row_id = write_catalog_entry(cur, entry)
+    conn.commit()
+    catalog_entry_committed(row_id, entry)
+
+
+def write_catalog_entry(cur: sqlite3.Cursor, entry: Dict[str, Any]) -> int:
     cur.execute(
         """
-        INSERT INTO catalog (name, type, genre, certificate, imdb_rate, votes, episodes)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO catalog (name, name_norm, type, genre, certificate, imdb_rate, votes, episodes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             entry.get("name"),
+            normalize_title(entry.get("name")),
             entry.get("type"),
             entry.get("genre"),
             entry.get("certificate"),
@@ -204,13 +996,75 @@ def insert_catalog_entry(entry: Dict[str, Any]) -> None:
             entry.get("episodes"),
         ),
     )
-    conn.commit()
-    conn.close()
+    row_id = cur.lastrowid
+    write_catalog_genres(cur, [(row_id, entry.get("genre"))], replace=False)
+    return row_id
+
+
+def catalog_entry_committed(row_id: int, entry: Dict[str, Any]) -> None:
+    catalog_entries_committed([(row_id, entry)])
+
+
+def catalog_entries_committed(items: List[Tuple[int, Dict[str, Any]]]) -> None:
+    # Кэши и индексы в памяти обновляются только после фиксации транзакции, пачкой на весь импорт
+    global _catalog_snapshot
+    _recommendation_cache.clear()
+    _title_cache.clear()
+    with _catalog_snapshot_lock:
+        if _catalog_snapshot is not None:
+            _catalog_snapshot = _catalog_snapshot.with_entries(
+                [
+                    (
+                        row_id,
+                        entry.get("name"),
+                        normalize_title(entry.get("name")),
+                        entry.get("type"),
+                        entry.get("genre"),
+                        entry.get("certificate"),
+                        entry.get("imdb_rate"),
+                        entry.get("votes"),
+                        entry.get("episodes"),
+                    )
+                    for row_id, entry in items
+                ]
+            )
+    if _catalog_vectors is not None:
+        _catalog_vectors.extend(
+            [
+                (
+                    row_id,
+                    normalize_title(entry.get("name")),
+                    entry.get("type"),
+                    entry.get("genre"),
+                    entry.get("certificate"),
+                    entry.get("imdb_rate"),
+                    entry.get("votes"),
+                )
+                for row_id, entry in items
+            ]
+        )
+    if _title_index is not None:
+        _title_index.add_many(
+            [(row_id, normalize_title(entry.get("name")), entry.get("imdb_rate")) for row_id, entry in items]
+        )
 
 
+@metrics.timed("data")
 def insert_view(user_id: int, view: Dict[str, Any]) -> None:
     conn = get_conn()
     cur = conn.cursor()
+    write_view(cur, user_id, view)
+    conn.commit()
+    views_committed(user_id)
+
+
+def views_committed(user_id: int) -> None:
+    # Новый просмотр меняет рекомендации и все готовые ответы пользователя
+    _recommendation_cache.invalidate(user_id)
+    response_cache.bump(user_id)
+
+
+def write_view(cur: sqlite3.Cursor, user_id: int, view: Dict[str, Any]) -> None:
     cur.execute(
         """
         INSERT INTO views (user_id, name, type, genre, certificate, imdb_rate, user_rate, view_date, duration_minutes)
@@ -228,10 +1082,104 @@ def insert_view(user_id: int, view: Dict[str, Any]) -> None:
             view.get("duration_minutes"),
         ),
     )
-    conn.commit()
-    conn.close()
+    write_view_genres(cur, [(cur.lastrowid, user_id, view.get("genre"), view.get("view_date"))])
+    write_user_stats(cur, user_id, view)
+
+
+IMPORT_MAX_BYTES = 5 * 1024 * 1024
+# Порог похожести для ambiguous: опечатки в названии набирают 0.65+, случайные общие слова — около 0.5
+IMPORT_AMBIGUOUS_SCORE = 0.6
+IMPORT_EXAMPLES = 5
+
+
+@metrics.timed("data")
+def match_titles(titles: Iterable[str]) -> Dict[str, Tuple[str, Optional[CatalogRecord]]]:
+    # Один проход по снимку каталога и индексу названий в памяти, без запроса к базе на строку файла.
+    # matched — только точное совпадение названия. Вхождение подстроки ("War" в "Star Wars: ...")
+    # и похожие названия с score не ниже IMPORT_AMBIGUOUS_SCORE — ambiguous: подставлять их вместо названия
+    # из файла нельзя. new — всё остальное, в том числе одно общее слово с тайтлом каталога
+    snapshot = catalog_snapshot()
+    index = title_index()
+    matches: Dict[str, Tuple[str, Optional[CatalogRecord]]] = {}
+    for title in titles:
+        pattern = normalize_title(title)
+        if pattern in matches:
+            continue
+        record = snapshot.find(pattern)
+        if record is not None:
+            matches[pattern] = ("matched", record)
+        elif index.containing(pattern, limit=1) or index.search(pattern, limit=1, min_score=IMPORT_AMBIGUOUS_SCORE):
+            matches[pattern] = ("ambiguous", None)
+        else:
+            matches[pattern] = ("new", None)
+    return matches
+
+
+def prepare_import(data: bytes, filename: str) -> Tuple[List[Dict[str, Any]], Dict[str, int], Dict[str, Tuple[str, Any]]]:
+    entries, skipped = read_history(data, filename)
+    return entries, skipped, match_titles(entry["name"] for entry in entries)
+
+
+@metrics.timed("data")
+def import_views(
+    user_id: int, entries: List[Dict[str, Any]], matches: Dict[str, Tuple[str, Optional[CatalogRecord]]]
+) -> Dict[str, Any]:
+    # Все просмотры и новые тайтлы — одна транзакция: файл импортируется целиком или не импортируется
+    conn = get_conn()
+    cur = conn.cursor()
+    counts = {"matched": 0, "ambiguous": 0, "new": 0}
+    created: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    ambiguous: List[str] = []
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        for entry in entries:
+            pattern = normalize_title(entry["name"])
+            status, record = matches[pattern]
+            if status == "matched":
+                content: Any = record
+            elif status == "new":
+                # Новый тайтл попадает в каталог, как после "новый" в /add, один раз на файл
+                if pattern not in created:
+                    item = {
+                        "name": entry["name"],
+                        "type": entry["type"],
+                        "genre": entry["genre"],
+                        "certificate": entry["certificate"],
+                        "imdb_rate": None,
+                    }
+                    created[pattern] = (write_catalog_entry(cur, item), item)
+                content = created[pattern][1]
+            else:
+                # Похожие названия есть, но выбирать за пользователя не будем: просмотр сохраняется как в файле
+                content = entry
+                if len(ambiguous) < IMPORT_EXAMPLES and entry["name"] not in ambiguous:
+                    ambiguous.append(entry["name"])
+            counts[status] += 1
+            write_view(
+                cur,
+                user_id,
+                {
+                    "name": content["name"],
+                    "type": content.get("type"),
+                    "genre": content.get("genre"),
+                    "certificate": content.get("certificate"),
+                    "imdb_rate": content.get("imdb_rate"),
+                    "user_rate": entry["user_rate"],
+                    "view_date": entry["view_date"],
+                    "duration_minutes": entry["duration_minutes"] or default_duration(content.get("type")),
+                },
+            )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    views_committed(user_id)
+    if created:
+        catalog_entries_committed(list(created.values()))
+    return {**counts, "created": len(created), "ambiguous_titles": ambiguous}
 
 
+@metrics.timed("data")
 def get_last_views(user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
     conn = get_conn()
     cur = conn.cursor()
@@ -246,7 +1194,6 @@ def get_last_views(user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
         (user_id, limit),
     )
     rows = cur.fetchall()
-    conn.close()
     return [
         {
             "name": r[0],
@@ -260,14 +1207,108 @@ def get_last_views(user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
     ]
 
 
+HISTORY_PAGE = 10
+HISTORY_COLUMNS = ("id", "name", "user_rate", "type", "genre", "view_date", "duration_minutes")
+# Курсор — последняя показанная запись: (view_date, id)
+HistoryCursor = Tuple[str, int]
+
+
+@metrics.timed("data")
+def history_page(
+    user_id: int,
+    cursor: Optional[HistoryCursor] = None,
+    older: bool = True,
+    page_size: int = HISTORY_PAGE,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    genre: Optional[str] = None,
+) -> Dict[str, Any]:
+    # Пагинация по ключу, а не OFFSET: каждая страница — поиск по индексу от курсора,
+    # цена не зависит от того, как глубоко листает пользователь
+    conn = get_conn()
+    cur = conn.cursor()
+    cmp, order = ("<", "DESC") if older else (">", "ASC")
+    lo, hi = date_from or "", date_to or "9999-12-31"
+    if cursor:
+        # Курсор сужает сам диапазон дат: SQLite ищет по индексу от него, а не от края фильтра.
+        # Остаток условия отсекает только записи того же дня
+        if older:
+            hi = min(hi, cursor[0])
+        else:
+            lo = max(lo, cursor[0])
+    last_date, last_id = cursor if cursor else ("", 0) if not older else ("9999-12-31", 2**63 - 1)
+    if genre:
+        # Тот же ключ (view_date, id) по индексу view_genres(user_id, genre, view_date, view_id)
+        cur.execute(
+            f"""
+            SELECT v.id, v.name, v.user_rate, v.type, v.genre, v.view_date, v.duration_minutes
+            FROM view_genres AS g
+            JOIN views AS v ON v.id = g.view_id
+            WHERE g.user_id = ? AND g.genre = ? AND g.view_date >= ? AND g.view_date <= ?
+              AND (g.view_date {cmp} ? OR g.view_id {cmp} ?)
+            ORDER BY g.view_date {order}, g.view_id {order}
+            LIMIT ?
+            """,
+            (user_id, genre, lo, hi, last_date, last_id, page_size + 1),
+        )
+    else:
+        cur.execute(
+            f"""
+            SELECT id, name, user_rate, type, genre, view_date, duration_minutes
+            FROM views
+            WHERE user_id = ? AND view_date >= ? AND view_date <= ?
+              AND (view_date {cmp} ? OR id {cmp} ?)
+            ORDER BY view_date {order}, id {order}
+            LIMIT ?
+            """,
+            (user_id, lo, hi, last_date, last_id, page_size + 1),
+        )
+    rows = cur.fetchall()
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not older:
+        rows.reverse()
+    items = [dict(zip(HISTORY_COLUMNS, r)) for r in rows]
+    has_older = more if older else bool(items)
+    has_newer = cursor is not None if older else more
+    return {
+        "items": items,
+        "older": (items[-1]["view_date"], items[-1]["id"]) if items and has_older else None,
+        "newer": (items[0]["view_date"], items[0]["id"]) if items and has_newer else None,
+    }
+
+
+@metrics.timed("data")
+def export_views(user_id: int, fmt: str, path: Union[str, IO], batch_size: int = EXPORT_BATCH) -> int:
+    # Строки идут из курсора пачками прямо в файл: память ограничена пачкой, а не длиной истории
+    cur = get_conn().cursor()
+    cur.execute(
+        f"SELECT {', '.join(EXPORT_COLUMNS)} FROM views WHERE user_id = ? ORDER BY id",
+        (user_id,),
+    )
+    return write_export(path, fmt, iter_batches(cur, batch_size))
+
+
+def canonical_genre(user_id: int, genre: str) -> Optional[str]:
+    # Пользователь пишет "drama", в view_genres лежит "Drama"
+    cur = get_conn().cursor()
+    cur.execute(
+        "SELECT genre FROM view_genres WHERE user_id = ? AND genre = ? COLLATE NOCASE LIMIT 1",
+        (user_id, genre.strip()),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+@metrics.timed("data")
 def stats(user_id: int) -> Dict[str, Any]:
     conn = get_conn()
     cur = conn.cursor()
     cur.execute(
         """
-        SELECT type, COUNT(*), SUM(duration_minutes), AVG(user_rate)
-        FROM views
-        WHERE user_id = ?
+        SELECT NULLIF(type, ''), SUM(views), SUM(minutes), SUM(rate_sum) / NULLIF(SUM(rate_count), 0)
+        FROM user_totals
+        WHERE user_id = ? AND genre = ''
         GROUP BY type
         """,
         (user_id,),
@@ -276,9 +1317,9 @@ def stats(user_id: int) -> Dict[str, Any]:
 
     cur.execute(
         """
-        SELECT genre, COUNT(*) as cnt
-        FROM views
-        WHERE user_id = ?
+        SELECT genre, SUM(views) as cnt
+        FROM user_totals
+        WHERE user_id = ? AND genre <> ''
         GROUP BY genre
         ORDER BY cnt DESC
         LIMIT 5
@@ -286,74 +1327,94 @@ def stats(user_id: int) -> Dict[str, Any]:
         (user_id,),
     )
     top_genres = cur.fetchall()
-    conn.close()
     return {"per_type": per_type, "top_genres": top_genres}
 
 
-def recommendations(user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+RECOMMENDATION_CACHE_SIZE = 1024
+RECOMMENDATION_TTL = 600
+RECOMMENDATION_POOL = 50
+
+# Готовый ранжированный список кандидатов на пользователя; сбрасывается при записи просмотра или в каталог
+_recommendation_cache = TTLCache(RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_TTL)
+metrics.register_gauges("tracker_recommendation_cache", "Кэш рекомендаций", _recommendation_cache.counters)
+
+
+# Тексты ответов по пользователю и команде; поколение пользователя растёт в views_committed()
+response_cache = ResponseCache(RESPONSE_CACHE_BYTES)
+metrics.register_gauges("tracker_response_cache", "Кэш ответов /stats, /progress, /last", response_cache.counters)
+
+
+def last_view_id(user_id: int) -> int:
+    # Отметка для общего хранилища: id из AUTOINCREMENT не повторяются, поиск по idx_views_user_id
+    cur = get_conn().cursor()
+    cur.execute("SELECT MAX(id) FROM views WHERE user_id = ?", (user_id,))
+    return cur.fetchone()[0] or 0
+
+
+def cached_response(user_id: int, command: str, render: Callable[[int], str], variant: str = "") -> str:
+    return response_cache.get_or_render(user_id, command, render, variant, stamp=last_view_id)
+
+
+@metrics.timed("data")
+def recommendations(user_id: int, limit: int = 5) -> List[CatalogRecord]:
+    cached = _recommendation_cache.get(user_id)
+    if cached is None or limit > RECOMMENDATION_POOL:
+        token = _recommendation_cache.token(user_id)
+        cached = _rank_candidates(user_id, max(limit, RECOMMENDATION_POOL))
+        _recommendation_cache.set(user_id, cached, token)
+    # Записи снимка неизменяемы, поэтому их можно отдавать из кэша без копирования
+    return cached[:limit]
+
+
+_catalog_vectors: Optional[CatalogVectors] = None
+_catalog_vectors_lock = threading.Lock()
+
+
+def catalog_vectors() -> CatalogVectors:
+    global _catalog_vectors
+    vectors = _catalog_vectors
+    if vectors is None:
+        with _catalog_vectors_lock:
+            if _catalog_vectors is None:
+                cur = get_conn().cursor()
+                cur.execute("SELECT COUNT(*) FROM catalog")
+                size = cur.fetchone()[0]
+                # Курсор читается построчно: в памяти только массивы признаков, а не весь каталог списком
+                cur.execute(
+                    f"""
+                    SELECT id, name_norm, type, genre, certificate, imdb_rate, votes, {", ".join(ADVISORY_FIELDS)}
+                    FROM catalog
+                    """
+                )
+                _catalog_vectors = CatalogVectors(cur, size)
+            vectors = _catalog_vectors
+    return vectors
+
+
+def reset_catalog_vectors() -> None:
+    global _catalog_vectors
+    with _catalog_vectors_lock:
+        _catalog_vectors = None
+
+
+def _rank_candidates(user_id: int, limit: int) -> List[CatalogRecord]:
     conn = get_conn()
     cur = conn.cursor()
     cur.execute(
         """
-        SELECT DISTINCT name FROM views WHERE user_id = ?
+        SELECT name, type, genre, certificate, user_rate FROM views WHERE user_id = ?
         """,
         (user_id,),
     )
-    watched = {row[0].lower() for row in cur.fetchall()}
+    history = [(normalize_title(r[0]), r[1], r[2], r[3], r[4]) for r in cur.fetchall()]
+    vectors = catalog_vectors()
+    watched = {row[0] for row in history}
+    return _catalog_rows_by_id(vectors.top_k(vectors.profile(history), watched, limit))
 
-    cur.execute(
-        """
-        SELECT genre, COUNT(*) as cnt
-        FROM views
-        WHERE user_id = ?
-        GROUP BY genre
-        ORDER BY cnt DESC
-        LIMIT 3
-        """,
-        (user_id,),
-    )
-    fav_genres = [row[0] for row in cur.fetchall() if row[0]]
-
-    placeholders = ",".join("?" * len(fav_genres)) if fav_genres else None
-    if placeholders:
-        query = f"""
-            SELECT name, type, genre, certificate, imdb_rate
-            FROM catalog
-            WHERE LOWER(name) NOT IN ({",".join(["?"] * len(watched) or ["''"])})
-              AND genre IN ({placeholders})
-            ORDER BY imdb_rate DESC NULLS LAST
-            LIMIT ?
-        """
-        params: List[Any] = list(watched) if watched else []
-        params.extend(fav_genres)
-        params.append(limit)
-    else:
-        query = """
-            SELECT name, type, genre, certificate, imdb_rate
-            FROM catalog
-            WHERE LOWER(name) NOT IN (SELECT LOWER(name) FROM views WHERE user_id = ?)
-            ORDER BY imdb_rate DESC NULLS LAST
-            LIMIT ?
-        """
-        params = [user_id, limit]
 
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    return [
-        {
-            "name": r[0],
-            "type": r[1],
-            "genre": r[2],
-            "certificate": r[3],
-            "imdb_rate": r[4],
-        }
-        for r in rows
-    ]
-
-
-def progress(user_id: int) -> Dict[str, Any]:
-    today = datetime.utcnow().date()
+@metrics.timed("data")
+def progress(user_id: int, today: Optional[date] = None) -> Dict[str, Any]:
+    today = today or datetime.utcnow().date()
     period_len = 30
     curr_start = today - timedelta(days=period_len)
     prev_start = curr_start - timedelta(days=period_len)
@@ -363,14 +1424,13 @@ def progress(user_id: int) -> Dict[str, Any]:
         cur = conn.cursor()
         cur.execute(
             """
-            SELECT COUNT(*), AVG(user_rate), SUM(duration_minutes)
-            FROM views
-            WHERE user_id = ? AND date(view_date) BETWEEN ? AND ?
+            SELECT SUM(views), SUM(rate_sum) / NULLIF(SUM(rate_count), 0), SUM(minutes)
+            FROM user_stats
+            WHERE user_id = ? AND genre = '' AND day >= ? AND day < ?
             """,
-            (user_id, start.isoformat(), end.isoformat()),
+            (user_id, start.isoformat(), (end + timedelta(days=1)).isoformat()),
         )
         row = cur.fetchone()
-        conn.close()
         return {
             "count": row[0] or 0,
             "avg": round(row[1], 2) if row[1] else None,
@@ -382,6 +1442,99 @@ def progress(user_id: int) -> Dict[str, Any]:
         "previous": agg(prev_start, curr_start - timedelta(days=1)),
     }
 
+
+@metrics.timed("data")
+def user_report_data(user_id: int) -> Dict[str, Any]:
+    # Всё сворачивается в SQL: в процесс отрисовки уходят десятки строк, а не вся история
+    cur = get_conn().cursor()
+    cur.execute(
+        """
+        SELECT SUM(views), SUM(minutes), SUM(rate_sum) / NULLIF(SUM(rate_count), 0)
+        FROM user_totals
+        WHERE user_id = ? AND genre = ''
+        """,
+        (user_id,),
+    )
+    views, minutes, avg_rate = cur.fetchone()
+    cur.execute(
+        """
+        SELECT CAST(ROUND(user_rate) AS INTEGER), COUNT(*)
+        FROM views
+        WHERE user_id = ? AND user_rate IS NOT NULL
+        GROUP BY 1
+        """,
+        (user_id,),
+    )
+    ratings = cur.fetchall()
+    cur.execute(
+        """
+        SELECT genre, SUM(views) AS cnt, SUM(rate_sum) / NULLIF(SUM(rate_count), 0)
+        FROM user_totals
+        WHERE user_id = ? AND genre <> ''
+        GROUP BY genre
+        ORDER BY cnt DESC
+        LIMIT ?
+        """,
+        (user_id, REPORT_GENRES),
+    )
+    genres = cur.fetchall()
+    # Неделя начинается с понедельника: date(day, '-6 days', 'weekday 1')
+    cur.execute(
+        """
+        SELECT date(day, '-6 days', 'weekday 1') AS week, SUM(minutes)
+        FROM user_stats
+        WHERE user_id = ? AND genre = '' AND day <> ''
+        GROUP BY week
+        HAVING week IS NOT NULL
+        ORDER BY week DESC
+        LIMIT ?
+        """,
+        (user_id, REPORT_WEEKS),
+    )
+    weeks = cur.fetchall()[::-1]
+    cur.execute(
+        """
+        SELECT ROUND(imdb_rate), ROUND(user_rate), COUNT(*)
+        FROM views
+        WHERE user_id = ? AND imdb_rate IS NOT NULL AND user_rate IS NOT NULL
+        GROUP BY 1, 2
+        """,
+        (user_id,),
+    )
+    imdb_vs_user = cur.fetchall()
+    return {
+        "views": views or 0,
+        "minutes": minutes or 0,
+        "avg_rate": round(avg_rate, 2) if avg_rate else None,
+        "ratings": ratings,
+        "genres": genres,
+        "weeks": weeks,
+        "imdb_vs_user": imdb_vs_user,
+    }
+
+
+REPORT_WORKERS = 1
+_report_pool: Optional[ProcessPoolExecutor] = None
+_report_pool_lock = threading.Lock()
+
+
+def report_pool() -> ProcessPoolExecutor:
+    # spawn, а не fork: у бота уже работают потоки пулов, копировать их блокировки в дочерний процесс нельзя
+    global _report_pool
+    with _report_pool_lock:
+        if _report_pool is None:
+            _report_pool = ProcessPoolExecutor(REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _report_pool
+
+
+def shutdown_report_pool() -> None:
+    global _report_pool
+    with _report_pool_lock:
+        if _report_pool is not None:
+            _report_pool.shutdown(wait=True)
+            _report_pool = None
+
+@metrics.timed("handler")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Привет! Я веду дневник просмотров и делаю рекомендации.\n"
@@ -390,24 +1543,31 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@metrics.timed("handler")
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Доступные команды:\n"
         "/add — добавить просмотр\n"
         "/last — последние просмотры\n"
+        "/history [с] [по] [жанр] — вся история по страницам, например /history 2024-01-01 2024-06-30 Drama\n"
+        "/export [csv|jsonl|parquet] — выгрузить весь дневник файлом\n"
+        "/import — загрузить историю просмотров из CSV или JSON\n"
         "/stats — статистика по типам и жанрам\n"
         "/recommend — рекомендации по твоим любимым жанрам\n"
         "/progress — сравнение активности за 30 дней\n"
+        "/report — графики по твоему дневнику\n"
         "/help — помощь",
         reply_markup=main_markup,
     )
 
 
+@metrics.timed("handler")
 async def add_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Введи название фильма или сериала:", reply_markup=ReplyKeyboardRemove())
     return ADD_TITLE
 
 
+@metrics.timed("handler")
 async def add_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
 
@@ -437,7 +1597,7 @@ async def add_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
     title = text
     context.user_data["title"] = title
 
-    exact = find_in_catalog(title)
+    exact, suggestions = await db_read(resolve_title, title)
     if exact:
         context.user_data["content"] = exact
         await update.message.reply_text(
@@ -447,7 +1607,6 @@ async def add_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ADD_EXISTS_RATING
 
-    suggestions = fuzzy_catalog(title)
     if suggestions:
         text_resp = "Не нашёл точного совпадения. Похожие варианты:\n"
         for idx, item in enumerate(suggestions, 1):
@@ -464,6 +1623,7 @@ async def add_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ADD_NEW_DETAILS
 
 
+@metrics.timed("handler")
 async def add_new_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     parts = [p.strip() for p in update.message.text.split(",")]
     if len(parts) < 2:
@@ -482,12 +1642,13 @@ async def add_new_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "imdb_rate": None,
     }
     context.user_data["content"] = new_item
-    insert_catalog_entry(new_item)
+    await queue_catalog_entry(new_item)
 
     await update.message.reply_text("Принято. Теперь оцени от 1 до 10:")
     return ADD_NEW_RATING
 
 
+@metrics.timed("handler")
 async def add_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         rating = float(update.message.text)
@@ -502,6 +1663,7 @@ async def add_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ADD_DATE
 
 
+@metrics.timed("handler")
 async def add_new_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         rating = float(update.message.text)
@@ -516,6 +1678,7 @@ async def add_new_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ADD_DATE
 
 
+@metrics.timed("handler")
 async def add_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip().lower()
     if text == "сегодня":
@@ -534,10 +1697,11 @@ async def add_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ADD_DURATION
 
 
+@metrics.timed("handler")
 async def add_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip().lower()
     if text == "авто":
-        duration = 120 if context.user_data["content"].get("type", "").lower() != "series" else 45
+        duration = default_duration(context.user_data["content"].get("type"))
     else:
         try:
             duration = int(text)
@@ -556,30 +1720,175 @@ async def add_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "view_date": context.user_data["view_date"],
         "duration_minutes": duration,
     }
-    insert_view(update.effective_user.id, view)
+    await queue_view(update.effective_user.id, view)
     await update.message.reply_text("Добавил в дневник! Что дальше?", reply_markup=main_markup)
     return ConversationHandler.END
 
 
-async def last_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    items = get_last_views(update.effective_user.id, limit=5)
+def render_last(user_id: int) -> str:
+    items = get_last_views(user_id, limit=5)
     if not items:
-        await update.message.reply_text("Пока нет просмотров. Используй /add.")
-        return
+        return "Пока нет просмотров. Используй /add."
     lines = []
     for item in items:
         lines.append(
             f"{item['name']} — {item['user_rate']}/10, {item.get('type','')} "
             f"({item.get('genre','')}) {item.get('view_date','')}"
         )
+    return "\n".join(lines)
+
+
+@metrics.timed("handler")
+async def last_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = await db_read(cached_response, update.effective_user.id, "last", render_last)
+    await update.message.reply_text(text, reply_markup=main_markup)
+
+
+def render_history(page: Dict[str, Any], history_filters: Dict[str, Any]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    header = "История"
+    if history_filters.get("date_from") or history_filters.get("date_to"):
+        header += f" с {history_filters.get('date_from') or '…'} по {history_filters.get('date_to') or '…'}"
+    if history_filters.get("genre"):
+        header += f", жанр {history_filters['genre']}"
+    lines = [header + ":"]
+    for item in page["items"]:
+        lines.append(
+            f"{item.get('view_date','')} {item['name']} — {item['user_rate']}/10, {item.get('type','')} "
+            f"({item.get('genre','')})"
+        )
+    # Курсор едет в callback_data (до 64 байт): "hist:o:2024-05-01:1234"
+    buttons = []
+    if page["newer"]:
+        buttons.append(InlineKeyboardButton("« новее", callback_data="hist:n:{}:{}".format(*page["newer"])))
+    if page["older"]:
+        buttons.append(InlineKeyboardButton("старее »", callback_data="hist:o:{}:{}".format(*page["older"])))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+@metrics.timed("handler")
+async def history_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    history_filters: Dict[str, Any] = {}
+    genre_words = []
+    for arg in context.args or []:
+        try:
+            day = datetime.strptime(arg, "%Y-%m-%d").date().isoformat()
+        except ValueError:
+            genre_words.append(arg)
+            continue
+        history_filters["date_to" if "date_from" in history_filters else "date_from"] = day
+    if genre_words:
+        genre = await db_read(canonical_genre, user_id, " ".join(genre_words))
+        if genre is None:
+            await update.message.reply_text(f"В твоей истории нет жанра {' '.join(genre_words)}.")
+            return
+        history_filters["genre"] = genre
+    context.user_data["history_filters"] = history_filters
+    page = await db_read(history_page, user_id, **history_filters)
+    if not page["items"]:
+        await update.message.reply_text("Пока нет просмотров. Используй /add.")
+        return
+    text, markup = render_history(page, history_filters)
+    await update.message.reply_text(text, reply_markup=markup)
+
+
+@metrics.timed("handler")
+async def history_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, direction, view_date, view_id = query.data.split(":", 3)
+    history_filters = context.user_data.get("history_filters", {})
+    page = await db_read(
+        history_page,
+        update.effective_user.id,
+        (view_date, int(view_id)),
+        older=direction == "o",
+        **history_filters,
+    )
+    if not page["items"]:
+        return
+    text, markup = render_history(page, history_filters)
+    await query.edit_message_text(text, reply_markup=markup)
+
+
+@metrics.timed("handler")
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    fmt = (context.args[0].lower() if context.args else "csv").lstrip(".")
+    if fmt not in FORMATS:
+        await update.message.reply_text(f"Форматы выгрузки: {', '.join(FORMATS)}.")
+        return
+    if fmt == "parquet" and not parquet_available():
+        await update.message.reply_text("Parquet сейчас недоступен, попробуй /export csv или /export jsonl.")
+        return
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}", prefix="diary-")
+    os.close(fd)
+    try:
+        rows = await db_read(export_views, update.effective_user.id, fmt, path)
+        if not rows:
+            await update.message.reply_text("Пока нет просмотров. Используй /add.")
+            return
+        with open(path, "rb") as document:
+            await update.message.reply_document(
+                document=document,
+                filename=f"diary.{fmt}",
+                caption=f"Весь дневник: {rows} просмотров",
+                reply_markup=main_markup,
+            )
+    finally:
+        os.remove(path)
+
+
+@metrics.timed("handler")
+async def import_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Пришли файл .csv, .json или .jsonl с историей. Нужны колонки name и user_rate, "
+        "по желанию view_date, duration_minutes, type, genre, certificate.\n"
+        "Подходят выгрузка оценок IMDb (Your Ratings) и файл из /export. /cancel — отменить.",
+        reply_markup=main_markup,
+    )
+    return IMPORT_FILE
+
+
+@metrics.timed("handler")
+async def import_waiting(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Жду файл .csv, .json или .jsonl. /cancel — отменить.")
+    return IMPORT_FILE
+
+
+@metrics.timed("handler")
+async def import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await update.message.reply_text(f"Файл больше {IMPORT_MAX_BYTES // (1024 * 1024)} МБ, раздели его на части.")
+        return IMPORT_FILE
+    telegram_file = await document.get_file()
+    data = bytes(await telegram_file.download_as_bytearray())
+    try:
+        entries, skipped, matches = await db_read(prepare_import, data, document.file_name or "")
+    except HistoryFormatError as exc:
+        await update.message.reply_text(str(exc))
+        return IMPORT_FILE
+    lines = []
+    if entries:
+        result = await db_write(import_views, update.effective_user.id, entries, matches)
+        lines.append(f"Импортировано просмотров: {len(entries)}")
+        lines.append(f"Найдено в каталоге: {result['matched']}")
+        lines.append(f"Неоднозначных (сохранены как в файле): {result['ambiguous']}")
+        lines.append(f"Новых: {result['new']}, добавлено в каталог тайтлов: {result['created']}")
+        if result["ambiguous_titles"]:
+            lines.append("Проверь, например: " + "; ".join(result["ambiguous_titles"]))
+    else:
+        lines.append("Не нашёл в файле ни одной строки для импорта.")
+    if skipped:
+        lines.append("Пропущено: " + ", ".join(f"{reason} — {count}" for reason, count in skipped.items()))
     await update.message.reply_text("\n".join(lines), reply_markup=main_markup)
+    return ConversationHandler.END
 
 
-async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = stats(update.effective_user.id)
+def render_stats(user_id: int) -> str:
+    data = stats(user_id)
     if not data["per_type"]:
-        await update.message.reply_text("Нет данных. Добавь просмотры через /add.")
-        return
+        return "Нет данных. Добавь просмотры через /add."
     lines = ["По типам:"]
     for row in data["per_type"]:
         lines.append(
@@ -589,11 +1898,18 @@ async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         lines.append("\nТоп жанров:")
         for g in data["top_genres"]:
             lines.append(f"{g[0]} — {g[1]}")
-    await update.message.reply_text("\n".join(lines), reply_markup=main_markup)
+    return "\n".join(lines)
+
+
+@metrics.timed("handler")
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = await db_read(cached_response, update.effective_user.id, "stats", render_stats)
+    await update.message.reply_text(text, reply_markup=main_markup)
 
 
+@metrics.timed("handler")
 async def recommend_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    recs = recommendations(update.effective_user.id, limit=5)
+    recs = await db_read(recommendations, update.effective_user.id, limit=5)
     if not recs:
         await update.message.reply_text("Нужно больше данных о предпочтениях. Добавь просмотры через /add.")
         return
@@ -606,30 +1922,134 @@ async def recommend_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("\n".join(lines), reply_markup=main_markup)
 
 
-async def progress_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    p = progress(update.effective_user.id)
+def render_progress(user_id: int, today: Optional[date] = None) -> str:
+    p = progress(user_id, today)
     curr, prev = p["current"], p["previous"]
-    await update.message.reply_text(
+    return (
         "Сравнение последних 30 дней с предыдущими 30:\n"
         f"Текущий период: {curr['count']} просмотров, ср. оценка {curr['avg']}, минут {curr['minutes']}\n"
-        f"Предыдущий: {prev['count']} просмотров, ср. оценка {prev['avg']}, минут {prev['minutes']}",
-        reply_markup=main_markup,
+        f"Предыдущий: {prev['count']} просмотров, ср. оценка {prev['avg']}, минут {prev['minutes']}"
     )
 
 
+@metrics.timed("handler")
+async def progress_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Окно в 30 дней сдвигается каждый день, поэтому дата входит в ключ кэша
+    today = datetime.utcnow().date()
+    render = functools.partial(render_progress, today=today)
+    text = await db_read(cached_response, update.effective_user.id, "progress", render, today.isoformat())
+    await update.message.reply_text(text, reply_markup=main_markup)
+
+
+@metrics.timed("handler")
+async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    # Картинка живёт в кэше ответов до следующего просмотра пользователя (views_committed)
+    cached, generation = response_cache.get(user_id, "report")
+    if cached is None:
+        data = await db_read(user_report_data, user_id)
+        if not data["views"]:
+            await update.message.reply_text("Пока нет просмотров. Используй /add.", reply_markup=main_markup)
+            return
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(report_pool(), render_user_report, data)
+        caption = (
+            f"Просмотров: {data['views']}, минут: {data['minutes']}, "
+            f"средняя оценка: {data['avg_rate'] if data['avg_rate'] is not None else '—'}"
+        )
+        cached = (png, caption)
+        response_cache.put(user_id, "report", cached, generation)
+    png, caption = cached
+    await update.message.reply_photo(photo=png, caption=caption, reply_markup=main_markup)
+
+
+@metrics.timed("handler")
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Отменено.", reply_markup=main_markup)
     return ConversationHandler.END
 
 
-def main():
+def main(
+    metrics_port: int = METRICS_PORT, slow_query_ms: float = SLOW_QUERY_MS, response_cache_path: str = RESPONSE_CACHE_PATH
+):
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN не найден в переменных окружения.")
 
-    init_db()
-    load_catalog_if_empty()
+    startup()
 
-    application = Application.builder().token(BOT_TOKEN).build()
+    metrics.slow_query_seconds = slow_query_ms / 1000
+    server = start_http_server(metrics_port) if metrics_port else None
+    if response_cache_path:
+        response_cache.store = ResponseStore(response_cache_path)
+
+    application = build_application(BOT_TOKEN)
+    try:
+        application.run_polling()
+    finally:
+        stop_http_server(server)
+        shutdown_report_pool()
+        shutdown_db()
+        if response_cache.store is not None:
+            response_cache.store.close()
+
+
+async def close_write_queue(application: Application) -> None:
+    await write_queue.close()
+
+
+class UserUpdateProcessor(BaseUpdateProcessor):
+    # Апдейты разных пользователей идут параллельно, одного пользователя — строго по очереди:
+    # состояние ConversationHandler (/add, /import) и user_data меняются только после обработчика,
+    # и второй апдейт того же диалога, начатый раньше, увидел бы старое состояние
+    def __init__(self, max_concurrent_updates: int) -> None:
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = None
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                key = update.effective_user.id
+            elif update.effective_chat is not None:
+                key = update.effective_chat.id
+        if key is None:
+            await coroutine
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            # Замок живёт, пока у пользователя есть апдейты в работе: словарь не растёт с числом пользователей
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def build_application(
+    token: str, request: Optional[BaseRequest] = None, update_processor: Optional[BaseUpdateProcessor] = None
+) -> Application:
+    # request подменяет HTTP-клиент Bot API: так апдейты можно прогонять без Telegram (bench.py replay)
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_shutdown(close_write_queue)
+        .concurrent_updates(update_processor or UserUpdateProcessor(CONCURRENT_UPDATES))
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
 
     conv = ConversationHandler(
         entry_points=[CommandHandler("add", add_start)],
@@ -648,18 +2068,142 @@ def main():
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_cmd))
     application.add_handler(CommandHandler("last", last_cmd))
+    application.add_handler(CommandHandler("history", history_cmd))
+    application.add_handler(CallbackQueryHandler(history_nav, pattern=r"^hist:"))
+    application.add_handler(CommandHandler("export", export_cmd))
+    # Файл импортируется только после /import: документы, присланные в другое время, не трогаем
+    history_files = (
+        filters.Document.FileExtension("csv")
+        | filters.Document.FileExtension("json")
+        | filters.Document.FileExtension("jsonl")
+    )
+    import_conv = ConversationHandler(
+        entry_points=[CommandHandler("import", import_cmd)],
+        states={
+            IMPORT_FILE: [
+                MessageHandler(history_files, import_file),
+                MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.Document.ALL, import_waiting),
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        allow_reentry=True,
+    )
+
+    application.add_handler(import_conv)
     application.add_handler(CommandHandler("stats", stats_cmd))
     application.add_handler(CommandHandler("recommend", recommend_cmd))
     application.add_handler(CommandHandler("progress", progress_cmd))
+    application.add_handler(CommandHandler("report", report_cmd))
     application.add_handler(conv)
 
     application.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, lambda u, c: u.message.reply_text("Используй меню команд."))
     )
+    return application
 
-    application.run_polling()
 
+def cli() -> None:
+    parser = argparse.ArgumentParser(description="Дневник просмотров: бот и обслуживание базы")
+    sub = parser.add_subparsers(dest="command")
+    run = sub.add_parser("run", help="запустить бота (по умолчанию)")
+    run.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="порт эндпоинта /metrics, 0 — выключен")
+    run.add_argument("--slow-query-ms", type=float, default=SLOW_QUERY_MS, help="журналировать запросы дольше, мс")
+    run.add_argument(
+        "--response-cache", default=RESPONSE_CACHE_PATH, help="файл SQLite для кэша ответов, переживающего перезапуск"
+    )
+    imp = sub.add_parser("import-catalog", help="загрузить CSV каталога в tracker.db")
+    imp.add_argument("csv", nargs="?", default=CATALOG_CSV)
+    imp.add_argument("--replace", action="store_true", help="заменить каталог целиком вместо upsert")
+    imp.add_argument("--chunksize", type=int, default=CHUNK_ROWS, help="строк CSV на транзакцию")
+    imp.add_argument("--cache-dir", default="", help="читать через кэш разобранного CSV в этом каталоге")
+    cache = sub.add_parser("build-catalog-cache", help="разобрать CSV каталога в типизированные колонки .npy")
+    cache.add_argument("csv", nargs="?", default=CATALOG_CSV)
+    cache.add_argument("--cache-dir", default=CATALOG_CACHE)
+    rebuild = sub.add_parser("rebuild-stats", help="пересчитать user_stats и user_totals по таблице views")
+    rebuild.add_argument("--check", action="store_true", help="только сверить с полным пересчётом")
+    exp = sub.add_parser("export", help="выгрузить просмотры пользователя")
+    exp.add_argument("user_id", type=int)
+    exp.add_argument("--format", choices=list(FORMATS), default="csv")
+    exp.add_argument("--output", default="-", help="путь к файлу, '-' — stdout (кроме parquet)")
+    exp.add_argument("--batch-size", type=int, default=EXPORT_BATCH)
+    hist = sub.add_parser("import-history", help="загрузить историю просмотров пользователя из CSV/JSON")
+    hist.add_argument("user_id", type=int)
+    hist.add_argument("file")
+    args = parser.parse_args()
+
+    if args.command == "rebuild-stats":
+        init_db()
+        if not args.check:
+            rebuild_user_stats()
+        mismatched = check_user_stats()
+        shutdown_db()
+        print(f"Расхождений с полным пересчётом: {mismatched}")
+        if mismatched:
+            raise SystemExit(1)
+        return
 
-if __name__ == "__main__":
+    if args.command == "export":
+        init_db()
+        output = args.output
+        if output == "-":
+            if args.format == "parquet":
+                parser.error("parquet пишется только в файл: укажи --output")
+            output = sys.stdout
+        if args.format == "parquet" and not parquet_available():
+            parser.error("для Parquet нужен пакет pyarrow")
+        try:
+            rows = export_views(args.user_id, args.format, output, args.batch_size)
+        finally:
+            shutdown_db()
+        print(f"Выгружено просмотров: {rows}", file=sys.stderr)
+        return
+
+    if args.command == "import-history":
+        init_db()
+        with open(args.file, "rb") as f:
+            data = f.read()
+        try:
+            entries, skipped, matches = prepare_import(data, os.path.basename(args.file))
+            result = import_views(args.user_id, entries, matches) if entries else {}
+        except HistoryFormatError as exc:
+            parser.error(str(exc))
+        finally:
+            shutdown_db()
+        print(
+            f"Импортировано: {len(entries)}, найдено: {result.get('matched', 0)}, "
+            f"неоднозначных: {result.get('ambiguous', 0)}, новых: {result.get('new', 0)}, пропущено: {sum(skipped.values())}"
+        )
+        return
+
+    if args.command == "import-catalog":
+        init_db()
+        count = import_catalog(
+            args.csv,
+            replace=args.replace,
+            chunksize=args.chunksize,
+            cache_dir=args.cache_dir or None,
+            progress=lambda rows, elapsed: print(
+                f"\rстрок: {rows:,}, {rows / max(elapsed, 1e-9):,.0f} строк/с", end="", flush=True
+            ),
+        )
+        print()
+        shutdown_db()
+        print(f"Импортировано строк: {count}")
+        return
+
+    if args.command == "build-catalog-cache":
+        started = time.perf_counter()
+        path, built = build_catalog_cache(args.csv, args.cache_dir)
+        state = "собран" if built else "актуален, CSV не менялся"
+        print(f"Кэш каталога {state}: {path} ({time.perf_counter() - started:.2f} c)")
+        return
 
+    if args.command == "run":
+        main(metrics_port=args.metrics_port, slow_query_ms=args.slow_query_ms, response_cache_path=args.response_cache)
+        return
     main()
+
+
+if __name__ == "__main__":
+
+    cli()
@@ -0,0 +1,248 @@
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Версии нужны, чтобы значение, посчитанное до invalidate(), не попало в кэш после него
+        self._epoch = 0
+        self._key_epochs: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def token(self, key: Hashable) -> Tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._key_epochs.get(key, 0)
+
+    def set(self, key: Hashable, value: Any, token: Optional[Tuple[int, int]] = None, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            if token is not None and token != (self._epoch, self._key_epochs.get(key, 0)):
+                return
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._key_epochs[key] = self._key_epochs.get(key, 0) + 1
+            if len(self._key_epochs) > self.maxsize:
+                # Версии ключей нужны только незавершённым вычислениям: сброс со сменой общей эпохи
+                # отклоняет их все разом, а сами значения в кэше остаются
+                self._key_epochs.clear()
+                self._epoch += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._key_epochs.clear()
+            self._epoch += 1
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+ResponseKey = Tuple[int, str, str]
+
+
+class ResponseStore:
+    # Общий файл SQLite для готовых ответов: переживает перезапуск и доступен нескольким процессам.
+    # Запись хранит stamp — id последнего просмотра пользователя, с которым она посчитана
+    def __init__(self, path: str, max_rows: int = 100_000) -> None:
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                user_id INTEGER NOT NULL,
+                command TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                stamp INTEGER NOT NULL,
+                written REAL NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (user_id, command, variant)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_written ON responses(written)")
+
+    def get(self, key: ResponseKey, stamp: int) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stamp, text FROM responses WHERE user_id = ? AND command = ? AND variant = ?", key
+            ).fetchone()
+        return row[1] if row is not None and row[0] == stamp else None
+
+    def set(self, key: ResponseKey, stamp: int, text: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (user_id, command, variant, stamp, written, text) VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, stamp, time.time(), text),
+            )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                # Размер файла ограничен: время от времени удаляем самые старые записи сверх max_rows
+                self._conn.execute(
+                    "DELETE FROM responses WHERE written <= (SELECT written FROM responses ORDER BY written DESC LIMIT 1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    # Готовые тексты ответов по (user_id, команда, вариант). У пользователя есть поколение, которое меняется
+    # с каждым его новым просмотром; запись прошлого поколения просто не совпадает, поэтому устаревших
+    # ответов не бывает, а память ограничена max_bytes с вытеснением самых давних.
+    # Поколения берутся из общего счётчика; у пользователя без своего поколения действует _floor
+    def __init__(self, max_bytes: int, store: Optional[ResponseStore] = None) -> None:
+        self.max_bytes = max_bytes
+        self.store = store
+        self._data: "OrderedDict[ResponseKey, Tuple[int, str, int]]" = OrderedDict()
+        self._generations: Dict[int, int] = {}
+        self._floor = 0
+        self._counter = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def bump(self, user_id: int) -> None:
+        with self._lock:
+            self._counter += 1
+            self._generations[user_id] = self._counter
+            if len(self._generations) > max(1024, 2 * len(self._data)):
+                self._prune_generations()
+
+    def _prune_generations(self) -> None:
+        # Поколение нужно только пользователям с записями в кэше. Остальные получают новый _floor —
+        # он больше всех выданных значений, поэтому ответы, посчитанные до сброса, в кэш уже не лягут
+        users = {user_id for user_id, _, _ in self._data}
+        self._generations = {user_id: self._generations.get(user_id, self._floor) for user_id in users}
+        self._counter += 1
+        self._floor = self._counter
+
+    def _lookup(self, key: ResponseKey) -> Tuple[Optional[Any], int]:
+        with self._lock:
+            generation = self._generations.get(key[0], self._floor)
+            item = self._data.get(key)
+            if item is not None and item[0] == generation:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1], generation
+            return None, generation
+
+    def get(self, user_id: int, command: str, variant: str = "") -> Tuple[Optional[Any], int]:
+        # Для ответов, которые строятся асинхронно: (значение или None, поколение для put())
+        value, generation = self._lookup((user_id, command, variant))
+        if value is None:
+            self._count("misses")
+        return value, generation
+
+    def put(self, user_id: int, command: str, value: Any, generation: int, variant: str = "") -> None:
+        self._set((user_id, command, variant), generation, value)
+
+    def get_or_render(
+        self,
+        user_id: int,
+        command: str,
+        render: Callable[[int], str],
+        variant: str = "",
+        stamp: Optional[Callable[[int], int]] = None,
+    ) -> str:
+        key = (user_id, command, variant)
+        text, generation = self._lookup(key)
+        if text is not None:
+            return text
+        if self.store is not None and stamp is not None:
+            # stamp берётся до render(): если просмотр добавят посередине, запись на диске просто не совпадёт
+            current = stamp(user_id)
+            text = self.store.get(key, current)
+            if text is None:
+                text = render(user_id)
+                self.store.set(key, current, text)
+                self._count("misses")
+            else:
+                self._count("store_hits")
+        else:
+            text = render(user_id)
+            self._count("misses")
+        self._set(key, generation, text)
+        return text
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _set(self, key: ResponseKey, generation: int, text: Any) -> None:
+        # Кортеж (картинка, подпись) считается по содержимому, а не по размеру самого кортежа
+        size = sys.getsizeof(text)
+        if isinstance(text, tuple):
+            size += sum(sys.getsizeof(item) for item in text)
+        with self._lock:
+            if generation != self._generations.get(key[0], self._floor) or size > self.max_bytes:
+                # Ответ посчитан до нового просмотра — в кэш его не кладём
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (generation, text, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def counters(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round((self.hits + self.store_hits) / lookups, 4) if lookups else 0.0,
+            }
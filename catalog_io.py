@@ -0,0 +1,328 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import IO, TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# pandas нужен только при импорте CSV и в анализе: бот на тёплом старте его не загружает
+if TYPE_CHECKING:
+    import pandas as pd
+
+ADVISORY_COLUMNS = ["Nudity", "Violence", "Profanity", "Alcohol", "Frightening"]
+
+# Порядок совпадает с колонками INSERT в bot.CATALOG_INSERT_COLUMNS
+CATALOG_FIELDS = [
+    ("Name", "name"),
+    ("Name_Norm", "name_norm"),
+    ("Type", "type"),
+    ("Genre", "genre"),
+    ("Certificate", "certificate"),
+    ("Rate", "imdb_rate"),
+    ("Votes", "votes"),
+    ("Episodes", "episodes"),
+    ("Duration", "duration"),
+    ("Date", "year"),
+] + [(col, col.lower()) for col in ADVISORY_COLUMNS]
+
+INTEGER_COLUMNS = ["Votes", "Episodes", "Duration", "Date"]
+NUMERIC_COLUMNS = ["Rate"] + INTEGER_COLUMNS
+# Почти уникальные строки: в кэше — байты UTF-8 подряд и смещения, а не словарь значений
+TEXT_COLUMNS = ["Name", "Name_Norm"]
+CHUNK_ROWS = 50_000
+CATALOG_CACHE_DIR = ".catalog-cache"
+# Растёт при изменении normalize_catalog_frame() или формата файлов: старые каталоги кэша перестают совпадать по ключу
+CATALOG_CACHE_VERSION = 2
+
+
+def split_genres(genre: Any) -> List[str]:
+    # "Action, Adventure, Thriller" -> ["Action", "Adventure", "Thriller"]; в выгрузке встречается "Actions"
+    if not isinstance(genre, str):
+        return []
+    genres: List[str] = []
+    for part in genre.split(","):
+        part = part.strip()
+        if part == "Actions":
+            part = "Action"
+        if part and part not in genres:
+            genres.append(part)
+    return genres
+
+
+def to_number(series: "pd.Series") -> "pd.Series":
+    # "107,163" -> 107163, "No rate" / "-" -> NaN
+    import pandas as pd
+
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        series = series.str.replace(",", "", regex=False).str.strip()
+    return pd.to_numeric(series, errors="coerce")
+
+
+def normalize_catalog_frame(df: "pd.DataFrame") -> "pd.DataFrame":
+    column_mapping = {}
+    if "Data" in df.columns:
+        column_mapping["Data"] = "Date"
+    if "Nudity, violence.." in df.columns:
+        column_mapping["Nudity, violence.."] = "Content_Rating"
+    df = df.rename(columns=column_mapping)
+
+    for col in ["Rate", "Votes", "Duration", "Date"]:
+        if col in df.columns:
+            df[col] = to_number(df[col])
+    if "Episodes" in df.columns:
+        df["Episodes"] = to_number(df["Episodes"]).fillna(1)
+    for col in ADVISORY_COLUMNS:
+        if col in df.columns:
+            # pandas читает литерал "None" как пропуск, а "No Rate" означает, что оценки нет
+            df[col] = df[col].fillna("None").replace("No Rate", np.nan)
+    if "Name" in df.columns:
+        df["Name_Norm"] = df["Name"].fillna("").astype(str).str.lower().str.split().str.join(" ")
+    return df
+
+
+def iter_catalog_chunks(path: str, chunksize: int = CHUNK_ROWS, **read_csv_kwargs) -> Iterator["pd.DataFrame"]:
+    # Память ограничена размером чанка, а не всего файла
+    import pandas as pd
+
+    for chunk in pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs):
+        yield normalize_catalog_frame(chunk)
+
+
+def compact_frame(df: "pd.DataFrame", categorical: List[str]) -> "pd.DataFrame":
+    for col in categorical:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col in df.select_dtypes("float64").columns:
+        df[col] = df[col].astype("float32")
+    return df
+
+
+def column_values(df: "pd.DataFrame", col: str) -> np.ndarray:
+    import pandas as pd
+
+    if col not in df.columns:
+        return np.full(len(df), None, dtype=object)
+    series = df[col]
+    if col in INTEGER_COLUMNS:
+        series = series.round().astype("Int64")
+    elif pd.api.types.is_float_dtype(series):
+        series = series.astype("Float64")
+    # object-массив с питоновскими int/float/str и None вместо NaN — sqlite3 принимает его как есть
+    return series.to_numpy(dtype=object, na_value=None)
+
+
+def catalog_rows(df: "pd.DataFrame") -> Iterator[Tuple[Any, ...]]:
+    columns: List[np.ndarray] = [column_values(df, col) for col, _ in CATALOG_FIELDS]
+    return zip(*columns)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def catalog_cache_path(csv_path: str, cache_dir: str = CATALOG_CACHE_DIR) -> str:
+    # Ключ — содержимое CSV: изменённый файл получает новый каталог, а не перезаписывает старый
+    return os.path.join(cache_dir, f"catalog-{file_digest(csv_path)[:32]}-v{CATALOG_CACHE_VERSION}")
+
+
+def build_catalog_cache(csv_path: str, cache_dir: str = CATALOG_CACHE_DIR) -> Tuple[str, bool]:
+    # Разобранный каталог по колонкам в .npy, как и импорт — по чанку за раз: память не растёт с размером CSV.
+    # Числа — float64 с NaN. Названия — байты UTF-8 подряд и смещения (словарь был бы размером с каталог).
+    # Остальные строки — коды int32 (-1 — пропуск) и отсортированный, как у astype("category"), словарь в meta.json.
+    # Возвращает (путь, был ли кэш перестроен)
+    path = catalog_cache_path(csv_path, cache_dir)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return path, False
+    import pandas as pd
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=cache_dir, prefix=".build-")
+    try:
+        rows, columns = _write_raw_columns(csv_path, tmp)
+        for col, spec in columns.items():
+            if spec["kind"] == "numeric":
+                _raw_to_npy(tmp, f"{col}.npy", "float64", rows)
+            elif spec["kind"] == "text":
+                _raw_to_npy(tmp, f"{col}.offsets.npy", "int64", rows + 1)
+                _raw_to_npy(tmp, f"{col}.isna.npy", "bool", rows)
+                _raw_to_npy(tmp, f"{col}.data.npy", "uint8", spec.pop("bytes"))
+            else:
+                # Коды копились в порядке появления значений: переводим в порядок отсортированного словаря
+                seen = spec.pop("seen")
+                categories = sorted(seen, key=str)
+                remap = np.empty(len(categories), dtype="int32")
+                remap[[seen[value] for value in categories]] = np.arange(len(categories), dtype="int32")
+                _raw_to_npy(tmp, f"{col}.npy", "int32", rows, lambda codes: np.where(codes < 0, -1, remap[codes]))
+                spec["categories"] = categories
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    source = os.path.abspath(csv_path)
+    meta = {"source": source, "rows": rows, "version": CATALOG_CACHE_VERSION, "columns": columns}
+    # meta.json пишется последним: каталог без него считается недостроенным
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Параллельная сборка успела раньше — её результат такой же
+        shutil.rmtree(tmp, ignore_errors=True)
+        return path, False
+    _prune_catalog_caches(cache_dir, source, keep=os.path.basename(path))
+    return path, True
+
+
+def _write_raw_columns(csv_path: str, tmp: str) -> Tuple[int, Dict[str, Dict[str, Any]]]:
+    # Первый проход: каждый чанк дописывается в сырые файлы колонок, в памяти только чанк и словари категорий
+    import pandas as pd
+
+    rows = 0
+    columns: Dict[str, Dict[str, Any]] = {}
+    files: Dict[str, IO[bytes]] = {}
+
+    def raw(name: str) -> IO[bytes]:
+        if name not in files:
+            files[name] = open(os.path.join(tmp, name + ".raw"), "wb")
+        return files[name]
+
+    try:
+        for chunk in iter_catalog_chunks(csv_path):
+            if not columns:
+                for col, _ in CATALOG_FIELDS:
+                    if col not in chunk.columns:
+                        continue
+                    if col in NUMERIC_COLUMNS:
+                        columns[col] = {"kind": "numeric"}
+                    elif col in TEXT_COLUMNS:
+                        columns[col] = {"kind": "text", "bytes": 0}
+                        raw(f"{col}.offsets.npy").write(np.zeros(1, dtype="int64").tobytes())
+                    else:
+                        columns[col] = {"kind": "category", "seen": {}}
+            for col, spec in columns.items():
+                series = chunk[col]
+                if spec["kind"] == "numeric":
+                    raw(f"{col}.npy").write(series.to_numpy(dtype="float64", na_value=np.nan).tobytes())
+                elif spec["kind"] == "text":
+                    values = series.to_numpy(dtype=object, na_value=None)
+                    encoded = [b"" if value is None else str(value).encode("utf-8") for value in values]
+                    ends = np.cumsum([len(item) for item in encoded], dtype="int64") + spec["bytes"]
+                    raw(f"{col}.offsets.npy").write(ends.tobytes())
+                    raw(f"{col}.isna.npy").write(np.array([value is None for value in values], dtype="bool").tobytes())
+                    raw(f"{col}.data.npy").write(b"".join(encoded))
+                    if len(ends):
+                        spec["bytes"] = int(ends[-1])
+                else:
+                    codes, uniques = pd.factorize(series)
+                    seen = spec["seen"]
+                    local = np.array([seen.setdefault(value, len(seen)) for value in uniques], dtype="int32")
+                    merged = np.full(len(codes), -1, dtype="int32")
+                    merged[codes >= 0] = local[codes[codes >= 0]]
+                    raw(f"{col}.npy").write(merged.tobytes())
+            rows += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+    return rows, columns
+
+
+def _raw_to_npy(tmp: str, name: str, dtype: str, length: int, transform: Optional[Callable] = None) -> None:
+    # Второй проход: сырые байты переносятся в .npy нужной длины кусками по CHUNK_ROWS
+    raw_path = os.path.join(tmp, name + ".raw")
+    if not length:
+        np.save(os.path.join(tmp, name), np.empty(0, dtype=dtype))
+    else:
+        source = np.memmap(raw_path, dtype=dtype, mode="r", shape=(length,))
+        target = np.lib.format.open_memmap(os.path.join(tmp, name), mode="w+", dtype=dtype, shape=(length,))
+        step = CHUNK_ROWS * 16 if dtype == "uint8" else CHUNK_ROWS
+        for start in range(0, length, step):
+            block = source[start:start + step]
+            target[start:start + step] = block if transform is None else transform(block)
+        target.flush()
+        del source, target
+    if os.path.exists(raw_path):
+        os.remove(raw_path)
+
+
+def _prune_catalog_caches(cache_dir: str, source: str, keep: str) -> None:
+    # Кэши прежних версий того же CSV больше не совпадут по ключу
+    for name in os.listdir(cache_dir):
+        if not name.startswith("catalog-") or name == keep:
+            continue
+        try:
+            with open(os.path.join(cache_dir, name, "meta.json"), encoding="utf-8") as f:
+                stale = json.load(f).get("source") == source
+        except (OSError, ValueError):
+            continue
+        if stale:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def _read_meta(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _cached_column(path: str, col: str, spec: Dict[str, Any], start: int, stop: int) -> Any:
+    # Числа и коды — срез mmap без копирования; названия декодируются только для запрошенных строк
+    import pandas as pd
+
+    if spec["kind"] == "numeric":
+        return np.load(os.path.join(path, f"{col}.npy"), mmap_mode="r")[start:stop]
+    if spec["kind"] == "category":
+        codes = np.load(os.path.join(path, f"{col}.npy"), mmap_mode="r")[start:stop]
+        return pd.Categorical.from_codes(codes, spec["categories"])
+    offsets = np.load(os.path.join(path, f"{col}.offsets.npy"), mmap_mode="r")[start:stop + 1]
+    isna = np.load(os.path.join(path, f"{col}.isna.npy"), mmap_mode="r")[start:stop]
+    data = np.load(os.path.join(path, f"{col}.data.npy"), mmap_mode="r")
+    raw = data[offsets[0]:offsets[-1]].tobytes() if len(offsets) > 1 else b""
+    bounds = (offsets - offsets[0]).tolist()
+    column = np.array([raw[a:b].decode("utf-8") for a, b in zip(bounds, bounds[1:])], dtype=object)
+    column[isna] = None
+    return column
+
+
+def load_catalog_cache(
+    path: str, columns: Optional[Sequence[str]] = None, start: int = 0, stop: Optional[int] = None
+) -> "pd.DataFrame":
+    # Колонки открываются через mmap: числа и коды не копируются, чтение не зависит от разбора CSV
+    import pandas as pd
+
+    meta = _read_meta(path)
+    stop = meta["rows"] if stop is None else min(stop, meta["rows"])
+    data = {
+        col: _cached_column(path, col, spec, start, stop)
+        for col, spec in meta["columns"].items()
+        if columns is None or col in columns
+    }
+    return pd.DataFrame(data, index=pd.RangeIndex(start, stop), copy=False)
+
+
+def read_catalog(
+    path: str, cache_dir: Optional[str] = CATALOG_CACHE_DIR, columns: Optional[Sequence[str]] = None
+) -> "pd.DataFrame":
+    # С cache_dir=None — прежний разбор CSV, без записи на диск
+    import pandas as pd
+
+    if cache_dir:
+        return load_catalog_cache(build_catalog_cache(path, cache_dir)[0], columns)
+    usecols = None if columns is None else lambda col: col in columns
+    return pd.concat(iter_catalog_chunks(path, usecols=usecols), ignore_index=True)
+
+
+def iter_catalog_frames(
+    path: str, chunksize: int = CHUNK_ROWS, cache_dir: Optional[str] = None
+) -> Iterator["pd.DataFrame"]:
+    # Из кэша — теми же чанками, что и из CSV: в памяти не больше одного чанка
+    if not cache_dir:
+        yield from iter_catalog_chunks(path, chunksize=chunksize)
+        return
+    cache_path = build_catalog_cache(path, cache_dir)[0]
+    rows = _read_meta(cache_path)["rows"]
+    for start in range(0, rows, chunksize):
+        yield load_catalog_cache(cache_path, start=start, stop=start + chunksize)
@@ -0,0 +1,233 @@
+import math
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CATEGORY_FIELDS = ("type", "genre", "certificate")
+RECORD_FIELDS = ("id", "name", "type", "genre", "certificate", "imdb_rate", "votes", "episodes")
+MISSING = -1
+# Рейтинги IMDB даны с одним знаком; 6 знаков после запятой лежат в пределах точности float32
+RATE_DECIMALS = 6
+
+# Строка для снимка: id, name, name_norm, type, genre, certificate, imdb_rate, votes, episodes
+SnapshotRow = Tuple[Any, ...]
+
+
+class CatalogRecord:
+    # Запись только для чтения: одни и те же объекты отдаются из кэша рекомендаций разным вызовам
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, id, name, type, genre, certificate, imdb_rate, votes, episodes) -> None:
+        self.id = id
+        self.name = name
+        self.type = type
+        self.genre = genre
+        self.certificate = certificate
+        self.imdb_rate = imdb_rate
+        self.votes = votes
+        self.episodes = episodes
+
+    # Обработчики читают записи как раньше словари: item["name"], item.get("type", "")
+    def __getitem__(self, key: str) -> Any:
+        if key not in RECORD_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in RECORD_FIELDS else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return RECORD_FIELDS
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, CatalogRecord):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in RECORD_FIELDS)
+
+    def __repr__(self) -> str:
+        return f"CatalogRecord({self.id}, {self.name!r}, {self.type!r}, imdb_rate={self.imdb_rate})"
+
+
+class Categories:
+    # Колонка с немногими различными значениями (тип, жанр, рейтинг): int32-коды и общий список строк
+    def __init__(self) -> None:
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        if value is None:
+            return MISSING
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return code
+
+    def copy(self) -> "Categories":
+        copied = Categories()
+        copied.values = list(self.values)
+        copied.codes = dict(self.codes)
+        return copied
+
+
+class CatalogSnapshot:
+    # Неизменяемый снимок: новые тайтлы дают новый снимок (with_entry) со своими копиями колонок,
+    # списков и словарей, старый остаётся целым для тех, кто его уже читает.
+    # Колонки — array.array: 4 байта на значение, а чтение элемента сразу даёт питоновское число
+    def __init__(
+        self,
+        ids: array,
+        names: List[str],
+        columns: Dict[str, array],
+        categories: Dict[str, Categories],
+        by_name: Dict[str, int],
+    ) -> None:
+        self._ids = ids
+        self._names = names
+        self._columns = columns
+        self._categories = categories
+        self._by_name = by_name
+        # Быстрые ссылки для _record(), чтобы не искать колонки по словарю на каждой записи
+        self._fields = tuple(columns[field] for field in (*CATEGORY_FIELDS, "imdb_rate", "votes", "episodes"))
+        self._types = categories["type"].values
+        self._genres = categories["genre"].values
+        self._certificates = categories["certificate"].values
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[SnapshotRow]) -> "CatalogSnapshot":
+        # rows должны идти по возрастанию id, как даёт ORDER BY id
+        categories = {field: Categories() for field in CATEGORY_FIELDS}
+        ids = array("q")
+        names: List[str] = []
+        columns = {field: array("i") for field in CATEGORY_FIELDS}
+        columns["imdb_rate"] = array("f")
+        columns["votes"] = array("i")
+        columns["episodes"] = array("i")
+        by_name: Dict[str, int] = {}
+        for row_id, name, name_norm, content_type, genre, certificate, imdb_rate, votes, episodes in rows:
+            ids.append(row_id)
+            names.append(sys.intern(name or ""))
+            cls._append(columns, categories, content_type, genre, certificate, imdb_rate, votes, episodes)
+            # Как и "WHERE name_norm = ? LIMIT 1" по индексу: среди дублей побеждает меньший id
+            by_name.setdefault(name_norm or "", row_id)
+        return cls(ids, names, columns, categories, by_name)
+
+    @staticmethod
+    def _append(columns, categories, content_type, genre, certificate, imdb_rate, votes, episodes) -> None:
+        columns["type"].append(categories["type"].code(content_type))
+        columns["genre"].append(categories["genre"].code(genre))
+        columns["certificate"].append(categories["certificate"].code(certificate))
+        columns["imdb_rate"].append(math.nan if imdb_rate is None else imdb_rate)
+        columns["votes"].append(MISSING if votes is None else votes)
+        columns["episodes"].append(MISSING if episodes is None else episodes)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _record(self, pos: int) -> CatalogRecord:
+        types, genres, certificates, rates, votes, episodes = self._fields
+        type_code = types[pos]
+        genre_code = genres[pos]
+        cert_code = certificates[pos]
+        rate = rates[pos]
+        votes = votes[pos]
+        episodes = episodes[pos]
+        return CatalogRecord(
+            self._ids[pos],
+            self._names[pos],
+            self._types[type_code] if type_code != MISSING else None,
+            self._genres[genre_code] if genre_code != MISSING else None,
+            self._certificates[cert_code] if cert_code != MISSING else None,
+            # float32 -> float с округлением возвращает исходные 7.8, а не 7.800000190734863
+            round(rate, RATE_DECIMALS) if rate == rate else None,
+            votes if votes != MISSING else None,
+            episodes if episodes != MISSING else None,
+        )
+
+    def _position(self, row_id: int) -> Optional[int]:
+        ids = self._ids
+        pos = bisect_left(ids, row_id)
+        if pos < len(ids) and ids[pos] == row_id:
+            return pos
+        return None
+
+    def find(self, name_norm: str) -> Optional[CatalogRecord]:
+        row_id = self._by_name.get(name_norm)
+        if row_id is None:
+            return None
+        pos = self._position(row_id)
+        return self._record(pos) if pos is not None else None
+
+    def records(self, ids: Sequence[int]) -> List[CatalogRecord]:
+        # Порядок ids сохраняется, отсутствующие пропускаются — как у прежнего SELECT ... WHERE id IN
+        records = []
+        for row_id in ids:
+            pos = self._position(row_id)
+            if pos is not None:
+                records.append(self._record(pos))
+        return records
+
+    def with_entry(self, row: SnapshotRow) -> "CatalogSnapshot":
+        row_id, name, name_norm, content_type, genre, certificate, imdb_rate, votes, episodes = row
+        if self._position(row_id) is not None:
+            return self
+        name = sys.intern(name or "")
+        by_name = dict(self._by_name)
+        by_name.setdefault(name_norm or "", row_id)
+        if not self._ids or row_id > self._ids[-1]:
+            # Обычный случай — новый id больше всех: колонки дописываются в копии, без пересборки снимка
+            ids = array("q", self._ids)
+            ids.append(row_id)
+            columns, categories = self._copy_columns()
+            self._append(columns, categories, content_type, genre, certificate, imdb_rate, votes, episodes)
+            return CatalogSnapshot(ids, self._names + [name], columns, categories, by_name)
+        rows = [
+            (self._ids[pos], self._names[pos], None, *self._raw(pos)) for pos in range(len(self._ids))
+        ]
+        rows.insert(bisect_left(self._ids, row_id), (row_id, name, None, content_type, genre, certificate, imdb_rate, votes, episodes))
+        snapshot = CatalogSnapshot.from_rows(rows)
+        # Словарь названий строился по name_norm, которого в колонках нет, поэтому берём копию текущего
+        snapshot._by_name = by_name
+        return snapshot
+
+    def with_entries(self, rows: Sequence[SnapshotRow]) -> "CatalogSnapshot":
+        # Пачка новых тайтлов (импорт истории): колонки копируются один раз, а не на каждую запись
+        rows = [row for row in rows if self._position(row[0]) is None]
+        if not rows:
+            return self
+        row_ids = [row[0] for row in rows]
+        if (self._ids and row_ids[0] <= self._ids[-1]) or row_ids != sorted(set(row_ids)):
+            snapshot = self
+            for row in rows:
+                snapshot = snapshot.with_entry(row)
+            return snapshot
+        ids = array("q", self._ids)
+        ids.extend(row_ids)
+        columns, categories = self._copy_columns()
+        names = list(self._names)
+        by_name = dict(self._by_name)
+        for row_id, name, name_norm, content_type, genre, certificate, imdb_rate, votes, episodes in rows:
+            names.append(sys.intern(name or ""))
+            self._append(columns, categories, content_type, genre, certificate, imdb_rate, votes, episodes)
+            by_name.setdefault(name_norm or "", row_id)
+        return CatalogSnapshot(ids, names, columns, categories, by_name)
+
+    def _copy_columns(self) -> Tuple[Dict[str, array], Dict[str, Categories]]:
+        columns = {field: array(column.typecode, column) for field, column in self._columns.items()}
+        return columns, {field: categories.copy() for field, categories in self._categories.items()}
+
+    def _raw(self, pos: int) -> Tuple[Any, ...]:
+        record = self._record(pos)
+        return record.type, record.genre, record.certificate, record.imdb_rate, record.votes, record.episodes
+
+    def nbytes(self) -> int:
+        # Оценка занимаемой памяти: массивы, списки и уникальные строки
+        total = sum(sys.getsizeof(column) for column in [self._ids, *self._columns.values()])
+        total += sys.getsizeof(self._names) + sys.getsizeof(self._by_name)
+        total += sum(sys.getsizeof(name) for name in self._names)
+        total += sum(sys.getsizeof(key) for key in self._by_name)
+        for categories in self._categories.values():
+            total += sys.getsizeof(categories.values) + sys.getsizeof(categories.codes)
+            total += sum(sys.getsizeof(value) for value in categories.values)
+        return total
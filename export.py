@@ -0,0 +1,102 @@
+import csv
+import json
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+EXPORT_COLUMNS = (
+    "id",
+    "name",
+    "type",
+    "genre",
+    "certificate",
+    "imdb_rate",
+    "user_rate",
+    "view_date",
+    "duration_minutes",
+)
+EXPORT_BATCH = 1000
+
+Batch = List[Tuple[Any, ...]]
+
+
+def iter_batches(cur: Any, batch_size: int = EXPORT_BATCH) -> Iterator[Batch]:
+    # Курсор SQLite отдаёт строки по мере чтения страниц: в памяти не больше одной пачки
+    while True:
+        batch = cur.fetchmany(batch_size)
+        if not batch:
+            return
+        yield batch
+
+
+def write_csv(out: IO, batches: Iterable[Batch], columns: Sequence[str] = EXPORT_COLUMNS) -> int:
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    rows = 0
+    for batch in batches:
+        writer.writerows(batch)
+        rows += len(batch)
+    return rows
+
+
+def write_jsonl(out: IO, batches: Iterable[Batch], columns: Sequence[str] = EXPORT_COLUMNS) -> int:
+    rows = 0
+    for batch in batches:
+        out.write("".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in batch))
+        rows += len(batch)
+    return rows
+
+
+def write_parquet(out: IO, batches: Iterable[Batch], columns: Sequence[str] = EXPORT_COLUMNS) -> int:
+    # pyarrow необязателен: без него доступны только CSV и JSONL
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для Parquet нужен пакет pyarrow") from None
+    schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("name", pa.string()),
+            ("type", pa.string()),
+            ("genre", pa.string()),
+            ("certificate", pa.string()),
+            ("imdb_rate", pa.float64()),
+            ("user_rate", pa.float64()),
+            ("view_date", pa.string()),
+            ("duration_minutes", pa.int64()),
+        ]
+    )
+    rows = 0
+    # Каждая пачка — отдельная row group, поэтому пишущий не держит весь файл в памяти
+    with pq.ParquetWriter(out, schema) as writer:
+        for batch in batches:
+            arrays = [pa.array(list(col), type=field.type) for col, field in zip(zip(*batch), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows += len(batch)
+    return rows
+
+
+# Формат -> (функция записи, открывать файл в двоичном режиме)
+FORMATS: Dict[str, Tuple[Callable[[IO, Iterable[Batch]], int], bool]] = {
+    "csv": (write_csv, False),
+    "jsonl": (write_jsonl, False),
+    "parquet": (write_parquet, True),
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def write_export(path: Union[str, IO], fmt: str, batches: Iterable[Batch]) -> int:
+    write, binary = FORMATS[fmt]
+    if not isinstance(path, str):
+        return write(path, batches)
+    if binary:
+        with open(path, "wb") as out:
+            return write(out, batches)
+    with open(path, "w", newline="", encoding="utf-8") as out:
+        return write(out, batches)
@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+IMPORT_MAX_ROWS = 50_000
+DEFAULT_DURATION = {"film": 120, "series": 45}
+
+# Заголовки выгрузки IMDb (Your ratings), нашего /export и русские варианты -> поле просмотра
+FIELD_ALIASES = {
+    "name": ("name", "title", "название", "фильм"),
+    "user_rate": ("user_rate", "your rating", "rating", "rate", "оценка", "моя оценка"),
+    "view_date": ("view_date", "date rated", "watched date", "date", "дата", "дата просмотра"),
+    "duration_minutes": ("duration_minutes", "runtime (mins)", "runtime", "duration", "длительность"),
+    "type": ("type", "title type", "тип"),
+    "genre": ("genre", "genres", "жанр", "жанры"),
+    "certificate": ("certificate", "рейтинг mpaa"),
+}
+# Тип из IMDb-выгрузки ("movie", "tvSeries", "TV Mini Series") -> Film/Series, как в каталоге
+TYPE_ALIASES = {"movie": "Film", "film": "Film", "фильм": "Film", "tvseries": "Series", "tv series": "Series",
+                "tvminiseries": "Series", "tv mini series": "Series", "series": "Series", "сериал": "Series"}
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%Y/%m/%d", "%m/%d/%Y")
+
+
+def default_duration(content_type: Optional[str]) -> int:
+    # То же, что ответ "авто" в /add
+    return DEFAULT_DURATION["series"] if (content_type or "").lower() == "series" else DEFAULT_DURATION["film"]
+
+
+class HistoryFormatError(ValueError):
+    pass
+
+
+def _header_map(columns: Iterable[str]) -> Dict[str, str]:
+    lowered = {str(col).strip().lower(): col for col in columns if col is not None}
+    mapping = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if alias in lowered:
+                mapping[field] = lowered[alias]
+                break
+    return mapping
+
+
+def _decode(data: bytes) -> str:
+    # Excel сохраняет CSV с BOM, старые выгрузки бывают в cp1251
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1251", errors="replace")
+
+
+def read_rows(data: bytes, filename: str = "") -> Iterator[Dict[str, Any]]:
+    text = _decode(data)
+    name = filename.lower()
+    stripped = text.lstrip()
+    if name.endswith(".json") or stripped.startswith("["):
+        try:
+            items = json.loads(text)
+        except json.JSONDecodeError as exc:
+            raise HistoryFormatError(f"Некорректный JSON: {exc.msg}, строка {exc.lineno}") from None
+        if not isinstance(items, list):
+            raise HistoryFormatError("JSON должен быть списком записей")
+        yield from (item for item in items if isinstance(item, dict))
+    elif name.endswith(".jsonl") or stripped.startswith("{"):
+        for lineno, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                raise HistoryFormatError(f"Некорректный JSON в строке {lineno}") from None
+            if isinstance(item, dict):
+                yield item
+    else:
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.DictReader(io.StringIO(text), dialect=dialect)
+
+
+def parse_date(value: Any) -> Optional[str]:
+    if not value:
+        return None
+    text = str(value).strip()[:10]
+    try:
+        # Быстрый путь для ISO-дат (IMDb, /export): strptime в разы медленнее
+        return date.fromisoformat(text).isoformat()
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS[1:]:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_number(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        return float(str(value).replace(",", ".").strip())
+    except ValueError:
+        return None
+
+
+def clean_entry(raw: Dict[str, Any], mapping: Dict[str, str], today: date) -> Tuple[Optional[Dict[str, Any]], str]:
+    # Возвращает (просмотр, "") или (None, причина пропуска)
+    def get(field: str) -> Any:
+        return raw.get(mapping[field]) if field in mapping else None
+
+    name = str(get("name") or "").strip()
+    if not name:
+        return None, "нет названия"
+    rate = parse_number(get("user_rate"))
+    if rate is None:
+        return None, "нет оценки"
+    if not 1 <= rate <= 10:
+        return None, "оценка вне 1-10"
+    view_date = parse_date(get("view_date")) if get("view_date") else today.isoformat()
+    if view_date is None:
+        return None, "не разобрана дата"
+    raw_type = str(get("type") or "").strip()
+    content_type = TYPE_ALIASES.get(raw_type.lower(), raw_type or None)
+    # Без длительности её потом проставит default_duration() по типу из каталога
+    duration = parse_number(get("duration_minutes"))
+    return {
+        "name": name,
+        "type": content_type,
+        "genre": str(get("genre") or "").strip() or None,
+        "certificate": str(get("certificate") or "").strip() or None,
+        "user_rate": rate,
+        "view_date": view_date,
+        "duration_minutes": int(duration) if duration and duration > 0 else None,
+    }, ""
+
+
+def read_history(data: bytes, filename: str = "", today: Optional[date] = None) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    # Разбор файла целиком до записи: либо импортируем все годные строки, либо сообщаем, почему файл не подходит
+    today = today or datetime.utcnow().date()
+    entries: List[Dict[str, Any]] = []
+    skipped: Dict[str, int] = {}
+    mapping: Optional[Dict[str, str]] = None
+    for raw in read_rows(data, filename):
+        if mapping is None:
+            mapping = _header_map(raw.keys())
+            if "name" not in mapping:
+                raise HistoryFormatError("Не нашёл колонку с названием (name / Title / Название)")
+        if len(entries) >= IMPORT_MAX_ROWS:
+            raise HistoryFormatError(f"Слишком много строк: не больше {IMPORT_MAX_ROWS} за раз")
+        entry, reason = clean_entry(raw, mapping, today)
+        if entry is None:
+            skipped[reason] = skipped.get(reason, 0) + 1
+        else:
+            entries.append(entry)
+    return entries, skipped
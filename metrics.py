@@ -0,0 +1,195 @@
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы корзин в секундах: от быстрых SELECT по индексу до медленного ранжирования
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+slow_log = logging.getLogger("tracker.slow_query")
+
+
+def param_shape(parameters: Any) -> str:
+    # В лог попадают только типы параметров, а не значения (названия, id пользователей)
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(v).__name__ for v in parameters) + ")"
+    return type(parameters).__name__
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "errors", "rows")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.enabled = True
+        self.slow_query_seconds = 0.0
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], Histogram] = {}
+        self._verbs: Dict[str, str] = {}
+        self._gauges: List[Tuple[str, str, Callable[[], Dict[str, float]]]] = []
+        # Строки, прочитанные из курсоров и изменённые запросами, — счётчик на поток:
+        # timed() относит разницу за вызов к функции, которая выполняла запросы
+        self._local = threading.local()
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False, rows: int = 0) -> None:
+        idx = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            hist = self._series.get((kind, name))
+            if hist is None:
+                hist = self._series[(kind, name)] = Histogram()
+            hist.counts[idx] += 1
+            hist.total += seconds
+            hist.count += 1
+            hist.rows += rows
+            if error:
+                hist.errors += 1
+
+    def add_rows(self, rows: int) -> None:
+        self._local.rows = getattr(self._local, "rows", 0) + rows
+
+    def rows_done(self) -> int:
+        return getattr(self._local, "rows", 0)
+
+    def observe_sql(self, sql: str, parameters: Any, seconds: float, error: bool = False) -> None:
+        verb = self._verbs.get(sql)
+        if verb is None:
+            # Текстов запросов в боте немного, поэтому разбор первого слова кэшируется по строке SQL
+            verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+            if len(self._verbs) < 4096:
+                self._verbs[sql] = verb
+        self.observe("sql", verb, seconds, error=error)
+        if self.slow_query_seconds and seconds >= self.slow_query_seconds:
+            slow_log.warning(
+                "медленный запрос %.1f мс: %s -- параметры %s",
+                seconds * 1000,
+                " ".join(sql.split()),
+                param_shape(parameters),
+            )
+
+    def register_gauges(self, name: str, help_text: str, collect: Callable[[], Dict[str, float]]) -> None:
+        self._gauges.append((name, help_text, collect))
+
+    def timed(self, kind: str) -> Callable[[Callable], Callable]:
+        def decorator(func: Callable) -> Callable:
+            name = func.__name__
+            if asyncio.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await func(*args, **kwargs)
+                    start = time.perf_counter()
+                    try:
+                        result = await func(*args, **kwargs)
+                    except BaseException:
+                        self.observe(kind, name, time.perf_counter() - start, error=True)
+                        raise
+                    self.observe(kind, name, time.perf_counter() - start)
+                    return result
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                rows = self.rows_done()
+                start = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException:
+                    self.observe(kind, name, time.perf_counter() - start, error=True, rows=self.rows_done() - rows)
+                    raise
+                self.observe(kind, name, time.perf_counter() - start, rows=self.rows_done() - rows)
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def snapshot(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        with self._lock:
+            return {
+                key: {"count": h.count, "sum": h.total, "errors": h.errors, "rows": h.rows}
+                for key, h in self._series.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            series = [(key, list(h.counts), h.total, h.count, h.errors, h.rows) for key, h in sorted(self._series.items())]
+        lines = [
+            "# HELP tracker_call_seconds Время обработчиков, функций данных и SQL-выражений",
+            "# TYPE tracker_call_seconds histogram",
+        ]
+        for (kind, name), counts, total, count, _, _ in series:
+            labels = f'kind="{kind}",name="{name}"'
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                lines.append(f'tracker_call_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'tracker_call_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"tracker_call_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"tracker_call_seconds_count{{{labels}}} {count}")
+        lines += ["# HELP tracker_call_errors_total Вызовы, завершившиеся исключением", "# TYPE tracker_call_errors_total counter"]
+        for (kind, name), _, _, _, errors, _ in series:
+            lines.append(f'tracker_call_errors_total{{kind="{kind}",name="{name}"}} {errors}')
+        lines += ["# HELP tracker_call_rows_total Строк прочитано и изменено SQL-запросами функций данных", "# TYPE tracker_call_rows_total counter"]
+        for (kind, name), _, _, _, _, rows in series:
+            if kind != "sql":
+                lines.append(f'tracker_call_rows_total{{kind="{kind}",name="{name}"}} {rows}')
+        for name, help_text, collect in self._gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for key, value in collect().items():
+                lines.append(f'{name}{{key="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Sequence[Any]) -> None:
+        pass
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    # Только локальный интерфейс: Prometheus забирает метрики с той же машины
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return server
+
+
+def stop_http_server(server: Optional[ThreadingHTTPServer]) -> None:
+    if server is not None:
+        server.shutdown()
+        server.server_close()
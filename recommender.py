@@ -0,0 +1,286 @@
+import math
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from catalog_io import split_genres
+
+ADVISORY_FIELDS = ["nudity", "violence", "profanity", "alcohol", "frightening"]
+ADVISORY_LEVELS = {"None": 0.0, "Mild": 1.0, "Moderate": 2.0, "Severe": 3.0}
+TOP_CERTIFICATES = 15
+# Вклад качества (рейтинг IMDB и число голосов) относительно сходства с профилем
+QUALITY_WEIGHT = 0.35
+NEUTRAL_RATE = 5.5
+# Сглаживание рейтинга: у тайтла с парой сотен голосов 9.5 значит меньше, чем 8.8 у хита
+PRIOR_VOTES = 5000
+# До этого размера каталог ранжируется целиком; выше — только по "спискам чемпионов" признаков,
+# чтобы время запроса не росло вместе с каталогом
+FULL_SCAN_LIMIT = 50_000
+CHAMPIONS_PER_FEATURE = 2000
+ACTIVE_FEATURES = 8
+# Строк матрицы признаков на один шаг заполнения: временные массивы не растут с каталогом
+FILL_CHUNK = 16384
+
+# Строка каталога для кодирования: id, name_norm, type, genre, certificate, imdb_rate, votes, *ADVISORY_FIELDS
+CatalogRow = Tuple[Any, ...]
+# Просмотр для профиля: name_norm, type, genre, certificate, user_rate
+HistoryRow = Tuple[str, Optional[str], Optional[str], Optional[str], Any]
+
+
+class _Codes:
+    # Строка -> int-код в порядке появления
+    def __init__(self) -> None:
+        self.values: List[Optional[str]] = []
+        self._codes: Dict[Optional[str], int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _CatalogColumns:
+    # Колонки каталога для CatalogVectors, по строке на тайтл. Дубликаты выгрузки схлопываются на лету
+    # в запись с наибольшим числом голосов — как _dedupe(), но без списка всех строк в памяти
+    _FIELDS = (
+        ("ids", np.int64, ()),
+        ("genre_codes", np.int32, ()),
+        ("type_codes", np.int32, ()),
+        ("certificates", np.int32, ()),
+        ("advisory", np.int8, (len(ADVISORY_FIELDS),)),
+        ("rates", np.float64, ()),
+        ("votes", np.float64, ()),
+    )
+
+    def __init__(self, capacity: int) -> None:
+        self.size = 0
+        self.positions: Dict[str, int] = {}
+        self.genres = _Codes()
+        self.types = _Codes()
+        self.certificates_seen = _Codes()
+        self._allocate(max(capacity, 1024))
+
+    def _allocate(self, capacity: int) -> None:
+        for name, dtype, shape in self._FIELDS:
+            arr = np.zeros((capacity, *shape), dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                arr[: self.size] = old[: self.size]
+            setattr(self, name, arr)
+
+    def add(self, row: CatalogRow) -> None:
+        votes = row[6] or 0
+        pos = self.positions.get(row[1])
+        if pos is None:
+            pos = self.size
+            if pos == len(self.ids):
+                self._allocate(2 * pos)
+            self.positions[row[1]] = pos
+            self.size += 1
+        elif votes <= self.votes[pos]:
+            return
+        self.ids[pos] = row[0]
+        self.genre_codes[pos] = self.genres.code(row[3]) if row[3] else -1
+        self.type_codes[pos] = self.types.code(row[2]) if row[2] else -1
+        self.certificates[pos] = self.certificates_seen.code(row[4]) if row[4] else -1
+        self.advisory[pos] = [ADVISORY_LEVELS.get(level, 0) for level in row[7:]]
+        self.rates[pos] = np.nan if row[5] is None else row[5]
+        self.votes[pos] = votes
+
+    def used(self, codes: np.ndarray, values: List[Optional[str]]) -> List[Optional[str]]:
+        # Значения, оставшиеся после схлопывания дубликатов: словарь признаков строится только по ним
+        return [values[code] for code in np.unique(codes[: self.size]) if code >= 0]
+
+
+class CatalogVectors:
+    def __init__(self, rows: Iterable[CatalogRow], size_hint: int = 0) -> None:
+        # Один проход по строкам (курсор читается построчно, без fetchall): на тайтл остаются только
+        # компактные коды в заранее выделенных массивах, матрица признаков заполняется из них по частям
+        columns = _CatalogColumns(size_hint)
+        for row in rows:
+            columns.add(row)
+        n = columns.size
+        genre_strings = columns.genres.values
+        genres = sorted({g for genre in columns.used(columns.genre_codes, genre_strings) for g in split_genres(genre)})
+        types = sorted(columns.used(columns.type_codes, columns.types.values))
+        cert_codes = columns.certificates[:n]
+        cert_counts = np.bincount(cert_codes[cert_codes >= 0], minlength=len(columns.certificates_seen.values))
+        counts = {c: int(cert_counts[i]) for i, c in enumerate(columns.certificates_seen.values) if cert_counts[i]}
+        certificates = sorted(counts, key=counts.get, reverse=True)[:TOP_CERTIFICATES]
+
+        self._genre_col = {g: i for i, g in enumerate(genres)}
+        offset = len(genres)
+        self._type_col = {t: offset + i for i, t in enumerate(types)}
+        offset += len(types)
+        self._cert_col = {c: offset + i for i, c in enumerate(certificates)}
+        offset += len(certificates)
+        self._advisory_offset = offset
+        self.dim = offset + len(ADVISORY_FIELDS)
+        rates = columns.rates[:n]
+        rated = ~np.isnan(rates)
+        self._mean_rate = sum(rates[rated].tolist()) / int(rated.sum()) if rated.any() else NEUTRAL_RATE
+        self._lock = threading.Lock()
+
+        # Таблицы "код строки -> признаки": жанровых сочетаний и рейтингов немного, строк каталога — сотни тысяч.
+        # Последняя строка таблицы жанров нулевая: код -1 (жанр не указан) попадает в неё
+        genre_table = np.zeros((len(genre_strings) + 1, len(genres)), dtype=np.float32)
+        for code, genre in enumerate(genre_strings):
+            for col, value in self._sparse(None, genre, None):
+                genre_table[code, col] = value
+        type_cols = np.array([self._type_col.get(t, -1) for t in columns.types.values] + [-1], dtype=np.int64)
+        cert_cols = np.array([self._cert_col.get(c, -1) for c in columns.certificates_seen.values] + [-1], dtype=np.int64)
+        advisory_values = (np.arange(4, dtype=np.float64) / 3 * 0.3).astype(np.float32)
+
+        features = np.zeros((n, self.dim), dtype=np.float32)
+        for start in range(0, n, FILL_CHUNK):
+            stop = min(start + FILL_CHUNK, n)
+            block = features[start:stop]
+            block[:, : len(genres)] = genre_table[columns.genre_codes[start:stop]]
+            local = np.arange(stop - start)
+            for codes, cols in ((columns.type_codes, type_cols), (columns.certificates, cert_cols)):
+                col = cols[codes[start:stop]]
+                hit = col >= 0
+                block[local[hit], col[hit]] = 0.5
+            block[:, offset:] = advisory_values[columns.advisory[start:stop]]
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            np.divide(block, norms, out=block, where=norms > 0)
+
+        self.positions = columns.positions
+        votes = columns.votes[:n]
+        quality = np.where(
+            rated,
+            (votes * np.nan_to_num(rates) + PRIOR_VOTES * self._mean_rate) / (votes + PRIOR_VOTES) / 10,
+            self._mean_rate / 10 - 0.1,
+        ).astype(np.float32)
+        ids = columns.ids[:n].copy()
+        # Массивы меняются только целиком одной ссылкой, чтобы читатели не видели их вразнобой
+        self._arrays = (features, quality, ids)
+        self._champions = self._build_champions(features, quality)
+
+    def __len__(self) -> int:
+        return len(self._arrays[2])
+
+    def _build_champions(self, features: np.ndarray, quality: np.ndarray) -> List[np.ndarray]:
+        # Для каждого признака — лучшие по вкладу тайтлы, последний список — лучшие по качеству вообще
+        if len(quality) <= FULL_SCAN_LIMIT:
+            return []
+        champions = []
+        for col in range(self.dim):
+            impact = features[:, col] * (1 + QUALITY_WEIGHT * quality)
+            nonzero = np.flatnonzero(impact > 0)
+            if len(nonzero) > CHAMPIONS_PER_FEATURE:
+                nonzero = nonzero[np.argpartition(-impact[nonzero], CHAMPIONS_PER_FEATURE - 1)[:CHAMPIONS_PER_FEATURE]]
+            champions.append(nonzero)
+        champions.append(np.argpartition(-quality, CHAMPIONS_PER_FEATURE - 1)[:CHAMPIONS_PER_FEATURE])
+        return champions
+
+    @staticmethod
+    def _dedupe(rows: Iterable[CatalogRow]) -> List[CatalogRow]:
+        # Дубликаты выгрузки схлопываем в запись с наибольшим числом голосов
+        best: Dict[str, CatalogRow] = {}
+        for row in rows:
+            current = best.get(row[1])
+            if current is None or (row[6] or 0) > (current[6] or 0):
+                best[row[1]] = row
+        return list(best.values())
+
+    def _quality(self, imdb_rate: Optional[float], votes: Optional[int]) -> float:
+        if imdb_rate is None:
+            return self._mean_rate / 10 - 0.1
+        votes = votes or 0
+        return (votes * imdb_rate + PRIOR_VOTES * self._mean_rate) / (votes + PRIOR_VOTES) / 10
+
+    def _sparse(
+        self,
+        content_type: Optional[str],
+        genre: Optional[str],
+        certificate: Optional[str],
+        advisory: Sequence[Optional[str]] = (),
+    ) -> List[Tuple[int, float]]:
+        cells = []
+        genre_cols = [self._genre_col[g] for g in split_genres(genre) if g in self._genre_col]
+        for col in genre_cols:
+            cells.append((col, 1.0 / math.sqrt(len(genre_cols))))
+        if content_type in self._type_col:
+            cells.append((self._type_col[content_type], 0.5))
+        if certificate in self._cert_col:
+            cells.append((self._cert_col[certificate], 0.5))
+        for i, level in enumerate(advisory):
+            if level in ADVISORY_LEVELS and ADVISORY_LEVELS[level]:
+                cells.append((self._advisory_offset + i, ADVISORY_LEVELS[level] / 3 * 0.3))
+        return cells
+
+    def encode(
+        self,
+        content_type: Optional[str],
+        genre: Optional[str],
+        certificate: Optional[str],
+        advisory: Sequence[Optional[str]] = (),
+    ) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for col, value in self._sparse(content_type, genre, certificate, advisory):
+            vec[col] = value
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def extend(self, rows: Iterable[CatalogRow]) -> None:
+        # Пачка новых записей одной склейкой массивов, а не копия матрицы на каждую запись
+        with self._lock:
+            rows = [row for row in self._dedupe(rows) if row[1] not in self.positions]
+            if not rows:
+                return
+            features, quality, ids = self._arrays
+            added = np.vstack([self.encode(row[2], row[3], row[4], row[7:]) for row in rows])
+            self._arrays = (
+                np.vstack([features, added]),
+                np.concatenate([quality, np.array([self._quality(row[5], row[6]) for row in rows], dtype=np.float32)]),
+                np.concatenate([ids, np.array([row[0] for row in rows], dtype=np.int64)]),
+            )
+            for i, row in enumerate(rows):
+                self.positions[row[1]] = len(ids) + i
+            if self._champions:
+                positions = np.arange(len(ids), len(ids) + len(rows))
+                for col in range(self.dim):
+                    hit = positions[added[:, col] > 0]
+                    if len(hit):
+                        self._champions[col] = np.concatenate([self._champions[col], hit])
+                self._champions[-1] = np.concatenate([self._champions[-1], positions])
+
+    def profile(self, history: Iterable[HistoryRow]) -> np.ndarray:
+        # Оценка 1-10 превращается в вес [-1, 1]: понравившееся тянет профиль к себе, остальное отталкивает
+        features = self._arrays[0]
+        profile = np.zeros(self.dim, dtype=np.float32)
+        total = 0.0
+        for name_norm, content_type, genre, certificate, user_rate in history:
+            rate = float(user_rate) if user_rate is not None else NEUTRAL_RATE + 1
+            weight = (rate - NEUTRAL_RATE) / 4.5
+            pos = self.positions.get(name_norm)
+            vec = features[pos] if pos is not None else self.encode(content_type, genre, certificate)
+            profile += weight * vec
+            total += abs(weight)
+        return profile / total if total else profile
+
+    def top_k(self, profile: np.ndarray, exclude: Iterable[str], k: int) -> List[int]:
+        features, quality, ids = self._arrays
+        n = len(ids)
+        champions = self._champions
+        if champions:
+            active = [col for col in np.argsort(-profile)[:ACTIVE_FEATURES] if profile[col] > 0]
+            candidates = np.unique(np.concatenate([champions[col] for col in active] + [champions[-1]]))
+            candidates = candidates[candidates < n]
+        else:
+            candidates = np.arange(n)
+        # Один матрично-векторный проход по кандидатам (для небольшого каталога — по всему каталогу)
+        scores = features[candidates] @ profile + QUALITY_WEIGHT * quality[candidates]
+        excluded = {pos for pos in (self.positions.get(name) for name in exclude) if pos is not None and pos < n}
+        if excluded:
+            scores[np.isin(candidates, list(excluded))] = -np.inf
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return ids[candidates[top]].tolist()
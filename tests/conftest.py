@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    # Своя пустая база на тест; пулы потоков общие на процесс, поэтому закрываем только соединения
+    monkeypatch.setattr(bot, "DB_PATH", str(tmp_path / "tracker.db"))
+    monkeypatch.setattr(bot, "CATALOG_CSV", str(tmp_path / "imdb.csv"))
+    monkeypatch.setattr(bot, "CATALOG_CACHE", "")
+    bot.init_db()
+    yield bot.DB_PATH
+    bot.db.close_all()
+    bot.reset_title_index()
+    bot.reset_catalog_snapshot()
+    bot.reset_catalog_vectors()
+    bot._recommendation_cache.clear()
+    bot._title_cache.clear()
+    bot.response_cache.clear()
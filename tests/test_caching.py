@@ -0,0 +1,29 @@
+from caching import ResponseCache, TTLCache
+
+
+def test_key_versions_stay_bounded_and_reject_stale_values():
+    cache = TTLCache(maxsize=8, ttl=60)
+    cache.set("kept", 1)
+    token = cache.token("stale")
+    for user_id in range(100):
+        cache.invalidate(user_id)
+    assert len(cache._key_epochs) <= 8
+    cache.invalidate("stale")
+    cache.set("stale", "old", token=token)
+    assert cache.get("stale") is None and cache.get("kept") == 1
+
+
+def test_generations_stay_bounded_and_reject_stale_responses():
+    cache = ResponseCache(max_bytes=1 << 20)
+    cache.get_or_render(1, "stats", lambda user_id: "cached")
+    _, stale = cache.get(2, "stats")
+    for user_id in range(2, 5000):
+        cache.bump(user_id)
+    assert len(cache._generations) <= 1024
+    # Ответ для 2, посчитанный до его нового просмотра, не попадает в кэш и после сброса поколений
+    cache.put(2, "stats", "old", stale)
+    assert cache.get(2, "stats")[0] is None
+    assert cache.get(1, "stats")[0] == "cached"
+    _, current = cache.get(2, "stats")
+    cache.put(2, "stats", "new", current)
+    assert cache.get(2, "stats")[0] == "new"
@@ -0,0 +1,66 @@
+import pytest
+
+import bot
+from bench import write_synthetic_catalog
+
+TITLES = 300
+USER_TITLE = {"name": "Наш домашний фильм", "type": "Film", "genre": "Drama", "certificate": "", "imdb_rate": None}
+
+
+def catalog_count() -> int:
+    return bot.get_conn().execute("SELECT COUNT(*) FROM catalog").fetchone()[0]
+
+
+def interrupted_import(monkeypatch, path: str, replace: bool) -> None:
+    # Процесс "падает" на втором чанке: первый уже зафиксирован
+    rows = bot.catalog_rows
+    calls = []
+
+    def failing(chunk):
+        calls.append(1)
+        if len(calls) > 1:
+            raise KeyboardInterrupt
+        return rows(chunk)
+
+    with monkeypatch.context() as m:
+        m.setattr(bot, "catalog_rows", failing)
+        with pytest.raises(KeyboardInterrupt):
+            bot.import_catalog(path, replace=replace, chunksize=100)
+
+
+def in_catalog(names) -> bool:
+    snapshot = bot.catalog_snapshot()
+    return all(snapshot.find(bot.normalize_title(name)) is not None for name in names)
+
+
+def test_titles_added_before_csv_are_kept(db_path):
+    bot.load_catalog_if_empty()
+    bot.insert_catalog_entry(USER_TITLE)
+    names = write_synthetic_catalog(bot.CATALOG_CSV, TITLES)
+    assert not bot.is_warm_start()
+    bot.load_catalog_if_empty()
+    assert in_catalog(names + [USER_TITLE["name"]])
+    assert bot.is_warm_start()
+
+
+def test_interrupted_replace_is_reloaded(db_path, monkeypatch):
+    write_synthetic_catalog(bot.CATALOG_CSV, TITLES)
+    interrupted_import(monkeypatch, bot.CATALOG_CSV, replace=True)
+    assert catalog_count() == 100
+    assert not bot.is_warm_start()
+    bot.load_catalog_if_empty()
+    assert catalog_count() == TITLES
+    assert bot.is_warm_start()
+
+
+def test_interrupted_upsert_keeps_rows(db_path, monkeypatch, tmp_path):
+    bot.insert_catalog_entry(USER_TITLE)
+    extra = str(tmp_path / "extra.csv")
+    names = write_synthetic_catalog(extra, TITLES)
+    interrupted_import(monkeypatch, extra, replace=False)
+    imdb = write_synthetic_catalog(bot.CATALOG_CSV, 50, seed=7)
+    bot.load_catalog_if_empty()
+    # Прерванный upsert дописан из своего файла, а imdb.csv каталог не заменил
+    assert in_catalog(names + [USER_TITLE["name"]])
+    assert not any(in_catalog([name]) for name in set(imdb) - set(names))
+    assert bot.is_warm_start()
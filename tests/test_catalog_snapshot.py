@@ -0,0 +1,19 @@
+from catalog_snapshot import CatalogSnapshot
+
+DUNE = (1, "Dune", "dune", "Film", "Sci-Fi", "PG-13", 8.0, 100, None)
+ARRIVAL = (2, "Arrival", "arrival", "Film", "Drama", "PG-13", 7.9, 90, None)
+HEAT = (3, "Heat", "heat", "Series", "Crime", "R", 8.3, 80, 10)
+
+
+def test_new_snapshot_leaves_the_old_one_intact():
+    old = CatalogSnapshot.from_rows([DUNE])
+    one = old.with_entry(ARRIVAL)
+    many = old.with_entries([ARRIVAL, HEAT])
+    assert len(old) == 1 and old.find("arrival") is None and old.find("heat") is None
+    assert old._names == ["Dune"] and old._categories["type"].values == ["Film"]
+    assert one.find("arrival").name == "Arrival" and one.find("heat") is None
+    assert many.find("heat").type == "Series" and many.find("heat").episodes == 10
+    # Снимок, в который уже дописывали, можно продолжить снова: ветки не видят записей друг друга
+    other = old.with_entry(HEAT)
+    assert one.find("heat") is None and other.find("arrival") is None
+    assert [record.name for record in other.records([1, 2, 3])] == ["Dune", "Heat"]
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+import bot
+from bench import StubBotAPI, UpdateFeed
+
+VIEW = {
+    "name": "Dune",
+    "type": "Film",
+    "genre": "Sci-Fi",
+    "certificate": "PG-13",
+    "imdb_rate": 8.0,
+    "user_rate": 9,
+    "view_date": "2024-05-01",
+    "duration_minutes": 155,
+}
+
+
+def test_application_processes_updates_concurrently(db_path):
+    application = bot.build_application("123456:TEST")
+    assert application.concurrent_updates == bot.CONCURRENT_UPDATES > 1
+    assert isinstance(application.update_processor, bot.UserUpdateProcessor)
+
+
+def test_slow_update_does_not_block_other_users(db_path, monkeypatch):
+    bot.insert_view(2, VIEW)
+    release = threading.Event()
+
+    def slow_recommendations(user_id, limit=5):
+        release.wait(10)
+        return []
+
+    monkeypatch.setattr(bot, "recommendations", slow_recommendations)
+
+    async def scenario(stub):
+        async with UpdateFeed(stub) as feed:
+            slow = feed.put(1, "/recommend")
+            try:
+                await asyncio.wait_for(feed.send(2, "/stats"), timeout=5)
+                assert not slow.done()
+            finally:
+                release.set()
+            await slow
+
+    stub = StubBotAPI()
+    asyncio.run(scenario(stub))
+    assert stub.last_text[2].startswith("По типам")
+    assert stub.last_text[1].startswith("Нужно больше данных")
+
+
+def test_conversations_keep_order_when_updates_overlap(db_path):
+    bot.insert_catalog_entry({"name": "Dune", "type": "Film", "genre": "Sci-Fi", "certificate": "PG-13", "imdb_rate": 8.0})
+    history = b"name,user_rate,view_date\nDune,7,2024-02-03\nArrival,8,2024-02-04\n"
+
+    async def scenario(stub):
+        async with UpdateFeed(stub) as feed:
+            # Все апдейты обоих диалогов в очереди сразу, не дожидаясь ответов
+            document = {"file_id": "h.csv", "file_unique_id": "h.csv", "file_name": "h.csv", "file_size": len(history)}
+            pending = [
+                feed.put(1, "/add"),
+                feed.put(2, "/import"),
+                feed.put(1, "dune"),
+                feed.put(2, "сейчас пришлю"),
+                feed.put(1, "9"),
+                feed.put(2, document=document),
+                feed.put(1, "2024-05-01"),
+                feed.put(1, "155"),
+            ]
+            await asyncio.gather(*pending)
+
+    stub = StubBotAPI()
+    stub.files["h.csv"] = history
+    asyncio.run(scenario(stub))
+    assert stub.last_text[1] == "Добавил в дневник! Что дальше?"
+    [view] = bot.get_last_views(1)
+    assert (view["name"], view["user_rate"], view["view_date"], view["duration_minutes"]) == ("Dune", 9, "2024-05-01", 155)
+    assert stub.last_text[2].startswith("Импортировано просмотров: 2")
+    assert [v["name"] for v in bot.get_last_views(2)] == ["Arrival", "Dune"]
+    assert bot.check_user_stats() == 0
@@ -0,0 +1,35 @@
+import sqlite3
+
+import pytest
+
+import bot
+from metrics import metrics
+
+VIEW = {"name": "Dune", "type": "Film", "genre": "Sci-Fi", "certificate": "PG-13", "imdb_rate": 8.0, "user_rate": 9}
+
+
+def test_failed_sql_is_recorded_as_error(db_path):
+    metrics.reset()
+    with pytest.raises(sqlite3.OperationalError):
+        bot.get_conn().execute("SELECT * FROM missing_table")
+    bot.get_conn().execute("SELECT 1").fetchone()
+    assert metrics.snapshot()[("sql", "SELECT")]["count"] == 2
+    assert metrics.snapshot()[("sql", "SELECT")]["errors"] == 1
+
+
+def test_rows_are_counted_from_the_cursor(db_path):
+    for day in range(1, 4):
+        bot.insert_view(1, dict(VIEW, view_date=f"2024-05-0{day}", duration_minutes=155))
+    bot.insert_catalog_entry(VIEW)
+    bot.catalog_snapshot()
+    bot.title_index()
+    metrics.reset()
+    bot.get_last_views(1, limit=2)
+    assert bot.find_in_catalog("Dune").name == "Dune"
+    rows = metrics.rows_done()
+    assert sum(1 for _ in bot.get_conn().execute("SELECT id FROM views")) == 3
+    assert metrics.rows_done() - rows == 3
+    series = metrics.snapshot()
+    assert series[("data", "get_last_views")]["rows"] == 2
+    # Запись из снимка каталога в памяти: база не читается, а не "одна строка" по len() результата
+    assert series[("data", "find_in_catalog")]["rows"] == 0
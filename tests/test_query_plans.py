@@ -0,0 +1,47 @@
+import pytest
+
+import bot
+from bench import hot_queries, setup_db
+
+QUERIES = hot_queries(1)
+# Таблицы пользователя: полный проход по ним растёт со всей базой, а не с историей одного пользователя
+USER_TABLES = ("views", "view_genres", "user_stats")
+
+
+@pytest.fixture
+def plans_db(db_path):
+    setup_db(db_path, 20, 200)
+    return db_path
+
+
+def query_plans(func, args) -> list:
+    conn = bot.get_conn()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        func(*args)
+    finally:
+        conn.set_trace_callback(None)
+    return [
+        (sql, [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)])
+        for sql in statements
+        if sql.lstrip().upper().startswith("SELECT")
+    ]
+
+
+@pytest.mark.parametrize("name, func, args", QUERIES, ids=[name for name, _, _ in QUERIES])
+def test_hot_query_does_not_scan_user_tables(plans_db, name, func, args):
+    for sql, plan in query_plans(func, args):
+        scans = [step for step in plan if step.startswith(tuple(f"SCAN {table}" for table in USER_TABLES))]
+        assert not scans, f"{name}: {' '.join(sql.split())}\n{plan}"
+
+
+def test_every_user_table_index_is_used(plans_db):
+    # Индекс, которого нет ни в одном плане, только замедляет запись (см. миграцию 11)
+    used = " ".join(step for _, func, args in QUERIES for _, plan in query_plans(func, args) for step in plan)
+    indexes = [
+        name
+        for name, table in bot.get_conn().execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'")
+        if table in USER_TABLES and not name.startswith("sqlite_autoindex")
+    ]
+    assert indexes and [name for name in indexes if f"INDEX {name} " not in used + " "] == []
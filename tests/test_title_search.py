@@ -0,0 +1,38 @@
+import bot
+from bench import write_synthetic_catalog
+from title_search import TitleIndex
+
+
+def test_better_rate_of_known_title_changes_ranking():
+    index = TitleIndex()
+    # Триграммы по словам не зависят от порядка слов: обе записи набирают одинаковый score
+    index.add_many([(1, "star wars", 6.0), (2, "wars star", 7.0)])
+    assert index.search("wars", limit=2) == [2, 1]
+    index.add_many([(3, "star wars", 8.5)])
+    assert len(index) == 2
+    assert index.search("wars", limit=2) == [3, 2]
+    assert index.containing("star wars") == [3]
+
+
+def test_search_keeps_its_view_while_titles_are_added():
+    index = TitleIndex()
+    index.add_many([(1, "dune", 8.0)])
+    arrays = index._arrays
+    index.add_many([(2, "dune part two", 8.5), (3, "dune", 9.0)])
+    assert arrays[0].tolist() == [1] and arrays[1] == ["dune"]
+    assert index.search("dune", limit=2) == [3, 2]
+
+
+def test_import_marks_only_close_titles_ambiguous(db_path):
+    write_synthetic_catalog(bot.CATALOG_CSV, 300)
+    bot.load_catalog_if_empty()
+    for name in ["Unknown", "Game of Thrones", "Star Wars", "Interstellar"]:
+        bot.insert_catalog_entry({"name": name, "type": "Film", "genre": "Drama", "certificate": "", "imdb_rate": 8.0})
+    matches = bot.match_titles(["Interstellar", "Game of Throns", "War", "Totally Unknown Zzz", "Наш домашний фильм"])
+    assert {pattern: status for pattern, (status, _) in matches.items()} == {
+        "interstellar": "matched",
+        "game of throns": "ambiguous",
+        "war": "ambiguous",
+        "totally unknown zzz": "new",
+        "наш домашний фильм": "new",
+    }
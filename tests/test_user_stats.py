@@ -0,0 +1,29 @@
+import bot
+from bench import setup_db
+
+VIEW = {"name": "Dune", "type": "Film", "genre": "Sci-Fi, Drama", "certificate": "PG-13", "imdb_rate": 8.0}
+
+
+def test_incremental_stats_match_full_recount(db_path):
+    setup_db(db_path, 5, 50)
+    assert bot.check_user_stats() == 0
+    bot.insert_view(1, dict(VIEW, user_rate=9, view_date="2024-05-01", duration_minutes=155))
+    bot.insert_view(7, dict(VIEW, user_rate=None, view_date="2024-05-02", duration_minutes=None))
+    history = b"name,user_rate,view_date\nDune,7,2024-02-03\nArrival,8,2024-02-04\n"
+    entries, _, matches = bot.prepare_import(history, "h.csv")
+    bot.import_views(2, entries, matches)
+    assert bot.check_user_stats() == 0
+
+
+def test_check_finds_drift_and_rebuild_fixes_it(db_path):
+    setup_db(db_path, 5, 50)
+    conn = bot.get_conn()
+    conn.execute(
+        "UPDATE user_stats SET views = views + 1 "
+        "WHERE (user_id, type, genre, day) = (SELECT user_id, type, genre, day FROM user_stats LIMIT 1)"
+    )
+    conn.execute("DELETE FROM user_totals WHERE user_id = 3")
+    conn.commit()
+    assert bot.check_user_stats() > 1
+    bot.rebuild_user_stats()
+    assert bot.check_user_stats() == 0
@@ -0,0 +1,183 @@
+import heapq
+import math
+import threading
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Минимальная доля веса запроса, которую должны покрыть триграммы названия
+MIN_COVERAGE = 0.36
+EMPTY = np.zeros(0, dtype=np.int32)
+
+# Триграмма -> отсортированные позиции названий
+Postings = Dict[str, np.ndarray]
+
+
+def word_trigrams(text: str) -> Set[str]:
+    # Триграммы считаются по словам, поэтому порядок слов в запросе не важен
+    grams: Set[str] = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def substring_trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class TitleIndex:
+    # Поиск идёт без замка: add_many() под замком собирает новые массивы и подменяет их одной ссылкой,
+    # как CatalogVectors, а старые остаются целыми у тех, кто их уже читает.
+    # Позиции по триграммам — int32-массивы: 4 байта на вхождение вместо питоновского int в списке
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # name_norm -> позиция; читает и пишет только add_many() под замком
+        self._positions: Dict[str, int] = {}
+        # ids, названия, рейтинги, число триграмм названия, позиции по словарным и по сплошным триграммам
+        self._arrays: Tuple[np.ndarray, List[str], np.ndarray, np.ndarray, Postings, Postings] = (
+            np.zeros(0, dtype=np.int64),
+            [],
+            np.zeros(0),
+            np.zeros(0),
+            {},
+            {},
+        )
+
+    def __len__(self) -> int:
+        return len(self._arrays[0])
+
+    def add_many(self, rows: Iterable[Tuple[int, str, Optional[float]]]) -> None:
+        with self._lock:
+            ids, names, rates, gram_counts, postings, substring_postings = self._arrays
+            start = len(ids)
+            new_ids = array("q")
+            new_rates = array("d")
+            new_counts = array("i")
+            new_names: List[str] = []
+            new_positions: Dict[str, int] = {}
+            updates: Dict[int, Tuple[int, float]] = {}
+            added: Dict[str, array] = defaultdict(lambda: array("i"))
+            added_substrings: Dict[str, array] = defaultdict(lambda: array("i"))
+            for row_id, name_norm, imdb_rate in rows:
+                name_norm = name_norm or ""
+                rate = float(imdb_rate) if imdb_rate is not None else -1.0
+                pos = self._positions.get(name_norm)
+                if pos is None:
+                    pos = new_positions.get(name_norm)
+                if pos is not None:
+                    # Дубликаты названия схлопываем в запись с лучшим рейтингом
+                    if pos >= start:
+                        if rate > new_rates[pos - start]:
+                            new_ids[pos - start] = row_id
+                            new_rates[pos - start] = rate
+                    elif rate > updates.get(pos, (0, rates[pos]))[1]:
+                        updates[pos] = (row_id, rate)
+                    continue
+                pos = start + len(new_ids)
+                grams = word_trigrams(name_norm)
+                new_ids.append(row_id)
+                new_names.append(name_norm)
+                new_rates.append(rate)
+                new_counts.append(len(grams))
+                new_positions[name_norm] = pos
+                for gram in grams:
+                    added[gram].append(pos)
+                for gram in substring_trigrams(name_norm):
+                    added_substrings[gram].append(pos)
+            if not new_ids and not updates:
+                return
+            # concatenate всегда даёт новый массив, поэтому обновление рейтинга не задевает прежний
+            ids = np.concatenate([ids, np.frombuffer(new_ids, dtype=np.int64)]) if new_ids else ids.copy()
+            rates = np.concatenate([rates, np.frombuffer(new_rates, dtype=np.float64)]) if new_rates else rates.copy()
+            for pos, (row_id, rate) in updates.items():
+                ids[pos] = row_id
+                rates[pos] = rate
+            self._arrays = (
+                ids,
+                names + new_names if new_names else names,
+                rates,
+                np.concatenate([gram_counts, np.array(new_counts, dtype=np.float64)]),
+                self._merge(postings, added),
+                self._merge(substring_postings, added_substrings),
+            )
+            self._positions.update(new_positions)
+
+    @staticmethod
+    def _merge(postings: Postings, added: Dict[str, array]) -> Postings:
+        # Новые позиции больше всех прежних, поэтому склейка оставляет массивы отсортированными
+        if not added:
+            return postings
+        merged = dict(postings)
+        for gram in list(added):
+            positions = np.frombuffer(added.pop(gram), dtype=np.int32).copy()
+            current = merged.get(gram)
+            merged[gram] = positions if current is None else np.concatenate([current, positions])
+        return merged
+
+    @staticmethod
+    def _containing_positions(arrays: tuple, query: str, limit: int) -> List[int]:
+        # Аналог LIKE '%query%': берём самый короткий список триграмм и проверяем подстроку
+        _, names, rates, _, _, substring_postings = arrays
+        if len(query) < 3:
+            candidates: Iterable[int] = range(len(names))
+        else:
+            candidates = min(
+                (substring_postings.get(gram, EMPTY) for gram in substring_trigrams(query)),
+                key=len,
+            ).tolist()
+        hits = [pos for pos in candidates if query in names[pos]]
+        return heapq.nlargest(limit, hits, key=lambda pos: rates[pos])
+
+    def containing(self, query: str, limit: int = 1) -> List[int]:
+        arrays = self._arrays
+        return [int(arrays[0][pos]) for pos in self._containing_positions(arrays, query, limit)]
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0.45) -> List[int]:
+        arrays = self._arrays
+        ids, _, rates, gram_counts, postings, _ = arrays
+        query_grams = sorted(word_trigrams(query), key=lambda g: len(postings.get(g, EMPTY)))
+        if not query_grams:
+            return []
+        q = len(query_grams)
+        total = len(ids) + 1
+        # Вес граммы — её редкость (idf): "the" почти ничего не говорит о названии
+        weights = [math.log(total / (len(postings.get(g, EMPTY)) + 1)) + 0.1 for g in query_grams]
+        query_weight = sum(weights)
+        # Префиксная фильтрация: кандидат, которого нет ни в одном из самых редких списков,
+        # наберёт не больше веса оставшихся грамм, а этого мало для MIN_COVERAGE
+        probe = []
+        remaining = query_weight
+        for gram, weight in zip(query_grams, weights):
+            if remaining < MIN_COVERAGE * query_weight:
+                break
+            probe.append(postings.get(gram, EMPTY))
+            remaining -= weight
+        contained = self._containing_positions(arrays, query, limit)
+        candidates = np.unique(np.concatenate(probe + [np.array(contained, dtype=np.int32)]))
+        if not len(candidates):
+            return []
+        counts = np.zeros(len(candidates), dtype=np.float64)
+        coverage = np.zeros(len(candidates), dtype=np.float64)
+        for gram, weight in zip(query_grams, weights):
+            arr = postings.get(gram, EMPTY)
+            if len(arr):
+                idx = np.minimum(np.searchsorted(arr, candidates), len(arr) - 1)
+                hit = arr[idx] == candidates
+                counts += hit
+                coverage += hit * (weight / query_weight)
+        dice = 2 * counts / (q + gram_counts[candidates])
+        # Покрытие запроса поднимает длинные названия, содержащие все слова запроса
+        score = (dice + coverage) / 2
+        score[coverage < MIN_COVERAGE] = 0.0
+        if contained:
+            score[np.isin(candidates, contained)] += 1.0
+        top = np.flatnonzero(score >= min_score)
+        if len(top) > limit:
+            # Оставляем limit лучших вместе с равными им по score, порядок доуточняет рейтинг
+            kth = np.partition(score[top], len(top) - limit)[len(top) - limit]
+            top = top[score[top] >= kth]
+        order = np.lexsort((-rates[candidates[top]], -score[top]))[:limit]
+        return ids[candidates[top[order]]].tolist()
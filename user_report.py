@@ -0,0 +1,75 @@
+import io
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+# Модуль без pandas: его импортирует бот, а matplotlib загружается только в процессе отрисовки
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+REPORT_FIGSIZE = (12, 9)
+REPORT_DPI = 90
+REPORT_WEEKS = 26
+REPORT_GENRES = 10
+
+
+def plot_user_report(data: Dict[str, Any], fig: Optional["Figure"] = None) -> "Figure":
+    # data — результат bot.user_report_data(): уже агрегированные SQL-запросом ряды
+    if fig is None:
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=REPORT_FIGSIZE)
+    (rates_ax, genres_ax), (weeks_ax, imdb_ax) = fig.subplots(2, 2)
+
+    rates = dict(data["ratings"])
+    values = list(range(1, 11))
+    rates_ax.bar(values, [rates.get(v, 0) for v in values], color="skyblue", edgecolor="black", alpha=0.8)
+    rates_ax.set_xticks(values)
+    rates_ax.set_xlabel("Моя оценка")
+    rates_ax.set_ylabel("Просмотров")
+    rates_ax.set_title("Распределение оценок", fontweight="bold")
+    rates_ax.grid(True, alpha=0.3)
+
+    genres = data["genres"][::-1]
+    if genres:
+        genres_ax.barh([g[0] for g in genres], [g[1] for g in genres], color="steelblue", alpha=0.7)
+        for i, (_, count, avg) in enumerate(genres):
+            if avg is not None:
+                genres_ax.text(count, i, f" {avg:.1f}", va="center", fontsize=9)
+    genres_ax.set_xlabel("Просмотров (справа — средняя оценка)")
+    genres_ax.set_title(f"Топ-{REPORT_GENRES} жанров", fontweight="bold")
+    genres_ax.grid(True, alpha=0.3)
+
+    weeks = data["weeks"]
+    if weeks:
+        weeks_ax.bar(range(len(weeks)), [w[1] for w in weeks], color="coral", alpha=0.7)
+        step = max(1, len(weeks) // 6)
+        weeks_ax.set_xticks(range(0, len(weeks), step))
+        weeks_ax.set_xticklabels([w[0] for w in weeks][::step], rotation=30, fontsize=8)
+    weeks_ax.set_ylabel("Минут")
+    weeks_ax.set_title(f"Минуты по неделям (последние {REPORT_WEEKS})", fontweight="bold")
+    weeks_ax.grid(True, alpha=0.3)
+
+    pairs = data["imdb_vs_user"]
+    if pairs:
+        # Точки сгруппированы в SQL по округлённым оценкам: размер — доля просмотров в самой частой паре
+        top = max(p[2] for p in pairs)
+        imdb_ax.scatter(
+            [p[0] for p in pairs], [p[1] for p in pairs], s=[20 + 400 * p[2] / top for p in pairs], alpha=0.5, c="purple"
+        )
+    imdb_ax.plot([1, 10], [1, 10], "r--", alpha=0.6, linewidth=1.5)
+    imdb_ax.set_xlim(0.5, 10.5)
+    imdb_ax.set_ylim(0.5, 10.5)
+    imdb_ax.set_xlabel("Рейтинг IMDB")
+    imdb_ax.set_ylabel("Моя оценка")
+    imdb_ax.set_title("Моя оценка vs IMDB", fontweight="bold")
+    imdb_ax.grid(True, alpha=0.3)
+
+    fig.suptitle("МОЙ ДНЕВНИК ПРОСМОТРОВ", fontsize=14, fontweight="bold")
+    fig.tight_layout()
+    return fig
+
+
+def render_user_report(data: Dict[str, Any]) -> bytes:
+    # Выполняется в отдельном процессе: отрисовка не держит ни цикл событий, ни потоки чтения базы
+    buffer = io.BytesIO()
+    plot_user_report(data).savefig(buffer, format="png", dpi=REPORT_DPI)
+    return buffer.getvalue()